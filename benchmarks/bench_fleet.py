@@ -0,0 +1,75 @@
+"""
+Car physics benchmark: one CarPhysics object per car against one CarFleet for all of them.
+
+Run from the repository root:
+    python benchmarks/bench_fleet.py
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+import pyglet
+
+pyglet.options["shadow_window"] = False
+
+from car_physics import CarControls
+from car_fleet import CarFleet
+from main_utils import load_sprite_data
+from race_runner import load_track_mask, create_car
+from tree_grid import TreeGrid, place_trees, map_tree_seed, TREE_COUNT
+
+CAR_COUNTS = (1, 5, 20, 50, 200)
+TICKS = 300
+DT = 1 / 60
+MAP_NAME = "track"
+
+
+def place_cars(count, spawn_point):
+    cars = [create_car("car") for _ in range(count)]
+    for i, car in enumerate(cars):
+        car.x = spawn_point[0] + i % 5 * 30
+        car.y = spawn_point[1] + i // 5 * 5
+        car.direction = -180
+    return cars
+
+
+def measure_objects(cars, track, trees):
+    controls = CarControls(True, False, False, True)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # CarPhysics announces every lap start
+        for _ in range(TICKS):
+            for car in cars:
+                car.step(DT, controls, track, trees)
+    return (time.perf_counter() - start) / TICKS
+
+
+def measure_fleet(cars, track, trees):
+    fleet = CarFleet(cars)
+    count = len(cars)
+    controls = CarControls(np.ones(count, bool), np.zeros(count, bool), np.zeros(count, bool), np.ones(count, bool))
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        fleet.step(DT, controls, track, trees)
+    return (time.perf_counter() - start) / TICKS
+
+
+def main():
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    track = load_track_mask(MAP_NAME)
+    trees = TreeGrid(place_trees(TREE_COUNT, track, map_tree_seed(MAP_NAME)))
+    spawn_point = load_sprite_data(1)[MAP_NAME]["spawn_point"]
+
+    print(f"{'cars':>6} {'objects ms':>12} {'fleet ms':>10}")
+    for count in CAR_COUNTS:
+        objects_time = measure_objects(place_cars(count, spawn_point), track, trees)
+        fleet_time = measure_fleet(place_cars(count, spawn_point), track, trees)
+        print(f"{count:>6} {objects_time * 1000:>12.3f} {fleet_time * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
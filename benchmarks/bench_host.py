@@ -0,0 +1,143 @@
+"""
+Time trial host over loopback: one race_host.RaceHost with hundreds of
+lan_client.RaceClients on 127.0.0.1, spread over every map. The clients and
+the host's event loop take turns in one thread, one tick each, so the
+numbers are per simulated second and do not depend on scheduling. Reports
+the host's CPU time per tick, how many races one core could keep at the
+tick rate, the time of the fleet steps every tick shares and the own work
+of a single race, and checks that every snapshot a client decoded is
+exactly what the host sent its race.
+
+Run from the repository root:
+    python benchmarks/bench_host.py
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+import pyglet
+
+pyglet.options["shadow_window"] = False
+
+from car_physics import CarControls
+from main_utils import load_sprite_data
+from race_host import RaceHost
+from lan_client import RaceClient
+
+SESSION_COUNTS = (100, 300, 1000)
+TICK_RATE = 60
+SNAPSHOT_RATE = 20
+SECONDS = 5
+JOIN_THREADS = 50
+
+
+def pump(loop):
+    """Lets the event loop read whatever packets are waiting."""
+    loop.run_until_complete(asyncio.sleep(0))
+
+
+def join(host, loop, map_names, count):
+    """Clients join from threads, the host's event loop answers them from this one."""
+    clients = [None] * count
+
+    def connect(first):
+        for i in range(first, count, JOIN_THREADS):
+            clients[i] = RaceClient(host.address, car_index=i % 2, map_name=map_names[i % len(map_names)], timeout=10.0)
+
+    threads = [threading.Thread(target=connect, args=(i,)) for i in range(min(JOIN_THREADS, count))]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        pump(loop)
+        time.sleep(0.001)
+    if None in clients:
+        raise RuntimeError("A client could not join")
+    return clients
+
+
+def drive(clients, host, loop, ticks, seed=0):
+    """Every client holds random keys for a while, like a driver would."""
+    rng = random.Random(seed)
+    held = [CarControls(True, False, False, False)] * len(clients)
+    for tick in range(ticks):
+        # In chunks, so the host reads them before the socket's buffer overflows
+        for first in range(0, len(clients), 100):
+            for i in range(first, min(first + 100, len(clients))):
+                if rng.random() < 0.03:
+                    held[i] = CarControls(rng.random() < 0.85, rng.random() < 0.1, rng.random() < 0.3, rng.random() < 0.3)
+                clients[i].send_input(held[i])
+            pump(loop)
+        host.tick()
+        for client in clients:
+            client.poll()
+
+
+def mismatches(clients, host):
+    """Snapshots a client decoded differently from what the host sent its race, and how many were compared."""
+    sessions = {session.address[1]: session for session in host.sessions.values()}
+    bad = compared = 0
+    for client in clients:
+        history = sessions[client.sock.getsockname()[1]].history
+        for tick, cars in client.received.items():
+            if tick in history:
+                compared += 1
+                bad += cars != history[tick]
+    return bad, compared
+
+
+def run(count, map_names):
+    loop = asyncio.new_event_loop()
+    with contextlib.redirect_stdout(io.StringIO()):  # Finished races are announced
+        host = RaceHost(map_names, TICK_RATE, SNAPSHOT_RATE, max_sessions=count)
+        host.open("127.0.0.1", 0)
+        loop.add_reader(host.sock.fileno(), host.receive)
+        clients = join(host, loop, map_names, count)
+        host.timer.reset()
+
+        drive(clients, host, loop, SECONDS * TICK_RATE)
+        bad, compared = mismatches(clients, host)
+        session_stats = host.session_stats()
+        stats = host.stats()
+        for client in clients:
+            client.close()
+        loop.remove_reader(host.sock.fileno())
+        host.close()
+        loop.close()
+
+    tick_p50, _, tick_p99 = stats["tick_ms"]
+    per_core = count / stats["load"]
+    costs = np.array([(p50, p99) for _, _, p50, p99, _ in session_stats.values()])
+    fleet_p50 = sum(p50 for p50, _ in stats["fleet_ms"].values())
+    down = sum(client.bytes_received for client in clients) / len(clients) / SECONDS
+    print(
+        f"{count:>8} {tick_p50:>8.3f} {tick_p99:>8.3f} {stats['busy_ms']:>8.3f} {per_core:>9.0f} {fleet_p50:>9.3f} "
+        f"{np.median(costs[:, 0]) * 1000:>8.1f} {costs[:, 1].max() * 1000:>9.1f} {down / 1000:>9.2f} {bad}/{compared}"
+    )
+    return bad == 0 and compared > 0
+
+
+def main():
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    map_names = list(load_sprite_data(1))
+    print(f"{SECONDS} s of time trials on {', '.join(map_names)} at {TICK_RATE} ticks and {SNAPSHOT_RATE} snapshots per second")
+    print(f"{'sessions':>8} {'tick p50':>8} {'tick p99':>8} {'busy ms':>8} {'per core':>9} {'fleet p50':>9} "
+          f"{'race p50':>8} {'worst p99':>9} {'down kB/s':>9} mismatched")
+    print(f"{'':>8} {'ms':>8} {'ms':>8} {'':>8} {'':>9} {'ms':>9} {'us':>8} {'us':>9}")
+    valid = True
+    for count in SESSION_COUNTS:
+        valid &= run(count, map_names)
+    if not valid:
+        print("Clients decoded snapshots that differ from the host's")
+    return 0 if valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
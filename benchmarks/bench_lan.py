@@ -0,0 +1,130 @@
+"""
+LAN race over loopback: one lan_server.RaceServer and several headless
+lan_client.RaceClients on 127.0.0.1. The server and the clients take turns
+in one thread, one tick each, so the numbers are per simulated second and
+do not depend on scheduling. Checks that every snapshot a client decoded
+is exactly the server's, also with lost packets, and reports the bandwidth
+per client and the server's CPU time per tick.
+
+Run from the repository root:
+    python benchmarks/bench_lan.py
+"""
+import contextlib
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pyglet
+
+pyglet.options["shadow_window"] = False
+
+import netcode
+from car_physics import CarControls
+from lan_server import RaceServer
+from lan_client import RaceClient
+
+PLAYER_COUNTS = (2, 4, 8)
+SNAPSHOT_RATES = (20, 30, 60)
+PACKET_LOSS = 0.1
+TICK_RATE = 60
+SECONDS = 10
+MAP_NAME = "trees_at_qatar"
+
+
+def join(server, count, packet_loss):
+    """Clients join from threads, the server answers them from this one."""
+    clients = [None] * count
+
+    def connect(i):
+        clients[i] = RaceClient(server.address, car_index=i % 2, packet_loss=packet_loss, seed=i)
+
+    threads = [threading.Thread(target=connect, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        server.step()
+        time.sleep(0.001)
+    if None in clients:
+        raise RuntimeError("A client could not join")
+    return clients
+
+
+def drive(clients, server, ticks, seed=0):
+    """Every client holds random keys for a while, like a driver would."""
+    rng = random.Random(seed)
+    held = [CarControls(True, False, False, False)] * len(clients)
+    for tick in range(ticks):
+        for i, client in enumerate(clients):
+            if rng.random() < 0.03:
+                held[i] = CarControls(rng.random() < 0.85, rng.random() < 0.1, rng.random() < 0.3, rng.random() < 0.3)
+            client.send_input(held[i])
+        server.step()
+        for client in clients:
+            client.poll()
+
+
+def mismatches(clients, server):
+    """Snapshots a client decoded differently from what the server sent, and how many were compared."""
+    bad = compared = 0
+    for client in clients:
+        for tick, cars in client.received.items():
+            if tick in server.history:
+                compared += 1
+                bad += cars != server.history[tick]
+    return bad, compared
+
+
+def run(count, snapshot_rate, packet_loss=0.0):
+    with contextlib.redirect_stdout(io.StringIO()):  # The server announces every player
+        server = RaceServer(MAP_NAME, "127.0.0.1", 0, TICK_RATE, snapshot_rate, max_players=count)
+        clients = join(server, count, packet_loss)
+        for client in clients:
+            client.bytes_received = client.bytes_sent = 0
+        server.timer.reset()
+
+        ticks = SECONDS * TICK_RATE
+        drive(clients, server, ticks)
+        bad, compared = mismatches(clients, server)
+        full_size = len(netcode.encode_snapshot(server.tick, netcode.NO_TICK, 0, server.fixed_cars()))
+        for client in clients:
+            client.close()
+        server.close()
+
+    down = sum(client.bytes_received for client in clients) / len(clients) / SECONDS
+    up = sum(client.bytes_sent for client in clients) / len(clients) / SECONDS
+    snapshots = sum(client.snapshots for client in clients) / len(clients)
+    delta_size = down * SECONDS / max(snapshots, 1)
+    tick_p50, _, tick_p99 = server.timer.percentiles("tick")
+    simulate_p50 = server.timer.percentiles("simulate")[0]
+    snapshot_p50 = server.timer.percentiles("snapshot")[0]
+    missing = sum(client.missing_baselines for client in clients)
+    print(
+        f"{count:>7} {snapshot_rate:>5} {packet_loss:>5.0%} {down / 1000:>8.2f} {up / 1000:>7.2f} "
+        f"{delta_size:>7.1f} {full_size:>6} {tick_p50:>8.3f} {tick_p99:>8.3f} {simulate_p50:>8.3f} {snapshot_p50:>8.3f} "
+        f"{missing:>6} {bad}/{compared}"
+    )
+    return bad == 0 and compared > 0
+
+
+def main():
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    print(f"{SECONDS} s of racing on {MAP_NAME} at {TICK_RATE} ticks per second, bandwidth per client")
+    print(f"{'players':>7} {'Hz':>5} {'loss':>5} {'down kB/s':>8} {'up kB/s':>7} {'B/snap':>7} {'full':>6} "
+          f"{'tick p50':>8} {'tick p99':>8} {'sim p50':>8} {'send p50':>8} {'nobase':>6} mismatched")
+    valid = True
+    for count in PLAYER_COUNTS:
+        for snapshot_rate in SNAPSHOT_RATES:
+            valid &= run(count, snapshot_rate)
+    valid &= run(max(PLAYER_COUNTS), 30, PACKET_LOSS)
+    if not valid:
+        print("Clients decoded snapshots that differ from the server's")
+    return 0 if valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
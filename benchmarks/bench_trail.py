@@ -0,0 +1,65 @@
+"""
+Trail.update micro-benchmark at different buffer sizes and fill levels.
+
+Run from the repository root:
+    python benchmarks/bench_trail.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import pyglet
+
+pyglet.options["headless"] = True
+
+from camera import Camera
+from objects import Trail
+
+TRAIL_SIZES = (500, 10000, 50000)
+FILL_LEVELS = (0.0, 0.25, 0.5, 1.0)
+UPDATES = 200
+
+
+class DriftingCar:
+    """Stands in for player.Car: always drifting, always emitting two particles."""
+    drifting = True
+
+    def get_trail_pos(self):
+        return [(640.0, 360.0), (650.0, 370.0)]
+
+
+class ParkedCar:
+    drifting = False
+
+
+def measure(trail, car, fill):
+    trail.trail_age[:] = trail.lifetime
+    live = int(trail.max_trail_size * fill)
+    trail.trail_age[:live] = 0.0
+    trail._needs_upload = True
+
+    start = time.perf_counter()
+    for _ in range(UPDATES):
+        trail.trail_age[:live] = 0.0  # keep the fill level steady
+        trail.update(car, 1 / 60)
+    return (time.perf_counter() - start) / UPDATES
+
+
+def main():
+    window = pyglet.window.Window(1280, 720, visible=False)
+    camera = Camera(window)
+
+    print(f"{'size':>8} {'fill':>6} {'drifting ms':>12} {'idle ms':>10}")
+    for size in TRAIL_SIZES:
+        trail = Trail(camera, pyglet.graphics.Batch(), max_trail_size=size)
+        for fill in FILL_LEVELS:
+            drifting = measure(trail, DriftingCar(), fill)
+            idle = measure(trail, ParkedCar(), fill)
+            print(f"{size:>8} {fill:>6.0%} {drifting * 1000:>12.3f} {idle * 1000:>10.3f}")
+    window.close()
+
+
+if __name__ == "__main__":
+    main()
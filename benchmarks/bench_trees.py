@@ -0,0 +1,71 @@
+"""
+Tree layer benchmark: one Sprite per tree (the old way) against the packed TreeLayer.
+
+Run from the repository root:
+    python benchmarks/bench_trees.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+import pyglet
+
+pyglet.options["headless"] = True
+
+from objects import TreeLayer
+
+TREE_COUNTS = (1000, 10000, 50000)
+DRAW_FRAMES = 60
+WORLD_SIZE = 2048 * 7
+
+
+def build_sprites(img, positions, batch):
+    sprites = []
+    for x, y in positions:
+        sprite = pyglet.sprite.Sprite(img, x=x, y=y, batch=batch, group=pyglet.graphics.Group(7))
+        sprite.scale = 7
+        sprites.append(sprite)
+    return sprites
+
+
+def build_layer(img, positions, batch):
+    return TreeLayer(img, positions, scale=7, batch=batch, group=pyglet.graphics.Group(7))
+
+
+def measure(window, build, img, positions):
+    batch = pyglet.graphics.Batch()
+    start = time.perf_counter()
+    keep_alive = build(img, positions, batch)
+    batch.draw()  # first draw uploads the buffers
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(DRAW_FRAMES):
+        window.clear()
+        batch.draw()
+        pyglet.gl.glFinish()
+    draw_time = (time.perf_counter() - start) / DRAW_FRAMES
+    del keep_alive
+    return build_time, draw_time
+
+
+def main():
+    window = pyglet.window.Window(1280, 720, visible=False)
+    assets_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Assets")
+    img = pyglet.image.load(os.path.join(assets_path, "tree.png"))
+    rng = np.random.default_rng(0)
+
+    print(f"{'trees':>8} {'approach':>10} {'build ms':>10} {'draw ms':>10}")
+    for count in TREE_COUNTS:
+        positions = rng.uniform(0, WORLD_SIZE, size=(count, 2)).astype(np.float32)
+        for name, build in (("sprites", build_sprites), ("layer", build_layer)):
+            build_time, draw_time = measure(window, build, img, positions.tolist())
+            print(f"{count:>8} {name:>10} {build_time * 1000:>10.2f} {draw_time * 1000:>10.3f}")
+    window.close()
+
+
+if __name__ == "__main__":
+    main()
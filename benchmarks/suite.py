@@ -0,0 +1,241 @@
+"""
+Benchmark suite for the per-frame hot paths, on every shipped map.
+
+Runs against a hidden headless pyglet window, so it works on a GPU-less
+Linux box with EGL. Run from the repository root:
+
+    python benchmarks/suite.py                    compare against benchmarks/baseline.json
+    python benchmarks/suite.py --save-baseline    record a new baseline
+    python benchmarks/suite.py --filter Trail     only cases whose name contains "Trail"
+
+Every case reports the fastest per-call time over a few repeats. A case
+more than --threshold slower than its baseline counts as a regression and
+makes the run exit with 1. Baselines are machine specific, record one on
+the machine that runs the comparison.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import numpy as np
+import pyglet
+
+pyglet.options["headless"] = True
+pyglet.options["audio"] = ("silent",)
+
+from pyglet.window import key
+import main
+from main_utils import load_assets, load_sprite_data
+from asset_cache import asset_cache
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.25
+DT = 1 / 60
+
+
+def time_call(func, number, repeats):
+    """Fastest time per call of func over repeats runs of number calls."""
+    best = float("inf")
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+class DriftingCar:
+    """Stands in for player.Car in Trail.update: always drifting next to the spawn."""
+    drifting = True
+
+    def __init__(self, x, y):
+        self.points = [(x, y), (x + 10, y + 10)]
+
+    def get_trail_pos(self):
+        return self.points
+
+
+class MapBench:
+    """Loads one map into the game and builds its benchmark cases."""
+    case_names = (
+        "load_assets", "Car.update", "Car.calculate_drift", "Car.update_hitbox_corners",
+        "Car.get_hitbox_corners", "Track.is_on_track x1000", "Trail.update", "TreeManager.update",
+        "TreeManager.generate_trees", "GameWorld.update", "Menu.update",
+    )
+
+    def __init__(self, game, map_index):
+        self.game = game
+        self.map_index = map_index
+        self.map_name = list(load_sprite_data(1))[map_index]
+        self.asset_keys = [f"{self.map_name}_map", f"{self.map_name}_map_grayscale", "car_texture", "tree"]
+
+    def load(self):
+        self.game.main_menu.on_map_pick(self.map_index)
+        while not self.game.is_map_ready(self.map_index):
+            time.sleep(0.01)  # the map preloads in the background, like while a player picks a car
+        self.game.main_menu.on_car_pick(0)
+        self.car = self.game.car
+        self.world = self.game.world
+        self.physics = self.car.physics
+        self.pristine = dict(self.physics.__dict__)
+        self.spawn = self.game.race_manager.spawn_point
+        self.game.keys.on_key_press(key.W, 0)
+
+    def reset_car(self):
+        self.physics.__dict__.update(self.pristine)
+        self.game.teleport_car_to_pos(self.spawn[0], self.spawn[1], -180)
+
+    def load_assets_case(self):
+        def load_cold():
+            # Dropped from the asset cache first, so every call decodes the images again.
+            # pyglet.resource only caches weakly and the result is dropped, so nothing else keeps them.
+            for asset_key in self.asset_keys:
+                asset_cache.discard(("image", f"{asset_key}.png"))
+            load_assets(self.asset_keys)
+        return load_cold
+
+    def cases(self):
+        """(name, func, number, repeats, setup) for everything except load_assets."""
+        game, car, physics, world = self.game, self.car, self.physics, self.world
+        track, keys = world.track, game.keys
+
+        def car_update():
+            car.update(DT, keys, track, world.tree_manager.grid)
+
+        def drifting_setup():
+            self.reset_car()
+            physics.speed = 600
+            physics.direction = 30
+            physics.vel_x, physics.vel_y = 10.0, 0.0
+
+        rng = np.random.default_rng(0)
+        points = rng.uniform(0, track.mask_width * track.scale, size=(1000, 2)).tolist()
+
+        def is_on_track():
+            for x, y in points:
+                track.is_on_track(x, y)
+
+        trail_car = DriftingCar(*self.spawn)
+
+        pan = {"step": 0}
+        def tree_manager_update():
+            # Pans across the map so cells keep appearing and disappearing
+            pan["step"] = (pan["step"] + 1) % 200
+            world.camera.x = pan["step"] * 70
+            world.camera.y = pan["step"] * 70
+            world.tree_manager.update(world.camera)
+
+        return [
+            ("Car.update", car_update, 500, 5, self.reset_car),
+            ("Car.calculate_drift", lambda: physics.calculate_drift(DT), 5000, 5, drifting_setup),
+            ("Car.update_hitbox_corners", lambda: physics.update_hitbox_corners(track, DT), 2000, 5, self.reset_car),
+            ("Car.get_hitbox_corners", physics.get_hitbox_corners, 5000, 5, self.reset_car),
+            ("Track.is_on_track x1000", is_on_track, 3, 5, None),
+            ("Trail.update", lambda: world.trail.update(trail_car, DT), 500, 5, None),
+            ("TreeManager.update", tree_manager_update, 2000, 5, None),
+            ("TreeManager.generate_trees", lambda: world.tree_manager.generate_trees(1000, track, seed=0), 3, 3, None),
+            ("GameWorld.update", lambda: world.update(DT, car), 500, 5, self.reset_car),
+            ("Menu.update", lambda: game.main_menu.update(DT), 500, 5, None),
+        ]
+
+
+def run(name_filter=None):
+    game = main.Game()
+    results = {}
+    for map_index in range(len(load_sprite_data(1))):
+        bench = MapBench(game, map_index)
+        if name_filter and name_filter not in bench.map_name and not any(
+            name_filter in name for name in MapBench.case_names
+        ):
+            continue
+
+        def record(name, func, number, repeats, setup=None):
+            full_name = f"{bench.map_name}/{name}"
+            if name_filter and name_filter not in full_name:
+                return
+            if setup:
+                setup()
+            results[full_name] = time_call(func, number, repeats)
+            print(f"{full_name:<50} {results[full_name] * 1e6:>12.1f} us")
+
+        # Timed before the map is loaded so nothing holds on to its images
+        record("load_assets", bench.load_assets_case(), 1, 2)
+        bench.load()
+        for case in bench.cases():
+            record(*case)
+    game.window.close()
+    return results
+
+
+def machine_info():
+    return {"python": platform.python_version(), "machine": platform.machine(), "pyglet": pyglet.version}
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against the baseline and returns the regressed case names."""
+    regressions = []
+    print()
+    print(f"{'case':<50} {'baseline us':>12} {'now us':>12} {'change':>8}")
+    for name, seconds in results.items():
+        if name not in baseline:
+            print(f"{name:<50} {'-':>12} {seconds * 1e6:>12.1f} {'new':>8}")
+            continue
+        change = seconds / baseline[name] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<50} {baseline[name] * 1e6:>12.1f} {seconds * 1e6:>12.1f} {change:>+8.0%}{flag}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="PyRacing hot path benchmarks")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write the results to {BASELINE_PATH}")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--filter", help="only run cases whose name contains this text")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)  # the game finds Assets/ relative to the working directory
+    results = run(args.filter)
+
+    if args.save_baseline:
+        baseline = {}
+        if args.filter and os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)["results"]
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine_info(), "results": baseline}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    if stored.get("machine") != machine_info():
+        print(f"\nWarning: Baseline was recorded on {stored.get('machine')}, this is {machine_info()}")
+
+    regressions = compare(results, stored["results"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.threshold:.0%}")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
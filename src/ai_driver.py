@@ -0,0 +1,81 @@
+import numpy as np
+from car_physics import CarControls
+from track_mask import SURFACE_WALL, SURFACE_SOFT_WALL, SURFACE_OFF_TRACK
+
+
+class RayDriver:
+    """
+    Drives every car of a CarFleet by looking at the track only: a fan of
+    rays from each car measures the free road in each direction, the car
+    steers towards the longest one and lifts or brakes when the road ahead
+    gets short. A car that stalls, usually nose first against a wall, backs
+    out for a moment. All cars are handled in a few array operations.
+    """
+    def __init__(self, fleet, ray_angles=(-90, -60, -35, -20, -10, 0, 10, 20, 35, 60, 90), ray_length=1400, samples=28,
+                 speed_per_room=1.0, stall_time=1.0, backing_time=1.0):
+        self.fleet = fleet
+        self.ray_angles = np.radians(np.asarray(ray_angles, dtype=np.float64))
+        self.ahead = int(np.argmin(np.abs(self.ray_angles)))
+        self.steps = np.linspace(ray_length / samples, ray_length, samples)
+        # Speed a car may carry per world pixel of free road ahead, scaled per car to spread the field
+        self.speed_per_room = np.broadcast_to(np.asarray(speed_per_room, dtype=np.float64), (len(fleet),)).copy()
+        self.stall_time = stall_time
+        self.backing_time = backing_time
+        self.slow = np.zeros(len(fleet))  # Seconds spent barely moving, per car
+        self.backing = np.zeros(len(fleet))  # Seconds left backing out, per car
+        self.backing_turn = np.zeros(len(fleet), dtype=bool)  # Nose swings left while backing out
+
+    def free_road(self, track):
+        """(cars, rays) distance in world pixels to the first wall along every ray."""
+        fleet = self.fleet
+        angles = np.radians(fleet.direction)[:, None] + self.ray_angles
+        cos_a, sin_a = np.cos(angles)[..., None], np.sin(angles)[..., None]
+        xs = fleet.x[:, None, None] + cos_a * self.steps
+        ys = fleet.y[:, None, None] + sin_a * self.steps
+        surfaces = track.classify_points(xs, ys)
+        blocked = (surfaces == SURFACE_WALL) | (surfaces == SURFACE_SOFT_WALL) | (surfaces == SURFACE_OFF_TRACK)
+        # Index of the first blocked sample, the full length if there is none
+        first = np.where(blocked.any(axis=2), blocked.argmax(axis=2), len(self.steps))
+        return np.concatenate(([0.0], self.steps))[first]
+
+    def controls(self, track, dt):
+        """A CarControls of bool arrays for the next tick of every car."""
+        fleet = self.fleet
+        free = self.free_road(track)
+        rows = np.arange(len(fleet))
+
+        # A ray only counts as far as its neighbours are free too, the car is wider than a ray
+        clearance = free.copy()
+        np.minimum(clearance[:, 1:], free[:, :-1], out=clearance[:, 1:])
+        np.minimum(clearance[:, :-1], free[:, 1:], out=clearance[:, :-1])
+
+        # Head for the longest ray, preferring straighter ones when they are about as long
+        score = clearance * np.cos(self.ray_angles) ** 2
+        target = self.ray_angles[np.argmax(score, axis=1)]
+        left = target > 0
+        right = target < 0
+
+        room = free[rows, self.ahead]
+        too_fast = fleet.speed > room * self.speed_per_room
+        accelerate = ~too_fast
+        brake = too_fast & (fleet.speed > 300)
+
+        # Reversing turns the nose the other way, towards the side with more room
+        self.slow[:] = np.where(np.abs(fleet.speed) < 30, self.slow + dt, 0.0)
+        stuck = (self.backing <= 0) & (self.slow > self.stall_time)
+        self.backing[stuck] = self.backing_time
+        self.slow[stuck] = 0.0
+        self.backing_turn[:] = np.where(stuck, free[:, -1] > free[:, 0], self.backing_turn)
+        backing = self.backing > 0
+        self.backing -= dt
+        accelerate &= ~backing
+        brake |= backing
+        left = np.where(backing, ~self.backing_turn, left)
+        right = np.where(backing, self.backing_turn, right)
+        return CarControls(accelerate, brake, left, right)
+
+    def snapshot(self):
+        return (self.slow.copy(), self.backing.copy(), self.backing_turn.copy())
+
+    def restore(self, state):
+        self.slow[:], self.backing[:], self.backing_turn[:] = state
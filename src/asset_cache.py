@@ -0,0 +1,81 @@
+from collections import OrderedDict
+
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+
+def estimate_size(value):
+    """Rough memory use in bytes of a cached asset."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "width") and hasattr(value, "height"):
+        return int(value.width * value.height * 4)  # decoded RGBA
+    data = getattr(value, "_data", None)  # pyglet StaticSource keeps its samples here
+    if data is not None:
+        return len(data)
+    return 0
+
+
+class AssetCache:
+    """
+    Keeps decoded assets (images, mask bytes, static sounds) alive between
+    races. Least recently used entries are dropped once the total estimated
+    size goes over budget_bytes.
+    """
+    def __init__(self, budget_bytes=DEFAULT_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, load, size=estimate_size):
+        """Returns the cached value for key, calling load() on a miss. None results are not cached."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        value = load()
+        if value is None:
+            return None
+
+        nbytes = size(value)
+        if nbytes > self.budget_bytes:
+            return value
+        self._entries[key] = (value, nbytes)
+        self.used_bytes += nbytes
+        self._evict()
+        return value
+
+    def peek(self, key):
+        """The cached value or None, without loading or touching the LRU order."""
+        entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def _evict(self):
+        while self.used_bytes > self.budget_bytes and self._entries:
+            _, (_, nbytes) = self._entries.popitem(last=False)
+            self.used_bytes -= nbytes
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.used_bytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.used_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Shared by everything that loads assets in this process
+asset_cache = AssetCache()
@@ -0,0 +1,75 @@
+import pyglet
+from pyglet.math import Mat4, Vec3
+
+
+class Camera:
+    """
+    Scroll offset of the world relative to the screen.
+    World objects keep fixed world coordinates; only this offset changes.
+    x and y are the simulated position, rendering blends from the
+    position at the start of the last tick by alpha.
+    """
+    def __init__(self, window, x=0.0, y=0.0):
+        self.window = window
+        self.x = x
+        self.y = y
+        self.previous_x = x
+        self.previous_y = y
+        self.alpha = 1.0
+
+    def begin_tick(self):
+        self.previous_x = self.x
+        self.previous_y = self.y
+
+    def move(self, dx, dy):
+        self.x += dx
+        self.y += dy
+
+    def look_at(self, world_x, world_y):
+        """Centers the view on a world position, interpolating from the old one."""
+        self.x = world_x - self.window.width / 2
+        self.y = world_y - self.window.height / 2
+
+    def move_to(self, x, y):
+        """Jumps without interpolating from the old position."""
+        self.x = self.previous_x = x
+        self.y = self.previous_y = y
+
+    @property
+    def render_x(self):
+        return self.previous_x + (self.x - self.previous_x) * self.alpha
+
+    @property
+    def render_y(self):
+        return self.previous_y + (self.y - self.previous_y) * self.alpha
+
+    def to_world(self, screen_x, screen_y):
+        return screen_x + self.x, screen_y + self.y
+
+    def to_screen(self, world_x, world_y):
+        return world_x - self.x, world_y - self.y
+
+
+class CameraGroup(pyglet.graphics.Group):
+    """Draws its children shifted by the camera offset through the window view matrix."""
+    def __init__(self, camera, order=0, parent=None):
+        super().__init__(order, parent)
+        self.camera = camera
+        self._previous_view = None
+
+    def set_state(self):
+        window = self.camera.window
+        self._previous_view = window.view
+        window.view = window.view @ Mat4.from_translation(Vec3(-self.camera.render_x, -self.camera.render_y, 0))
+
+    def unset_state(self):
+        self.camera.window.view = self._previous_view
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and
+                self.camera is other.camera and
+                self.order == other.order and
+                self.parent == other.parent)
+
+    def __hash__(self):
+        return hash((id(self.camera), self.order, self.parent))
@@ -0,0 +1,415 @@
+import math
+import numpy as np
+from car_physics import STATE_FIELDS, PhysicsState, REFERENCE_TICK
+from track_mask import SURFACE_START, SURFACE_FINISH, SURFACE_WALL, SURFACE_SOFT_WALL, SURFACE_CHECKPOINT, SURFACE_OFF_TRACK
+
+# Surface class -> bit flags, so one OR and one AND over the four corners
+# answer every "any corner on ..." and "all corners in ..." question
+_HARD_WALL = 1
+_SOFT_WALL = 2
+_START = 4
+_FINISH = 8
+_CHECKPOINT = 16
+_BLOCKED = 32  # Set for hard and soft walls alike
+_SURFACE_BITS = np.zeros(SURFACE_OFF_TRACK + 1, dtype=np.uint8)
+_SURFACE_BITS[SURFACE_START] = _START
+_SURFACE_BITS[SURFACE_FINISH] = _FINISH
+_SURFACE_BITS[SURFACE_WALL] = _HARD_WALL | _BLOCKED
+_SURFACE_BITS[SURFACE_SOFT_WALL] = _SOFT_WALL | _BLOCKED
+_SURFACE_BITS[SURFACE_CHECKPOINT] = _CHECKPOINT
+_SURFACE_BITS[SURFACE_OFF_TRACK] = _HARD_WALL | _BLOCKED  # Anything off the marked track behaves like a wall
+
+# Corners of the hitbox in its own frame, times the half width and height
+_CORNER_SIGNS_X = np.array([-1.0, 1.0, 1.0, -1.0])
+_CORNER_SIGNS_Y = np.array([1.0, 1.0, -1.0, -1.0])
+
+_FLOAT_FIELDS = (
+    "x", "y", "vel_x", "vel_y", "speed", "direction", "angular_velocity", "drift_turn_strength",
+    "timer", "collision_correction_x", "collision_correction_y",
+)
+_INT_FIELDS = ("last_turn", "collision_frames")
+_BOOL_FIELDS = ("drifting", "crashed", "is_lap_finished", "lap_started", "checkpoint_reached")
+
+
+class CarFleet:
+    """
+    Many cars stepped together: the math of CarPhysics.step on one array
+    per state field instead of one object per car, so a tick costs about
+    the same for one car as for fifty. Cars do not collide with each other.
+    """
+    def __init__(self, cars):
+        """Takes the parameters and current state of a list of CarPhysics."""
+        template = cars[0]
+        self.turn_strength = template.turn_strength
+        self.speed_cap = template.speed_cap
+        self.reverse_cap = template.reverse_cap
+        self.angular_damping = template.angular_damping
+        self.collision_spin_force = template.collision_spin_force
+        self.wall_restitution = template.wall_restitution
+
+        self.power = np.array([car.power for car in cars], dtype=np.float64)
+        self.friction = np.array([car.friction for car in cars], dtype=np.float64)
+        self.half_width = np.array([car.hitbox_width / 2 for car in cars], dtype=np.float64)
+        self.half_height = np.array([car.hitbox_height / 2 for car in cars], dtype=np.float64)
+        self.corner_dx = _CORNER_SIGNS_X * self.half_width[:, None]
+        self.corner_dy = _CORNER_SIGNS_Y * self.half_height[:, None]
+
+        for names, dtype in ((_FLOAT_FIELDS, np.float64), (_INT_FIELDS, np.int64), (_BOOL_FIELDS, bool)):
+            for name in names:
+                setattr(self, name, np.array([getattr(car, name) for car in cars], dtype=dtype))
+
+    def __len__(self):
+        return len(self.x)
+
+    def state_of(self, i):
+        """Car i as a PhysicsState, comparable with CarPhysics.snapshot()."""
+        return PhysicsState._make(getattr(self, name)[i].item() for name in STATE_FIELDS)
+
+    def set_car(self, i, car):
+        """Replaces car i with the parameters and state of a CarPhysics."""
+        self.power[i] = car.power
+        self.friction[i] = car.friction
+        self.half_width[i] = car.hitbox_width / 2
+        self.half_height[i] = car.hitbox_height / 2
+        self.corner_dx[i] = _CORNER_SIGNS_X * self.half_width[i]
+        self.corner_dy[i] = _CORNER_SIGNS_Y * self.half_height[i]
+        for name in STATE_FIELDS:
+            getattr(self, name)[i] = getattr(car, name)
+
+    def snapshot(self):
+        return tuple(getattr(self, name).copy() for name in STATE_FIELDS)
+
+    def restore(self, state, cars=None):
+        """Puts every car back into a snapshot, or only cars (a mask or indices) when given."""
+        if cars is None:
+            cars = slice(None)
+        for name, values in zip(STATE_FIELDS, state):
+            getattr(self, name)[cars] = values[cars]
+
+    def step(self, dt, controls, track, trees=None):
+        """
+        One tick of CarPhysics.step for every car. controls is a CarControls
+        of bool arrays, one entry per car.
+        """
+        # The heading only changes in update, everything before it shares one cos and sin
+        theta = np.radians(self.direction)
+        cos_t, sin_t = np.cos(theta), np.sin(theta)
+
+        self.update_hitbox_corners(track, dt, cos_t, sin_t)
+        if trees is not None:
+            self.collide_with_trees(trees, dt, cos_t, sin_t)
+        self.update(dt, controls, theta, cos_t, sin_t)
+        self.x += self.vel_x + self.collision_correction_x
+        self.y += self.vel_y + self.collision_correction_y
+
+    def update(self, dt, controls, theta, cos_t, sin_t):
+        self.speed = np.maximum(self.reverse_cap, np.minimum(self.speed, self.speed_cap))
+
+        driving = ~self.crashed
+        accelerating = controls.accelerate & driving
+        braking = controls.brake & driving
+        turn_input = (controls.left.astype(np.int64) - controls.right) * driving
+        tick_scale = dt / REFERENCE_TICK
+
+        turn_rate = np.where(self.drifting, self.drift_turn_strength, self.turn_strength)
+
+        pushed = (accelerating | braking | (self.speed < 0)) & ~self.drifting
+        self.vel_x = np.where(pushed, self.speed * cos_t * dt, self.vel_x)
+        self.vel_y = np.where(pushed, self.speed * sin_t * dt, self.vel_y)
+
+        self.calculate_drift(dt, theta, cos_t, sin_t)
+
+        self.speed = np.where(accelerating, self.speed + self.power * dt, self.speed)
+        factor = np.where(self.speed < 0, 0.5, 1.0)
+        self.speed = np.where(braking, self.speed - self.power * factor * dt, self.speed)
+
+        turning = turn_input != 0
+        if turning.any():
+            sign = np.where(self.speed >= 0, 1, -1)
+            speed_ratio = np.abs(self.speed) / self.speed_cap
+
+            steering = turning & ~self.drifting
+            self.last_turn = np.where(steering, turn_input, self.last_turn)
+            turn_factor = speed_ratio * dt * np.maximum(1 - self.speed / self.speed_cap / 4, 0.5)
+            steered = (self.direction + sign * turn_input * turn_rate * turn_factor) % 360
+
+            drift_turn = sign * self.last_turn * self.drift_turn_strength * speed_ratio * dt
+            input_turn = sign * turn_input * self.turn_strength / 2 * speed_ratio * dt
+            drifted = (self.direction + drift_turn + input_turn) % 360
+
+            self.direction = np.where(steering, steered, np.where(turning, drifted, self.direction))
+
+        self.direction = (self.direction + self.angular_velocity * dt) % 360
+        self.angular_velocity *= self.angular_damping ** tick_scale
+        self.angular_velocity[np.abs(self.angular_velocity) < 1.0] = 0.0
+
+        self.vel_x *= 0.995 ** tick_scale
+        self.vel_y *= 0.995 ** tick_scale
+
+    def calculate_drift(self, dt, direction_rad, cos_t, sin_t):
+        vel_angle = np.arctan2(self.vel_y, self.vel_x)
+        ang_diff = (vel_angle - direction_rad + math.pi) % (2 * math.pi) - math.pi
+        diff = np.abs(np.degrees(ang_diff))
+        modded = 90 - np.abs(90 - diff)
+        drift_factor = modded / 90
+        self.drifting = (drift_factor > 0.1) & (self.speed > 200)
+
+        self.drift_turn_strength = self.turn_strength * (0.5 + drift_factor)
+
+        corr = drift_factor * self.friction * self.speed
+        lat_ang = direction_rad + np.where(ang_diff < 0, math.pi / 2, -math.pi / 2)
+        # vel is a per-tick displacement, so the correction scales with dt squared
+        tick_scale = dt / REFERENCE_TICK
+        self.vel_x = self.vel_x + np.cos(lat_ang) * corr * dt * tick_scale
+        self.vel_y = self.vel_y + np.sin(lat_ang) * corr * dt * tick_scale
+
+        fade = drift_factor * 0.01 * (1 - self.speed / self.speed_cap)
+        keep = (1 - fade) ** tick_scale
+        self.vel_x = self.vel_x * keep
+        self.vel_y = self.vel_y * keep
+
+        measured = np.hypot(self.vel_x, self.vel_y) / dt
+        proj = self.vel_x * cos_t + self.vel_y * sin_t
+        self.speed = np.copysign(measured, proj)
+
+    def hitbox_corners(self, cos_t=None, sin_t=None):
+        """(n, 4) corner x and y arrays in the corner order of CarPhysics.get_hitbox_corners."""
+        if cos_t is None:
+            theta = np.radians(self.direction)
+            cos_t, sin_t = np.cos(theta), np.sin(theta)
+        cos_t, sin_t = cos_t[:, None], sin_t[:, None]
+        dx, dy = self.corner_dx, self.corner_dy
+        return self.x[:, None] + dx * cos_t - dy * sin_t, self.y[:, None] + dx * sin_t + dy * cos_t
+
+    def update_hitbox_corners(self, track, dt, cos_t, sin_t):
+        corners_x, corners_y = self.hitbox_corners(cos_t, sin_t)
+        flags = _SURFACE_BITS[track.classify_points(corners_x, corners_y)]
+        touched = np.bitwise_or.reduce(flags, axis=1)
+        everywhere = np.bitwise_and.reduce(flags, axis=1)
+
+        # Soft walls only count while no corner is on the finish line
+        on_finish = (touched & _FINISH) != 0
+        soft_walls = ((touched & _SOFT_WALL) != 0) & ~on_finish
+        colliding = (((touched & _HARD_WALL) != 0) | soft_walls) & ((everywhere & _BLOCKED) == 0)
+
+        self.collision_correction_x = np.zeros(len(self))
+        self.collision_correction_y = np.zeros(len(self))
+        self.collision_frames = np.where(colliding, self.collision_frames + 1, 0)
+        if colliding.any():
+            cars = np.flatnonzero(colliding)
+            car_flags = flags[cars]
+            in_wall = ((car_flags & _HARD_WALL) != 0) | (((car_flags & _SOFT_WALL) != 0) & soft_walls[cars, None])
+            self._resolve_wall_collisions(track, cars, corners_x[cars], corners_y[cars], in_wall, dt, cos_t[cars], sin_t[cars])
+
+        # Lap/checkpoint logic of CarPhysics.update_hitbox_corners
+        on_start = (touched & _START) != 0
+        on_checkpoint = ~on_start & ((touched & _CHECKPOINT) != 0)
+        on_finish &= ~on_start & ~on_checkpoint
+
+        starting = on_start & ~self.lap_started
+        if starting.any():
+            self.timer[starting] = 0
+            self.checkpoint_reached[starting] = False
+            self.lap_started |= starting
+        self.checkpoint_reached |= on_checkpoint & self.lap_started
+
+        finishing = on_finish & self.lap_started & self.checkpoint_reached & (self.timer > 1)
+        if finishing.any():
+            self.is_lap_finished |= finishing
+            self.lap_started &= ~finishing
+            self.checkpoint_reached &= ~finishing
+
+    def _resolve_wall_collisions(self, track, cars, xs, ys, in_wall, dt, cos_t, sin_t):
+        """CarPhysics._resolve_wall_collision for the listed cars, xs and ys are their corners."""
+        distances, normals_x, normals_y = track.wall_distance(xs, ys)
+
+        # The deepest wall corner decides the push, the mask resolution is the safety margin
+        deepest = np.argmin(np.where(in_wall, distances, np.inf), axis=1)
+        rows = np.arange(len(cars))
+        depth = -distances[rows, deepest].astype(np.float64) + track.scale / 2
+        normal_x = normals_x[rows, deepest].astype(np.float64)
+        normal_y = normals_y[rows, deepest].astype(np.float64)
+        contact_x, contact_y = xs[rows, deepest], ys[rows, deepest]
+        x, y = self.x[cars], self.y[cars]
+
+        # Soft walls are not in the distance field, those push towards the car center
+        fallback = (depth <= 0) | ((normal_x == 0) & (normal_y == 0))
+        if fallback.any():
+            away_x, away_y = x - contact_x, y - contact_y
+            length = np.hypot(away_x, away_y)
+            length[length == 0] = 1.0
+            normal_x = np.where(fallback, away_x / length, normal_x)
+            normal_y = np.where(fallback, away_y / length, normal_y)
+            depth = np.where(fallback, track.scale, depth)
+
+        self.collision_correction_x[cars] = normal_x * depth
+        self.collision_correction_y[cars] = normal_y * depth
+
+        vel_x, vel_y = self.vel_x[cars], self.vel_y[cars]
+        into_wall = vel_x * normal_x + vel_y * normal_y
+        hit = into_wall < 0
+        if not hit.any():
+            return
+        cars, normal_x, normal_y, into_wall = cars[hit], normal_x[hit], normal_y[hit], into_wall[hit]
+        contact_x, contact_y, x, y = contact_x[hit], contact_y[hit], x[hit], y[hit]
+        vel_x, vel_y = vel_x[hit], vel_y[hit]
+
+        impact_factor = np.abs(self.speed[cars] / self.speed_cap)
+        velocity = np.hypot(vel_x, vel_y)
+        velocity[velocity == 0] = 1.0
+        head_on = -into_wall / velocity
+
+        # Cancel the velocity going into the wall and bounce a bit
+        vel_x = vel_x - normal_x * into_wall * (1 + self.wall_restitution)
+        vel_y = vel_y - normal_y * into_wall * (1 + self.wall_restitution)
+        self.vel_x[cars] = vel_x
+        self.vel_y[cars] = vel_y
+
+        # Spin from where the wall hit the car
+        lever_x, lever_y = contact_x - x, contact_y - y
+        lever_length = np.hypot(lever_x, lever_y)
+        lever_length[lever_length == 0] = 1.0
+        lever = (lever_x * normal_y - lever_y * normal_x) / lever_length
+        self.angular_velocity[cars] += lever * self.collision_spin_force * impact_factor * 20
+
+        self.crashed[cars] |= (impact_factor > 0.7) & (head_on > 0.7)
+        self.speed[cars] = (vel_x * cos_t[hit] + vel_y * sin_t[hit]) / dt
+
+    def collide_with_trees(self, trees, dt, cos_t, sin_t):
+        """CarPhysics.collide_with_trees for every car against one TreeGrid."""
+        radius = trees.trunk_radius
+        reach = np.hypot(self.half_width, self.half_height) + radius
+        near = trees.maybe_near(self.x, self.y, float(reach.max()))
+        if not near.any():
+            return
+        candidates = np.flatnonzero(near)
+        found, trunk_x, trunk_y = trees.pairs_near(self.x[candidates], self.y[candidates], reach[candidates])
+        if not len(found):
+            return
+        cars = candidates[found]
+
+        hw, hh = self.half_width[cars], self.half_height[cars]
+        cos_t, sin_t = cos_t[cars], sin_t[cars]
+
+        # Trunk centers in each car's local frame
+        rel_x = trunk_x.astype(np.float64) - self.x[cars]
+        rel_y = trunk_y.astype(np.float64) - self.y[cars]
+        local_x = rel_x * cos_t + rel_y * sin_t
+        local_y = -rel_x * sin_t + rel_y * cos_t
+        closest_x = np.maximum(-hw, np.minimum(hw, local_x))
+        closest_y = np.maximum(-hh, np.minimum(hh, local_y))
+
+        off_x, off_y = closest_x - local_x, closest_y - local_y
+        dist = np.hypot(off_x, off_y)
+        touching = dist < radius
+        if not touching.any():
+            return
+        penetration = radius - dist
+
+        # Trunk center inside the hitbox, push straight away from it
+        inside = dist == 0
+        off_x = np.where(inside, -local_x, off_x)
+        off_y = np.where(inside, -local_y, off_y)
+        dist = np.where(inside, np.hypot(off_x, off_y), dist)
+        dist[dist == 0] = 1.0
+
+        normal_x = (off_x * cos_t - off_y * sin_t) / dist
+        normal_y = (off_x * sin_t + off_y * cos_t) / dist
+        cars, normal_x, normal_y = cars[touching], normal_x[touching], normal_y[touching]
+        penetration = penetration[touching]
+
+        # A car touching several trunks handles them one after another like
+        # CarPhysics does, so its pushes add up in the same order
+        first = np.flatnonzero(np.r_[True, cars[1:] != cars[:-1]])
+        rank = np.arange(len(cars)) - np.repeat(first, np.diff(np.r_[first, len(cars)]))
+        for k in range(int(rank.max()) + 1):
+            now = rank == k
+            c, nx, ny = cars[now], normal_x[now], normal_y[now]
+            self.collision_correction_x[c] += nx * penetration[now]
+            self.collision_correction_y[c] += ny * penetration[now]
+
+            into_tree = self.vel_x[c] * nx + self.vel_y[c] * ny
+            bounce = into_tree < 0
+            c, nx, ny, into_tree = c[bounce], nx[bounce], ny[bounce], into_tree[bounce]
+            self.vel_x[c] -= nx * into_tree * 1.3
+            self.vel_y[c] -= ny * into_tree * 1.3
+
+        hit = cars[first]
+        self.collision_frames[hit] += 1
+        self.speed[hit] = (self.vel_x[hit] * cos_t[touching][first] + self.vel_y[hit] * sin_t[touching][first]) / dt
+
+
+class FleetRaceRules:
+    """
+    The lap and crash rules of game_logic.RaceManager for every car of a
+    CarFleet at once: finished laps are counted and restart the timer, a
+    crashed car slows down and goes back to its start slot after 5 seconds.
+    """
+    def __init__(self, fleet, total_laps, start_direction=-180):
+        self.fleet = fleet
+        self.total_laps = total_laps
+        self.start_direction = start_direction
+        self.start_x = fleet.x.copy()
+        self.start_y = fleet.y.copy()
+        self.laps = np.zeros(len(fleet), dtype=np.int64)
+        self.time_after_crash = np.zeros(len(fleet))
+        self.finished = np.zeros(len(fleet), dtype=bool)  # Cars that finished a lap in the last tick
+        self.lap_time = np.zeros(len(fleet))  # Time of every car's last finished lap
+
+    @property
+    def racing(self):
+        """Cars that still have laps to drive, the others get no more input."""
+        return self.laps < self.total_laps
+
+    def step(self, dt, controls, track, trees=None, moving=None):
+        """
+        fleet.step and apply for the cars in the moving mask, every other
+        car keeps its state as if the tick had not happened for it.
+        """
+        if moving is None or moving.all():
+            self.fleet.step(dt, controls, track, trees)
+            return self.apply(dt)
+
+        waiting = ~moving
+        fleet_state = self.fleet.snapshot()
+        rules_state = (self.laps.copy(), self.time_after_crash.copy(), self.lap_time.copy())
+        self.fleet.step(dt, controls, track, trees)
+        respawn = self.apply(dt)
+        self.fleet.restore(fleet_state, waiting)
+        for values, saved in zip((self.laps, self.time_after_crash, self.lap_time), rules_state):
+            values[waiting] = saved[waiting]
+        self.finished &= moving
+        return respawn & moving
+
+    def apply(self, dt):
+        """Call after every fleet.step. Returns the cars that were put back on their start slot."""
+        fleet = self.fleet
+        finished = self.finished = fleet.is_lap_finished.copy()
+        if finished.any():
+            self.laps += finished
+            self.lap_time[finished] = fleet.timer[finished]
+            fleet.timer[finished] = 0
+            fleet.is_lap_finished[:] = False
+        fleet.timer += dt
+
+        respawn = np.zeros(len(fleet), dtype=bool)
+        crashed = fleet.crashed
+        if crashed.any():
+            self.time_after_crash[crashed] += dt
+            fleet.vel_x[crashed] *= 0.92 ** (dt / REFERENCE_TICK)
+            fleet.vel_y[crashed] *= 0.92 ** (dt / REFERENCE_TICK)
+            respawn = crashed & (self.time_after_crash > 5)
+            if respawn.any():
+                self.reset(respawn)
+        return respawn
+
+    def reset(self, cars):
+        """Puts cars (a mask or indices) back on their start slot, facing the start."""
+        fleet = self.fleet
+        self.time_after_crash[cars] = 0
+        fleet.crashed[cars] = False
+        fleet.drifting[cars] = False
+        fleet.x[cars] = self.start_x[cars]
+        fleet.y[cars] = self.start_y[cars]
+        fleet.direction[cars] = self.start_direction
+        fleet.timer[cars] = 0
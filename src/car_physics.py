@@ -0,0 +1,347 @@
+import math
+from collections import namedtuple
+from operator import attrgetter
+import numpy as np
+from track_mask import SURFACE_WALL, SURFACE_OFF_TRACK
+
+# The handling was tuned at 60 ticks per second. Per-tick factors are
+# rescaled by dt / REFERENCE_TICK so other tick rates drive the same.
+REFERENCE_TICK = 1 / 60
+
+# Driver input for one tick, each field is a bool
+CarControls = namedtuple("CarControls", ["accelerate", "brake", "left", "right"])
+NO_CONTROLS = CarControls(False, False, False, False)
+
+# Everything in CarPhysics that changes while driving, the rest is set once per car
+STATE_FIELDS = (
+    "x", "y", "vel_x", "vel_y", "speed", "direction", "angular_velocity",
+    "drifting", "drift_turn_strength", "last_turn", "collision_frames", "crashed",
+    "timer", "is_lap_finished", "lap_started", "checkpoint_reached",
+    "collision_correction_x", "collision_correction_y",
+)
+PhysicsState = namedtuple("PhysicsState", STATE_FIELDS)
+_read_state = attrgetter(*STATE_FIELDS)
+
+
+class CarPhysics:
+    """
+    Car dynamics, collisions and lap state with no pyglet in sight.
+    Positions are world pixels; (x, y) is the center of the hitbox.
+    """
+    def __init__(self, power, friction, hitbox_width, hitbox_height, x=0.0, y=0.0):
+        self.speed = 0
+        self.power = power
+        self.friction = friction
+        self.direction = 0.0
+        self.turn_strength = 140
+        self.drift_turn_strength = 100
+        self.speed_cap = 1000
+        self.reverse_cap = -self.speed_cap / 3
+        self.drifting = False
+        self.last_turn = 0
+        self.collision_frames = 0
+        self.collision_sound_due = False
+        self.crashed = False
+        self.timer = 0
+        self.is_lap_finished = False
+        self.lap_started = False
+        self.checkpoint_reached = False
+        self.angular_velocity = 0.0
+        self.angular_damping = 0.95
+        self.collision_spin_force = 20
+        self.wall_restitution = 0.3
+        self._cached_direction = None
+        self._cached_cos = 0.0
+        self._cached_sin = 0.0
+
+        # Movement parameters
+        self.x = x
+        self.y = y
+        self.vel_x = 0.0
+        self.vel_y = 0.0
+        self.collision_correction_x = 0.0
+        self.collision_correction_y = 0.0
+
+        self.hitbox_width = hitbox_width
+        self.hitbox_height = hitbox_height
+
+    def _update_cached_trig(self):
+        """Cache trigonometric calculations for performance"""
+        if self._cached_direction != self.direction:
+            self._cached_direction = self.direction
+            rad = math.radians(self.direction)
+            self._cached_cos = math.cos(rad)
+            self._cached_sin = math.sin(rad)
+
+    def snapshot(self):
+        """The driving state as a PhysicsState tuple, cheap enough to take every tick."""
+        return PhysicsState._make(_read_state(self))
+
+    def restore(self, state):
+        """Puts the car back into a snapshot. Stepping on from it repeats the original ticks exactly."""
+        for name, value in zip(STATE_FIELDS, state):
+            setattr(self, name, value)
+        self.collision_sound_due = False
+        self._cached_direction = None
+
+    def step(self, dt, controls, track, trees=None):
+        """Runs one full physics tick: collisions, driving and moving the car."""
+        self.update_hitbox_corners(track, dt)
+        if trees is not None:
+            self.collide_with_trees(trees, dt)
+        self.update(dt, controls)
+        self.x += self.vel_x + self.collision_correction_x
+        self.y += self.vel_y + self.collision_correction_y
+
+    def update(self, dt, controls):
+        self.speed = max(self.reverse_cap, min(self.speed, self.speed_cap))
+
+        if not self.crashed:
+            accelerating = controls.accelerate
+            braking = controls.brake
+            turn_input = (controls.left * 1) + (controls.right * -1)
+        else:
+            accelerating = False
+            braking = False
+            turn_input = 0
+
+        self._update_cached_trig()
+        tick_scale = dt / REFERENCE_TICK
+
+        turn_rate = self.turn_strength if not self.drifting else self.drift_turn_strength
+
+        if accelerating or braking or self.speed < 0:
+            if not self.drifting:
+                self.vel_x = self.speed * self._cached_cos * dt
+                self.vel_y = self.speed * self._cached_sin * dt
+
+        self.calculate_drift(dt)
+
+        if accelerating:
+            self.speed += self.power * dt
+
+        if braking:
+            factor = 0.5 if self.speed < 0 else 1.0
+            self.speed -= self.power * factor * dt
+
+        if turn_input:
+            sign = 1 if self.speed >= 0 else -1
+            speed_ratio = abs(self.speed) / self.speed_cap
+
+            if not self.drifting:
+                self.last_turn = turn_input
+                turn_factor = speed_ratio * dt * max(1 - self.speed / self.speed_cap / 4, 0.5)
+                self.direction = (self.direction + sign * turn_input * turn_rate * turn_factor) % 360
+            else:
+                drift_turn = sign * self.last_turn * self.drift_turn_strength * speed_ratio * dt
+                input_turn = sign * turn_input * self.turn_strength / 2 * speed_ratio * dt
+                self.direction = (self.direction + drift_turn + input_turn) % 360
+
+        self.direction = (self.direction + self.angular_velocity * dt) % 360
+        self.angular_velocity *= self.angular_damping ** tick_scale
+        if abs(self.angular_velocity) < 1.0:
+            self.angular_velocity = 0.0
+
+        self.vel_x *= 0.995 ** tick_scale
+        self.vel_y *= 0.995 ** tick_scale
+
+    def calculate_drift(self, dt):
+        if self._cached_direction != self.direction:
+            self._update_cached_trig()
+
+        vel_angle = math.atan2(self.vel_y, self.vel_x)
+        direction_rad = math.radians(self.direction)
+        angle_diff = math.degrees((vel_angle - direction_rad + math.pi) % (2 * math.pi) - math.pi)
+        diff = abs(angle_diff)
+        modded = 90 - abs(90 - diff)
+        drift_factor = modded / 90
+        self.drifting = drift_factor > 0.1 and self.speed > 200
+
+        self.drift_turn_strength = self.turn_strength * (0.5 + drift_factor)
+
+        ang_vel = math.atan2(self.vel_y, self.vel_x)
+        ang_head = math.radians(self.direction)
+        ang_diff = (ang_vel - ang_head + math.pi) % (2 * math.pi) - math.pi
+        corr = drift_factor * self.friction * self.speed
+        lat_ang = ang_head + (math.pi / 2 if ang_diff < 0 else -math.pi / 2)
+        # vel is a per-tick displacement, so the correction scales with dt squared
+        tick_scale = dt / REFERENCE_TICK
+        self.vel_x += math.cos(lat_ang) * corr * dt * tick_scale
+        self.vel_y += math.sin(lat_ang) * corr * dt * tick_scale
+
+        fade = drift_factor * 0.01 * (1 - self.speed / self.speed_cap)
+        self.vel_x *= (1 - fade) ** tick_scale
+        self.vel_y *= (1 - fade) ** tick_scale
+
+        measured = math.hypot(self.vel_x, self.vel_y) / dt
+        head_rad = math.radians(self.direction)
+        proj = self.vel_x * math.cos(head_rad) + self.vel_y * math.sin(head_rad)
+        self.speed = math.copysign(measured, proj)
+
+    def get_hitbox_corners(self, fx=None, fy=None):
+        if fx is None or fy is None:
+            fx, fy = self.x, self.y
+
+        hw, hh = self.hitbox_width / 2, self.hitbox_height / 2
+        fhw, fhh = (self.hitbox_width + 160) / 2, hh
+        theta = math.radians(self.direction)
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+
+        def compute_corners(cx, cy, w, h):
+            local_corners = [(-w, h), (w, h), (w, -h), (-w, -h)]
+            return [
+                (cx + dx * cos_t - dy * sin_t, cy + dx * sin_t + dy * cos_t)
+                for dx, dy in local_corners
+            ]
+
+        corners = compute_corners(self.x, self.y, hw, hh)
+        future_corners = compute_corners(fx, fy, fhw, fhh)
+        return corners, future_corners
+
+    def update_corners_states(self, corners, future_corners, track):
+        points = np.array(corners + future_corners, dtype=np.float64)
+        surfaces = track.classify_points(points[:, 0], points[:, 1])
+        # Anything off the marked track behaves like a wall
+        states = np.where(surfaces == SURFACE_OFF_TRACK, SURFACE_WALL, surfaces).tolist()
+
+        return states[:4], states[4:]
+
+    def _register_collision(self):
+        """Counts collision ticks; the sound is due on the first one and every 20th after."""
+        if self.collision_frames % 20 == 0:
+            self.collision_sound_due = True
+        self.collision_frames += 1
+
+    def update_hitbox_corners(self, track, dt):
+        corners, future_corners = self.get_hitbox_corners()
+        corner_states, future_states = self.update_corners_states(corners, future_corners, track)
+
+        if 2 not in corner_states:
+            corner_states = [3 if s == 4 else s for s in corner_states]
+
+        collision_detected = any(s == 3 for s in corner_states) and corner_states != [3, 3, 3, 3]
+        inside_wall_indices = [i for i, state in enumerate(corner_states) if state == 3]
+
+        self.collision_correction_x = 0.0
+        self.collision_correction_y = 0.0
+
+        if collision_detected:
+            self._register_collision()
+            self._resolve_wall_collision(track, [corners[i] for i in inside_wall_indices], dt)
+        else:
+            self.collision_frames = 0
+
+        # --- Lap/checkpoint logic unchanged ---
+        if any(state == 1 for state in corner_states):
+            if not self.lap_started:
+                self.lap_started = True
+                self.checkpoint_reached = False
+                self.timer = 0
+                print("Lap timer started!")
+
+        # Check for checkpoint (value 5)
+        elif any(state == 5 for state in corner_states):
+            if self.lap_started:
+                self.checkpoint_reached = True
+                print("Checkpoint reached!")
+
+        # Check for finish (value 2)
+        elif any(state == 2 for state in corner_states):
+            if self.lap_started and self.checkpoint_reached and self.timer > 1:
+                self.is_lap_finished = True
+                self.lap_started = False
+                self.checkpoint_reached = False
+                print("Lap finished!")
+
+    def collide_with_trees(self, trees, dt):
+        """Treats tree trunks as solid circles and pushes the car out of them."""
+        hw, hh = self.hitbox_width / 2, self.hitbox_height / 2
+        radius = trees.trunk_radius
+        center_x, center_y = self.x, self.y
+        trunks = trees.trees_near(center_x, center_y, math.hypot(hw, hh) + radius)
+        if not len(trunks):
+            return
+
+        theta = math.radians(self.direction)
+        cos_t, sin_t = math.cos(theta), math.sin(theta)
+        hit = False
+
+        for trunk_x, trunk_y in trunks.tolist():
+            # Trunk center in the car's local frame
+            rel_x, rel_y = trunk_x - center_x, trunk_y - center_y
+            local_x = rel_x * cos_t + rel_y * sin_t
+            local_y = -rel_x * sin_t + rel_y * cos_t
+            closest_x = max(-hw, min(hw, local_x))
+            closest_y = max(-hh, min(hh, local_y))
+
+            off_x, off_y = closest_x - local_x, closest_y - local_y
+            dist = math.hypot(off_x, off_y)
+            if dist >= radius:
+                continue
+            if dist == 0:
+                # Trunk center inside the hitbox, push straight away from it
+                off_x, off_y = -local_x, -local_y
+                dist = math.hypot(off_x, off_y) or 1.0
+            hit = True
+
+            normal_x = (off_x * cos_t - off_y * sin_t) / dist
+            normal_y = (off_x * sin_t + off_y * cos_t) / dist
+            penetration = radius - math.hypot(closest_x - local_x, closest_y - local_y)
+            self.collision_correction_x += normal_x * penetration
+            self.collision_correction_y += normal_y * penetration
+
+            into_tree = self.vel_x * normal_x + self.vel_y * normal_y
+            if into_tree < 0:
+                self.vel_x -= normal_x * into_tree * 1.3
+                self.vel_y -= normal_y * into_tree * 1.3
+
+        if hit:
+            self._register_collision()
+            self._update_cached_trig()
+            self.speed = (self.vel_x * self._cached_cos + self.vel_y * self._cached_sin) / dt
+
+    def _resolve_wall_collision(self, track, wall_corners, dt):
+        """Pushes the car out of the wall along the wall normal in a single step and bounces it off."""
+        xs = [x for x, _ in wall_corners]
+        ys = [y for _, y in wall_corners]
+        distances, normals_x, normals_y = track.wall_distance(xs, ys)
+
+        # The deepest corner decides the push, the mask resolution is the safety margin
+        deepest = int(np.argmin(distances))
+        depth = -float(distances[deepest]) + track.scale / 2
+        normal_x, normal_y = float(normals_x[deepest]), float(normals_y[deepest])
+        contact_x, contact_y = wall_corners[deepest]
+
+        if depth <= 0 or (normal_x == 0 and normal_y == 0):
+            # Soft walls are not in the distance field, fall back to pushing towards the car center
+            normal_x, normal_y = self.x - contact_x, self.y - contact_y
+            length = math.hypot(normal_x, normal_y) or 1.0
+            normal_x, normal_y = normal_x / length, normal_y / length
+            depth = track.scale
+
+        self.collision_correction_x = normal_x * depth
+        self.collision_correction_y = normal_y * depth
+
+        into_wall = self.vel_x * normal_x + self.vel_y * normal_y
+        if into_wall < 0:
+            impact_factor = abs(self.speed / self.speed_cap)
+            head_on = -into_wall / (math.hypot(self.vel_x, self.vel_y) or 1.0)
+
+            # Cancel the velocity going into the wall and bounce a bit
+            self.vel_x -= normal_x * into_wall * (1 + self.wall_restitution)
+            self.vel_y -= normal_y * into_wall * (1 + self.wall_restitution)
+
+            # Spin from where the wall hit the car
+            lever_x, lever_y = contact_x - self.x, contact_y - self.y
+            lever = (lever_x * normal_y - lever_y * normal_x) / (math.hypot(lever_x, lever_y) or 1.0)
+            self.angular_velocity += lever * self.collision_spin_force * impact_factor * 20
+
+            if impact_factor > 0.7 and head_on > 0.7:
+                self.crashed = True
+
+            self._update_cached_trig()
+            self.speed = (self.vel_x * self._cached_cos + self.vel_y * self._cached_sin) / dt
+
+    def get_trail_pos(self):
+        corners, _ = self.get_hitbox_corners()
+        return [corners[0], corners[3]]
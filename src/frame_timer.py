@@ -0,0 +1,105 @@
+import time
+import numpy as np
+
+
+class _Scope:
+    """Reusable context manager that adds its elapsed time to one timer entry."""
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class FrameTimer:
+    """
+    Rolling per-frame timings of named scopes, in seconds.
+
+        with frame_timer.scope("physics"):
+            ...
+
+    A scope entered several times in one frame (one per physics tick) is
+    summed. end_frame() moves the frame's totals into ring buffers of the
+    last `history` frames, which the percentile queries read from.
+    """
+    FRAME = "frame"
+
+    def __init__(self, history=300):
+        self.history = history
+        self.samples = {}
+        self.counts = {}
+        self._current = {}
+        self._scopes = {}
+        self._frame_start = None
+
+    def scope(self, name):
+        scope = self._scopes.get(name)
+        if scope is None:
+            scope = self._scopes[name] = _Scope(self, name)
+        return scope
+
+    def add(self, name, seconds):
+        self._current[name] = self._current.get(name, 0.0) + seconds
+
+    def end_frame(self):
+        """Closes the current frame. The time since the last call is recorded as "frame"."""
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            self._current[FrameTimer.FRAME] = now - self._frame_start
+        self._frame_start = now
+
+        for name, seconds in self._current.items():
+            buffer = self.samples.get(name)
+            if buffer is None:
+                buffer = self.samples[name] = np.zeros(self.history, dtype=np.float64)
+                self.counts[name] = 0
+            buffer[self.counts[name] % self.history] = seconds
+            self.counts[name] += 1
+        self._current = {}
+
+    def names(self):
+        return list(self.samples)
+
+    def recent(self, name):
+        """The recorded frames of a scope, oldest first."""
+        buffer = self.samples.get(name)
+        if buffer is None:
+            return np.empty(0)
+        count = self.counts[name]
+        if count < self.history:
+            return buffer[:count].copy()
+        return np.roll(buffer, -(count % self.history))
+
+    def percentiles(self, name, qs=(50, 95, 99)):
+        """Percentiles of a scope over the recorded frames, in milliseconds."""
+        values = self.recent(name)
+        if not len(values):
+            return tuple(0.0 for _ in qs)
+        return tuple(float(v) * 1000 for v in np.percentile(values, qs))
+
+    def summary(self):
+        """{name: {"p50": ms, "p95": ms, "p99": ms, "last": ms}} for every scope."""
+        result = {}
+        for name in self.samples:
+            p50, p95, p99 = self.percentiles(name)
+            result[name] = {"p50": p50, "p95": p95, "p99": p99, "last": float(self.recent(name)[-1]) * 1000}
+        return result
+
+    def within_budget(self, name, budget_ms, percentile=95):
+        """True if the scope stays under budget_ms at the given percentile."""
+        return self.percentiles(name, (percentile,))[0] <= budget_ms
+
+    def reset(self):
+        self.samples = {}
+        self.counts = {}
+        self._current = {}
+        self._frame_start = None
@@ -1,16 +1,21 @@
-import pyglet
+from collections import namedtuple
 from pyglet.window import key
 from objects import Track, Trail
 import objects
 from tree_manager import TreeManager
+from camera import Camera, CameraGroup
+from car_physics import REFERENCE_TICK
+from main_utils import load_tree_positions
 
 class GameWorld:
     """
     Manages all the objects that make up the game world.
     This includes the track, decorations, and trees.
+    World objects stay at fixed world coordinates, only the camera moves.
     """
-    def __init__(self, window, batch, map_data, assets):
+    def __init__(self, window, batch, map_data, assets, tree_seed=None, tree_positions=None):
         map_scale = map_data["scale"]
+        self.camera = Camera(window)
 
         self.track = Track(
             map_data["color_img"],
@@ -18,6 +23,10 @@ class GameWorld:
             window,
             scale=map_scale,
             batch=batch,
+            group=CameraGroup(self.camera, 2),
+            mask_pixels=map_data.get("mask_pixels"),
+            surfaces=map_data.get("surfaces"),
+            wall_field=map_data.get("wall_field"),
         )
 
         self.decorations = objects.static_object.StaticObject(
@@ -25,7 +34,7 @@ class GameWorld:
             window,
             scale=map_scale,
             batch=batch,
-            group=pyglet.graphics.Group(6),
+            group=CameraGroup(self.camera, 6),
         )
 
         self.tree_manager = TreeManager(
@@ -35,27 +44,32 @@ class GameWorld:
             world_width=self.track.scaled_size[0],
             world_height=self.track.scaled_size[1],
             batch=batch,
+            group=CameraGroup(self.camera, 7),
         )
-        self.tree_manager.generate_trees(1000, self.track)
+        if tree_positions is None:
+            tree_positions = load_tree_positions(map_data["name"], self.track, tree_seed)
+        self.tree_manager.set_positions(tree_positions)
 
-        self.trail = Trail(batch=batch)
+        self.trail = Trail(self.camera, batch=batch)
 
-    def update(self, dx, dy, car=None):
-        """Updates the position of all world objects."""
-        self.track.update(dx, dy)
-        self.decorations.update(dx, dy)
-        self.tree_manager.update(dx, dy, None) 
+    def update(self, dt, car=None):
+        """Updates the world objects that change over time."""
+        self.tree_manager.update(self.camera)
         if car:
-            self.trail.update(dx, dy, car)
+            self.trail.update(car, dt)
 
     def cleanup(self):
         """Prepares world objects for deletion."""
+        self.camera = None
         self.track = None
         self.decorations = None
         self.tree_manager = None
         self.trail = None
 
 
+RaceState = namedtuple("RaceState", ["current_lap", "lap_times", "time_after_crash", "is_race_finished"])
+
+
 class RaceManager:
     """
     Manages the state and rules of the race, like laps, timing, and crashes.
@@ -67,6 +81,7 @@ class RaceManager:
         self.is_race_finished = False
         self.current_lap = 1
         self.total_laps = 0
+        self.lap_times = []
         self.spawn_point = (0, 0)
 
     def start_race(self, laps, spawn_point):
@@ -74,18 +89,33 @@ class RaceManager:
         self.total_laps = laps
         self.spawn_point = spawn_point
         self.current_lap = 1
+        self.lap_times = []
         self.is_race_finished = False
 
+    def snapshot(self):
+        return RaceState(self.current_lap, tuple(self.lap_times), self.time_after_crash, self.is_race_finished)
+
+    def restore(self, state):
+        self.current_lap = state.current_lap
+        self.lap_times = list(state.lap_times)
+        self.time_after_crash = state.time_after_crash
+        self.is_race_finished = state.is_race_finished
+        self.game.lap_time = self.car.timer
+        self.game.main_menu.show_lap_times(self.lap_times)
+
     def update(self, dt):
         """Handles race logic each frame."""
         if self.car.is_lap_finished:
             self.current_lap += 1
+            self.lap_times.append(self.car.timer)
+            self.game.finish_ghost_lap(self.car.timer)
             self.car.timer = 0
             self.car.is_lap_finished = False
             if self.current_lap > self.total_laps:
                 total_time = self.game.main_menu.count_total_time()
                 self.is_race_finished = True
                 self.game.add_score(total_time[0], total_time[1])
+                self.game.save_replay()
 
         self.car.timer += dt
         self.game.lap_time = self.car.timer # UI label
@@ -96,8 +126,8 @@ class RaceManager:
     def handle_crash(self, dt):
         """Manages the logic for when the car has crashed."""
         self.time_after_crash += dt
-        self.car.vel_x *= 0.92
-        self.car.vel_y *= 0.92
+        self.car.vel_x *= 0.92 ** (dt / REFERENCE_TICK)
+        self.car.vel_y *= 0.92 ** (dt / REFERENCE_TICK)
         if self.car.update_pitch:
             self.car.engine_player.pitch = 0.3
 
@@ -106,7 +136,10 @@ class RaceManager:
             self.car.crashed = False
             self.car.drifting = False
             self.game.teleport_car_to_pos(self.spawn_point[0], self.spawn_point[1], -180)
+            if self.game.race_progress is not None:
+                self.game.race_progress.respawn([0], [self.car.x], [self.car.y])
             self.car.timer = 0
+            self.game.ghost_recorder.stop()  # The timer now runs from the spawn point, not from the start line
 
 
 class InputHandler:
@@ -120,6 +153,8 @@ class InputHandler:
         self.r_pressed_last = False
         self.f_pressed_last = False
         self.e_pressed_last = False
+        self.f3_pressed_last = False
+        self.f9_pressed_last = False
 
     def update(self):
         """Checks for and acts on key presses."""
@@ -129,10 +164,8 @@ class InputHandler:
         self.p_pressed_last = p_pressed
 
         r_pressed = self.keys[key.R]
-        if r_pressed and not self.r_pressed_last:
-#            self.game.cleanup_game_objects()
-            self.game.is_on_menu = True
-            self.game.paused = True
+        if r_pressed and not self.r_pressed_last and self.game.race_manager and not self.game.is_on_menu:
+            self.game.restart_race()
         self.r_pressed_last = r_pressed
 
         f_pressed = self.keys[key.F]
@@ -145,3 +178,13 @@ class InputHandler:
         if e_pressed and not self.e_pressed_last:
             self.game.settings=False
         self.e_pressed_last = e_pressed
+
+        f3_pressed = self.keys[key.F3]
+        if f3_pressed and not self.f3_pressed_last:
+            self.game.frame_overlay.toggle()
+        self.f3_pressed_last = f3_pressed
+
+        f9_pressed = self.keys[key.F9]
+        if f9_pressed and not self.f9_pressed_last:
+            self.game.start_profile()
+        self.f9_pressed_last = f9_pressed
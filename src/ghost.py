@@ -0,0 +1,240 @@
+import struct
+import numpy as np
+import pyglet
+from camera import CameraGroup
+
+# Fixed point steps: 1/16 world pixel and 1/64 degree per unit
+POSITION_SCALE = 16
+DIRECTION_SCALE = 64
+
+GHOST_MAGIC = b"GHST"
+GHOST_VERSION = 1
+_HEADER = struct.Struct("<4sBHIdqqq")  # magic, version, tick rate, ticks, lap time, first x, y, direction
+_DELTA_LIMIT = np.iinfo(np.int16).max
+
+
+def sprite_frame(direction):
+    """Index into the 8 frame car sheet for a direction, the same one player.Car shows."""
+    return round(0 - direction / 45) % 8
+
+
+class GhostLap:
+    """
+    One recorded lap: the fixed point state of the first tick and int16
+    deltas for every tick after it, 6 bytes per tick. The sprite frame is
+    not stored, it follows from the direction.
+    """
+    def __init__(self, tick_rate, lap_time, start, deltas):
+        self.tick_rate = tick_rate
+        self.lap_time = lap_time
+        self.start = start
+        self.deltas = deltas
+
+        # Absolute positions for playback, so any lap time is one index away
+        fixed = np.cumsum(deltas, axis=0, dtype=np.int64) + np.array(start, dtype=np.int64)
+        self.xs = fixed[:, 0] / POSITION_SCALE
+        self.ys = fixed[:, 1] / POSITION_SCALE
+        self.directions = fixed[:, 2] / DIRECTION_SCALE
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def state_at(self, lap_time):
+        """(x, y, direction) of the car lap_time seconds into the lap, None past its end."""
+        # Tick k was recorded at (k + 1) / tick_rate seconds
+        position = lap_time * self.tick_rate - 1
+        if position > len(self) - 1:
+            return None
+        position = max(position, 0.0)
+        i = int(position)
+        j = min(i + 1, len(self) - 1)
+        t = position - i
+        turn = (self.directions[j] - self.directions[i] + 180) % 360 - 180
+        return (
+            self.xs[i] + (self.xs[j] - self.xs[i]) * t,
+            self.ys[i] + (self.ys[j] - self.ys[i]) * t,
+            (self.directions[i] + turn * t) % 360,
+        )
+
+    def to_bytes(self):
+        header = _HEADER.pack(GHOST_MAGIC, GHOST_VERSION, self.tick_rate, len(self), self.lap_time, *self.start)
+        return header + self.deltas.astype("<i2").tobytes()
+
+    @classmethod
+    def from_bytes(cls, data):
+        try:
+            magic, version, tick_rate, ticks, lap_time, *start = _HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(f"Broken ghost data: {e}")
+        if magic != GHOST_MAGIC or version != GHOST_VERSION:
+            raise ValueError(f"Unsupported ghost data (version {version})")
+        deltas = np.frombuffer(data, dtype="<i2", count=ticks * 3, offset=_HEADER.size).reshape(ticks, 3)
+        return cls(tick_rate, lap_time, tuple(start), deltas)
+
+
+class LapDelta:
+    """
+    Live time difference between the car and a GhostLap. The car is
+    projected onto the recorded path near a cursor that follows it along
+    the lap, so an update only looks at a short window of samples. Off the
+    path the cursor stays where the car left it, and the car is looked for
+    within search_seconds behind it up to twice that ahead.
+    """
+    def __init__(self, lap, lost_distance=150, search_seconds=5):
+        self.lap = lap
+        self.ahead = max(lap.tick_rate // 2, 2)
+        self.behind = max(lap.tick_rate // 8, 1)
+        self.search = int(search_seconds * lap.tick_rate)
+        self.lost_distance_sq = lost_distance ** 2
+        self.cursor = None
+        self.lost_since = None  # Lap time the car left the path at, None on it
+        self.last_time = 0.0
+
+    def update(self, x, y, lap_time):
+        """Seconds the car is behind (positive) or ahead of the recorded lap, None away from its path."""
+        lap = self.lap
+        if lap_time < self.last_time:
+            self.cursor = None  # A new lap, a respawn or a rollback
+        self.last_time = lap_time
+
+        if self.cursor is None:
+            # Searching the lap up to a little after the same time keeps the
+            # end of the lap out of the search near the start line
+            i = self._nearest(x, y, 0, int((lap_time + 5) * lap.tick_rate))
+            if i is None:
+                self.cursor = min(int(lap_time * lap.tick_rate), len(lap) - 1)
+                self.lost_since = lap_time
+                return None
+        else:
+            i = None
+            if self.lost_since is None:
+                i = self._nearest(x, y, self.cursor - self.behind, self.cursor + self.ahead)
+                if i is None:
+                    self.lost_since = lap_time
+            if i is None:
+                # Found again near where it left, or up to as far on as the recorded lap got meanwhile
+                gone = min(int((lap_time - self.lost_since) * lap.tick_rate), self.search)
+                i = self._nearest(x, y, self.cursor - self.search, self.cursor + gone + self.search)
+                if i is None:
+                    return None
+        self.cursor = i
+        self.lost_since = None
+
+        # Tick k was recorded at (k + 1) / tick_rate seconds
+        return float(lap_time - (self._progress(x, y, i) + 1) / lap.tick_rate)
+
+    def _nearest(self, x, y, start, end):
+        """Index of the sample in [start, end) closest to x, y, None if none is near."""
+        start = max(start, 0)
+        end = min(end, len(self.lap))
+        if start >= end:
+            return None
+        dx = self.lap.xs[start:end] - x
+        dy = self.lap.ys[start:end] - y
+        distances = dx * dx + dy * dy
+        i = int(np.argmin(distances))
+        if distances[i] > self.lost_distance_sq:
+            return None
+        return start + i
+
+    def _progress(self, x, y, i):
+        """Fractional sample index of x, y projected onto the path next to sample i."""
+        xs, ys = self.lap.xs, self.lap.ys
+        best = (float("inf"), float(i))
+        for a in (i - 1, i):
+            b = a + 1
+            if a < 0 or b >= len(xs):
+                continue
+            sx, sy = xs[b] - xs[a], ys[b] - ys[a]
+            length_sq = sx * sx + sy * sy
+            t = 0.0 if length_sq == 0 else min(max(((x - xs[a]) * sx + (y - ys[a]) * sy) / length_sq, 0.0), 1.0)
+            px, py = xs[a] + sx * t - x, ys[a] + sy * t - y
+            best = min(best, (px * px + py * py, a + t))
+        return best[1]
+
+
+class GhostRecorder:
+    """
+    Records the car once per physics tick into a preallocated delta buffer,
+    from the tick its lap timer starts at the start line until the lap is
+    finished. Laps longer than the buffer or with a jump a delta cannot hold
+    (a teleport) are dropped instead of saved.
+    """
+    def __init__(self, tick_rate, max_lap_seconds=600):
+        self.tick_rate = tick_rate
+        self.buffer = np.zeros((int(tick_rate * max_lap_seconds), 3), dtype=np.int16)
+        self.stop()
+
+    def start_lap(self):
+        """Call on the tick the lap timer restarts at 0, that tick is recorded as the lap's first."""
+        self.recording = True
+        self.ticks = 0
+        self.valid = True
+        self.start = None
+        self.last = None
+
+    def stop(self):
+        """Nothing is recorded until the next start_lap()."""
+        self.start_lap()
+        self.recording = False
+
+    def record(self, x, y, direction):
+        if not self.recording:
+            return
+        fixed = (round(x * POSITION_SCALE), round(y * POSITION_SCALE), round(direction * DIRECTION_SCALE))
+        if self.last is None:
+            self.start = self.last = fixed
+            delta = (0, 0, 0)
+        else:
+            delta = (fixed[0] - self.last[0], fixed[1] - self.last[1], fixed[2] - self.last[2])
+            self.last = fixed
+
+        if self.ticks >= len(self.buffer) or max(abs(delta[0]), abs(delta[1]), abs(delta[2])) > _DELTA_LIMIT:
+            self.valid = False
+        if self.valid:
+            self.buffer[self.ticks] = delta
+        self.ticks += 1
+
+    def discard_lap(self):
+        """The current lap will not be kept, used when the race is rolled back into it."""
+        self.valid = False
+
+    def finish_lap(self, lap_time):
+        """The recorded lap as a GhostLap, None if it could not be kept. Records nothing until the next start_lap()."""
+        lap = None
+        if self.recording and self.valid and self.ticks:
+            lap = GhostLap(self.tick_rate, lap_time, self.start, self.buffer[:self.ticks].copy())
+        self.stop()
+        return lap
+
+
+class Ghost:
+    """A translucent car replaying a GhostLap, drawn below the player's car."""
+    def __init__(self, lap, car_sheet, scale, batch, camera, opacity=110):
+        self.lap = lap
+        self.textures = pyglet.image.ImageGrid(car_sheet, rows=1, columns=8)
+        self.textures.anchor_x = self.textures.width // 2
+        self.textures.anchor_y = self.textures.height // 2
+        self.sprite = pyglet.sprite.Sprite(self.textures[0], batch=batch, group=CameraGroup(camera, 4))
+        self.sprite.scale = scale
+        self.sprite.opacity = opacity
+        self.sprite.visible = False
+        self.frame = 0
+        self.delta = LapDelta(lap)
+
+    def show_at(self, lap_time):
+        """Moves the ghost to where the recorded lap was at lap_time, hiding it once the lap is over."""
+        state = self.lap.state_at(lap_time)
+        if state is None:
+            self.sprite.visible = False
+            return
+        x, y, direction = state
+        frame = sprite_frame(direction)
+        if frame != self.frame:
+            self.frame = frame
+            self.sprite.image = self.textures[frame]
+        self.sprite.position = (x - self.sprite.width / 2, y - self.sprite.height / 2, 0)
+        self.sprite.visible = True
+
+    def delete(self):
+        self.sprite.delete()
@@ -0,0 +1,222 @@
+"""
+Client side of a LAN race, without any pyglet: joins a lan_server.py,
+sends the driver input every tick and keeps the snapshots it receives,
+decoded and ready to be drawn a little in the past.
+"""
+import random
+import socket
+import time
+from collections import deque
+
+import netcode
+from replay import encode_controls
+
+JOIN_RETRY = 0.25  # Seconds between JOIN packets while waiting for the WELCOME
+KEEP_ALIVE = 0.5  # Seconds between packets while no input goes out
+
+
+def parse_address(text, default_port=netcode.DEFAULT_PORT):
+    """("host", port) from "host" or "host:port"."""
+    host, _, port = text.rpartition(":")
+    if not host:
+        return text, default_port
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError(f"Bad port in {text}")
+
+
+class RaceClient:
+    """
+    One player's connection, to a lan_server.py or to a race_host.py, which
+    starts a race of the player's own on map_name. send_input() goes out
+    every physics tick, poll() reads every snapshot that arrived and
+    acknowledges the newest one, so the server can send only what changed
+    since.
+
+    Snapshots are drawn interpolation_delay ticks behind the estimated server
+    tick, two snapshot intervals by default, which hides a late or lost one.
+    packet_loss drops that share of the incoming packets on purpose, for tests.
+    """
+    def __init__(self, address, car_index=0, map_name="", timeout=3.0, packet_loss=0.0, seed=None):
+        self.address = (socket.gethostbyname(address[0]), address[1])
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.packet_loss = packet_loss
+        self.random = random.Random(seed)
+
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.snapshots = 0
+        self.missing_baselines = 0
+        self.connected_at = self._last_send = time.perf_counter()
+        self._join(car_index, map_name, timeout)
+        self.sock.setblocking(False)
+
+        self.seq = 0
+        self.inputs = deque(maxlen=netcode.INPUT_REDUNDANCY)
+        self.received = {}  # tick -> cars, the baselines the server may send deltas against
+        self.buffer = deque(maxlen=2 * self.snapshot_rate)  # (tick, cars) in tick order, for interpolation
+        self.latest_tick = netcode.NO_TICK
+        self.ack_seq = 0
+        self.interpolation_delay = 2 * self.tick_rate / self.snapshot_rate
+        self._clock_offset = None
+
+    def _join(self, car_index, map_name, timeout):
+        """Sends JOIN until the server answers. Raises ConnectionError when it refuses or does not answer."""
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            self._send(netcode.encode_join(car_index, map_name))
+            self.sock.settimeout(JOIN_RETRY)
+            try:
+                data, address = self.sock.recvfrom(netcode.MAX_PACKET)
+            except socket.timeout:
+                continue
+            except OSError:
+                # Nobody listening on the port, some systems say so right away
+                time.sleep(JOIN_RETRY)
+                continue
+            try:
+                kind = netcode.packet_type(data)
+                if kind == netcode.REJECT:
+                    reason = netcode.decode_reject(data)
+                    raise ConnectionError(f"The server refused to join: {netcode.REJECT_REASONS.get(reason, reason)}")
+                if kind == netcode.WELCOME:
+                    self.bytes_received += len(data)
+                    (self.player_id, self.car_index, self.tick_rate, self.snapshot_rate,
+                     self.spawn_point, self.map_name) = netcode.decode_welcome(data)
+                    return
+            except netcode.ProtocolError:
+                continue
+        raise ConnectionError(f"No answer from {self.address[0]}:{self.address[1]}")
+
+    def _send(self, data):
+        try:
+            self.sock.sendto(data, self.address)
+            self.bytes_sent += len(data)
+            self._last_send = time.perf_counter()
+        except OSError as e:
+            print(f"Warning: Could not send to the server: {e}")
+
+    def keep_alive(self, now=None):
+        """Repeats the last INPUT packet now and then while the game is paused, so the server keeps the slot."""
+        now = time.perf_counter() if now is None else now
+        if now - self._last_send > KEEP_ALIVE:
+            self._send(netcode.encode_input(self.player_id, self.latest_tick, self.seq, list(self.inputs)))
+
+    def send_input(self, controls):
+        """Sends the controls of the next tick together with the last few. Returns the input's seq."""
+        self.seq += 1
+        self.inputs.append(encode_controls(controls))
+        self._send(netcode.encode_input(self.player_id, self.latest_tick, self.seq, list(self.inputs)))
+        return self.seq
+
+    def poll(self, now=None):
+        """Reads every waiting snapshot. Returns True when a newer one arrived."""
+        now = time.perf_counter() if now is None else now
+        updated = False
+        while True:
+            try:
+                data = self.sock.recv(netcode.MAX_PACKET)
+            except (BlockingIOError, InterruptedError):
+                return updated
+            except OSError:
+                continue
+            if self.packet_loss and self.random.random() < self.packet_loss:
+                continue
+            self.bytes_received += len(data)
+            try:
+                if netcode.packet_type(data) != netcode.SNAPSHOT:
+                    continue
+                baseline_tick = netcode.snapshot_baseline(data)
+                baseline = None
+                if baseline_tick != netcode.NO_TICK:
+                    baseline = self.received.get(baseline_tick)
+                    if baseline is None:
+                        self.missing_baselines += 1
+                        continue
+                tick, ack_seq, cars = netcode.decode_snapshot(data, baseline)
+            except netcode.ProtocolError as e:
+                print(f"Warning: Dropped a snapshot: {e}")
+                continue
+
+            self.snapshots += 1
+            self.received[tick] = cars
+            if tick <= self.latest_tick:
+                continue  # Overtaken by a newer one, only good as a baseline
+            self.latest_tick = tick
+            self.ack_seq = ack_seq
+            self.buffer.append((tick, cars))
+            self._update_clock(now, tick)
+            oldest = tick - 2 * self.tick_rate
+            for old in [old for old in self.received if old < oldest]:
+                del self.received[old]
+            updated = True
+
+    def _update_clock(self, now, tick):
+        """
+        Offset between local time in ticks and the server tick. The fastest
+        snapshots are the least delayed, so the offset follows any that came
+        quicker at once and a slower trend only gradually.
+        """
+        offset = now * self.tick_rate - tick
+        if self._clock_offset is None or offset < self._clock_offset:
+            self._clock_offset = offset
+        else:
+            self._clock_offset += (offset - self._clock_offset) * 0.01
+
+    def server_tick(self, now=None):
+        """Estimated tick the server is on right now, fractional."""
+        if self._clock_offset is None:
+            return float(self.latest_tick)
+        now = time.perf_counter() if now is None else now
+        return now * self.tick_rate - self._clock_offset
+
+    @property
+    def own_car(self):
+        """This player's car in the newest snapshot as a netcode.dequantize_car dict, None before the first."""
+        if not self.buffer:
+            return None
+        fixed = self.buffer[-1][1].get(self.player_id)
+        return netcode.dequantize_car(fixed) if fixed is not None else None
+
+    def interpolated(self, now=None):
+        """
+        {player id: (x, y, direction, car index)} of every car
+        interpolation_delay ticks in the past, between the two snapshots
+        around that moment. Holds the newest snapshot when none is newer.
+        """
+        if not self.buffer:
+            return {}
+        render_tick = self.server_tick(now) - self.interpolation_delay
+        before = after = self.buffer[-1]
+        for entry in reversed(self.buffer):
+            if entry[0] <= render_tick:
+                before = entry
+                break
+            after = before = entry
+
+        span = after[0] - before[0]
+        t = min(max((render_tick - before[0]) / span, 0.0), 1.0) if span else 0.0
+        cars = {}
+        for player_id, b in after[1].items():
+            a = before[1].get(player_id, b)
+            turn = ((b[3] - a[3]) / netcode.DIRECTION_SCALE + 180) % 360 - 180
+            cars[player_id] = (
+                (a[1] + (b[1] - a[1]) * t) / netcode.POSITION_SCALE,
+                (a[2] + (b[2] - a[2]) * t) / netcode.POSITION_SCALE,
+                (a[3] / netcode.DIRECTION_SCALE + turn * t) % 360,
+                b[0],
+            )
+        return cars
+
+    def stats(self, now=None):
+        """Bytes per second both ways since joining."""
+        now = time.perf_counter() if now is None else now
+        seconds = max(now - self.connected_at, 1e-9)
+        return {"down": self.bytes_received / seconds, "up": self.bytes_sent / seconds}
+
+    def close(self):
+        try:
+            self._send(netcode.header(netcode.LEAVE))
+        finally:
+            self.sock.close()
@@ -0,0 +1,121 @@
+import math
+import time
+import pyglet
+import netcode
+from car_physics import REFERENCE_TICK
+from replay import encode_controls, decode_controls
+from ghost import sprite_frame
+from main_utils import load_assets, load_sprite_data
+
+# The own car is corrected when the server has it further away than this, in world pixels.
+# Bigger than the 1/16 px fixed point step, so rounding alone never triggers it.
+CORRECTION_DISTANCE = 1.0
+
+
+class LanRace:
+    """
+    The game side of a LAN race. The own car drives on the local physics
+    right away, every tick's input goes to the server and the state it
+    predicted is kept until the server has applied that input. When the
+    server's state differs, the car is put there and the inputs the server
+    has not seen yet are simulated again. The other players are drawn from
+    the snapshots, interpolated a little in the past.
+    """
+    def __init__(self, client, player, batch):
+        self.client = client
+        self.player = player
+        self.batch = batch
+        self.predictions = {}  # seq -> (control bits, PhysicsState after that tick)
+        self.corrections = 0
+        self.car_names = list(load_sprite_data(0))
+        self.sheets = {}  # car index -> (ImageGrid, scale) of the other players' cars
+        self.sprites = {}  # player id -> (Sprite, car index)
+
+    def step(self, dt, controls, track, trees):
+        """Call after the own car stepped one tick with controls."""
+        seq = self.client.send_input(controls)
+        self.predictions[seq] = (encode_controls(controls), self.player.physics.snapshot())
+        if self.client.poll():
+            self.reconcile(dt, track, trees)
+
+    def reconcile(self, dt, track, trees):
+        client = self.client
+        server = client.own_car
+        for seq in [seq for seq in self.predictions if seq < client.ack_seq]:
+            del self.predictions[seq]
+        predicted = self.predictions.get(client.ack_seq)
+        if server is None or predicted is None:
+            return
+
+        bits, state = predicted
+        flags = int(server["flags"])
+        crashed = bool(flags & netcode.FLAG_CRASHED)
+        if math.hypot(state.x - server["x"], state.y - server["y"]) <= CORRECTION_DISTANCE and state.crashed == crashed:
+            return
+
+        corrected = state._replace(
+            x=server["x"], y=server["y"], vel_x=server["vel_x"], vel_y=server["vel_y"], speed=server["speed"],
+            direction=server["direction"], angular_velocity=server["angular_velocity"],
+            drift_turn_strength=server["drift_turn_strength"], drifting=bool(flags & netcode.FLAG_DRIFTING),
+            crashed=crashed, lap_started=bool(flags & netcode.FLAG_LAP_STARTED),
+            checkpoint_reached=bool(flags & netcode.FLAG_CHECKPOINT_REACHED),
+        )
+        physics = self.player.physics
+        physics.restore(corrected)
+        self.predictions[client.ack_seq] = (bits, corrected)
+        for seq in range(client.ack_seq + 1, client.seq + 1):
+            bits = self.predictions[seq][0]
+            physics.step(dt, decode_controls(bits), track, trees)
+            physics.collision_sound_due = False
+            if physics.crashed:
+                # The slow down of a crashed car in RaceManager.update
+                physics.vel_x *= 0.92 ** (dt / REFERENCE_TICK)
+                physics.vel_y *= 0.92 ** (dt / REFERENCE_TICK)
+            self.predictions[seq] = (bits, physics.snapshot())
+        self.player.previous_x, self.player.previous_y = physics.x, physics.y
+        self.corrections += 1
+
+    def _sheet(self, car_index):
+        """Car frames and sprite scale of a car, the own car's when its image is missing."""
+        sheet = self.sheets.get(car_index)
+        if sheet is None:
+            sheet = (self.player.textures, self.player.sprite.scale)
+            if 0 <= car_index < len(self.car_names):
+                name = self.car_names[car_index]
+                image = load_assets([f"{name}_texture"])[f"{name}_texture"]
+                if image is not None:
+                    textures = pyglet.image.ImageGrid(image, rows=1, columns=8)
+                    textures.anchor_x = textures.width // 2
+                    textures.anchor_y = textures.height // 2
+                    sheet = (textures, load_sprite_data(0)[name]["scale"])
+            self.sheets[car_index] = sheet
+        return sheet
+
+    def sync_sprites(self, now=None):
+        """Moves the other players' sprites to where the snapshots put them right now."""
+        now = time.perf_counter() if now is None else now
+        cars = self.client.interpolated(now)
+        cars.pop(self.client.player_id, None)
+        for player_id in [player_id for player_id in self.sprites if player_id not in cars]:
+            self.sprites.pop(player_id)[0].delete()
+
+        for player_id, (x, y, direction, car_index) in cars.items():
+            textures, scale = self._sheet(car_index)
+            entry = self.sprites.get(player_id)
+            if entry is None or entry[1] != car_index:
+                if entry is not None:
+                    entry[0].delete()
+                sprite = pyglet.sprite.Sprite(textures[0], batch=self.batch, group=self.player.group)
+                sprite.scale = scale
+                entry = self.sprites[player_id] = (sprite, car_index)
+            sprite = entry[0]
+            frame = textures[sprite_frame(direction)]
+            if sprite.image is not frame:
+                sprite.image = frame
+            sprite.position = (x - sprite.width / 2, y - sprite.height / 2, 0)
+
+    def close(self):
+        for sprite, _ in self.sprites.values():
+            sprite.delete()
+        self.sprites = {}
+        self.client.close()
@@ -0,0 +1,365 @@
+"""
+Dedicated server of a LAN race: two to eight players on their own
+machines drive on one map. The server steps every car, clients only send
+their W/S/A/D state and draw what the snapshots tell them.
+
+    python3 src/lan_server.py --map track [--port 47610] [--snapshot-rate 30]
+
+Join with `python3 src/main.py --join HOST[:PORT]`.
+"""
+import argparse
+import socket
+import sys
+import time
+
+import numpy as np
+import pyglet
+pyglet.options['shadow_window'] = False  # Decoding the masks needs no GL context
+
+import netcode
+from main_utils import load_sprite_data
+from car_physics import CarControls
+from car_fleet import CarFleet, FleetRaceRules
+from opponents import grid_slots, START_DIRECTION
+from race_runner import load_track_mask, load_map_trees, create_car
+from frame_timer import FrameTimer
+from replay import decode_fleet_controls
+
+# Inputs waiting before a player's car gets a second step per tick to catch up
+CATCH_UP_BACKLOG = 2
+# Inputs waiting before the oldest are dropped, a client that hung for a second
+MAX_INPUT_BACKLOG = 60
+# Snapshot history kept for delta baselines, in seconds
+BASELINE_SECONDS = 1.0
+
+
+class Connection:
+    """One player: its address, the inputs waiting for their tick and what it has received."""
+    def __init__(self, player_id, address, car_index, now):
+        self.player_id = player_id
+        self.address = address
+        self.car_index = car_index
+        self.pending = {}  # seq -> control bits not applied yet
+        self.next_seq = None
+        self.applied_seq = 0
+        self.ack_tick = netcode.NO_TICK
+        self.last_heard = now
+        self.joined = now
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.snapshots = 0
+        self.full_snapshots = 0
+
+    def receive_inputs(self, inputs):
+        for seq, bits in inputs.items():
+            if self.next_seq is None or seq >= self.next_seq:
+                self.pending[seq] = bits
+        if self.next_seq is None and self.pending:
+            self.next_seq = min(self.pending)
+
+    def next_input(self):
+        """
+        Control bits of the next input in order, None while it has not
+        arrived. Inputs are never guessed, so the server drives exactly what
+        the client predicted, only later.
+        """
+        if len(self.pending) > MAX_INPUT_BACKLOG:
+            # Too far behind to catch up, skip to the recent inputs
+            self.next_seq = max(self.pending) - CATCH_UP_BACKLOG
+        elif self.next_seq not in self.pending and len(self.pending) >= netcode.INPUT_REDUNDANCY:
+            # More packets in a row were lost than each one repeats, that input is gone
+            self.next_seq = min(self.pending)
+        bits = self.pending.pop(self.next_seq, None)
+        if bits is not None:
+            self.applied_seq = self.next_seq
+            self.next_seq += 1
+            for seq in [seq for seq in self.pending if seq < self.next_seq]:
+                del self.pending[seq]
+        return bits
+
+
+class RaceServer:
+    """
+    Steps the cars of every connected player as one CarFleet at a fixed
+    tick rate, with the lap and crash rules of the single player race. A
+    car only moves when its player's input for the tick has arrived.
+    Every snapshot interval each client gets the fixed point state of all
+    cars as a delta against the newest snapshot it has acknowledged.
+    """
+    def __init__(self, map_name, host="0.0.0.0", port=netcode.DEFAULT_PORT, tick_rate=60, snapshot_rate=30,
+                 max_players=netcode.MAX_PLAYERS, timeout=5.0):
+        if tick_rate % snapshot_rate:
+            raise ValueError(f"The tick rate {tick_rate} is not a multiple of the snapshot rate {snapshot_rate}")
+        all_map_data = load_sprite_data(1)
+        if map_name not in all_map_data:
+            raise ValueError(f"Unknown map {map_name}, expected one of {', '.join(all_map_data)}")
+        map_data = all_map_data[map_name]
+
+        self.map_name = map_name
+        self.tick_rate = tick_rate
+        self.dt = 1 / tick_rate
+        self.snapshot_rate = snapshot_rate
+        self.snapshot_interval = tick_rate // snapshot_rate
+        self.timeout = timeout
+        self.tick = 0
+
+        self.track = load_track_mask(map_name)
+        self.trees = load_map_trees(map_name, self.track)
+
+        # One fleet slot per player, empty slots stand still on their grid spot
+        self.car_names = list(load_sprite_data(0))
+        template = create_car(self.car_names[0])
+        slots = grid_slots(self.track, map_data["spawn_point"], max_players, template.hitbox_width, template.hitbox_height)
+        if len(slots) < max_players:
+            print(f"Warning: Only {len(slots)} of {max_players} players fit on the start grid")
+        cars = []
+        for x, y in slots:
+            car = create_car(self.car_names[0])
+            # On the fixed point grid, so the clients spawn on exactly the same spot
+            car.x = round(x * netcode.POSITION_SCALE) / netcode.POSITION_SCALE
+            car.y = round(y * netcode.POSITION_SCALE) / netcode.POSITION_SCALE
+            car.direction = START_DIRECTION
+            cars.append(car)
+        self.fleet = CarFleet(cars)
+        self.rules = FleetRaceRules(self.fleet, map_data["total_laps"], START_DIRECTION)
+        self.car_index = np.zeros(len(cars), dtype=np.int64)
+        self.bits = np.zeros(len(cars), dtype=np.uint8)  # Control bits of every slot's last input
+        self.slots = [None] * len(cars)
+        self.connections = {}  # address -> Connection
+        self.history = {}  # tick -> {player id: fixed point car}, the baselines for deltas
+
+        self.timer = FrameTimer(history=10 * tick_rate)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def join(self, address, car_index, now):
+        """Gives a new player the first free grid slot, or tells it the race is full."""
+        connection = self.connections.get(address)
+        if connection is None:
+            if None not in self.slots:
+                self.send(address, netcode.encode_reject(netcode.REJECT_FULL))
+                return
+            player_id = self.slots.index(None)
+            car_index, car = self.create_car(car_index)
+            car.x, car.y = self.rules.start_x[player_id], self.rules.start_y[player_id]
+            car.direction = START_DIRECTION
+            self.fleet.set_car(player_id, car)
+            self.rules.laps[player_id] = 0
+            self.rules.time_after_crash[player_id] = 0
+            self.car_index[player_id] = car_index
+            connection = self.connections[address] = self.slots[player_id] = Connection(player_id, address, car_index, now)
+            print(f"Player {player_id} joined from {address[0]}:{address[1]} with {self.car_names[car_index]}")
+
+        # A repeated JOIN means our WELCOME got lost, it gets the same answer
+        player_id = connection.player_id
+        spawn_point = (self.rules.start_x[player_id], self.rules.start_y[player_id])
+        self.send(address, netcode.encode_welcome(
+            player_id, connection.car_index, self.tick_rate, self.snapshot_rate, spawn_point, self.map_name,
+        ))
+
+    def create_car(self, car_index):
+        """(car index, CarPhysics) of a player's pick, the first car when the pick is unknown here."""
+        if 0 <= car_index < len(self.car_names):
+            try:
+                return car_index, create_car(self.car_names[car_index])
+            except OSError as e:
+                print(f"Warning: Can not load car {car_index}, using {self.car_names[0]}: {e}")
+        return 0, create_car(self.car_names[0])
+
+    def leave(self, connection, reason):
+        print(f"Player {connection.player_id} {reason}")
+        del self.connections[connection.address]
+        self.slots[connection.player_id] = None
+
+    def send(self, address, data):
+        try:
+            self.sock.sendto(data, address)
+        except OSError as e:
+            print(f"Warning: Could not send to {address[0]}:{address[1]}: {e}")
+            return 0
+        connection = self.connections.get(address)
+        if connection is not None:
+            connection.bytes_sent += len(data)
+        return len(data)
+
+    def receive(self, now):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(netcode.MAX_PACKET)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # A client that went away makes some systems report an error on the next read
+                continue
+            try:
+                kind = netcode.packet_type(data)
+                if kind == netcode.JOIN:
+                    self.join(address, netcode.decode_join(data)[0], now)
+                    continue
+                connection = self.connections.get(address)
+                if connection is None:
+                    continue
+                connection.last_heard = now
+                connection.bytes_received += len(data)
+                if kind == netcode.INPUT:
+                    player_id, ack_tick, inputs = netcode.decode_input(data)
+                    if player_id == connection.player_id:
+                        connection.ack_tick = max(connection.ack_tick, ack_tick)
+                        connection.receive_inputs(inputs)
+                elif kind == netcode.LEAVE:
+                    self.leave(connection, "left")
+            except netcode.ProtocolError as e:
+                if _is_join_of_other_version(data):
+                    self.send(address, netcode.encode_reject(netcode.REJECT_VERSION))
+                else:
+                    print(f"Warning: Dropped a packet from {address[0]}:{address[1]}: {e}")
+
+    def step(self):
+        """Reads the waiting packets, simulates one tick and sends snapshots when one is due."""
+        now = time.perf_counter()
+        with self.timer.scope("tick"):
+            with self.timer.scope("receive"):
+                self.receive(now)
+                for connection in list(self.connections.values()):
+                    if now - connection.last_heard > self.timeout:
+                        self.leave(connection, "timed out")
+
+            with self.timer.scope("simulate"):
+                connections = list(self.connections.values())
+                self.step_players(connections)
+                # Players whose inputs piled up after a hitch get a second step until they are back in time
+                self.step_players([connection for connection in connections if len(connection.pending) > CATCH_UP_BACKLOG])
+                self.tick += 1
+
+            if self.tick % self.snapshot_interval == 0 and self.connections:
+                with self.timer.scope("snapshot"):
+                    self.send_snapshots()
+        self.timer.end_frame()
+
+    def step_players(self, connections):
+        """
+        Steps the cars of connections whose next input has arrived. Every
+        other car keeps its state, so a late input delays a car instead of
+        changing its path.
+        """
+        moving = np.zeros(len(self.slots), dtype=bool)
+        for connection in connections:
+            bits = connection.next_input()
+            if bits is not None:
+                moving[connection.player_id] = True
+                self.bits[connection.player_id] = bits
+        if not moving.any():
+            return
+
+        racing = self.rules.racing
+        controls = CarControls(*(keys & racing for keys in decode_fleet_controls(self.bits)))
+        self.rules.step(self.dt, controls, self.track, self.trees, moving)
+
+    def fixed_cars(self):
+        """{player id: fixed point car} of every connected player."""
+        fleet = self.fleet
+        flags = (
+            fleet.drifting * netcode.FLAG_DRIFTING
+            | fleet.crashed * netcode.FLAG_CRASHED
+            | fleet.lap_started * netcode.FLAG_LAP_STARTED
+            | fleet.checkpoint_reached * netcode.FLAG_CHECKPOINT_REACHED
+        )
+        values = np.stack((
+            self.car_index, fleet.x, fleet.y, fleet.direction, fleet.vel_x, fleet.vel_y, fleet.speed,
+            fleet.angular_velocity, fleet.drift_turn_strength, fleet.timer, self.rules.laps, flags,
+        ), axis=1)
+        fixed = np.round(values * np.array(netcode.FIELD_SCALES)).astype(np.int64).tolist()
+        return {i: tuple(fixed[i]) for i, connection in enumerate(self.slots) if connection is not None}
+
+    def send_snapshots(self):
+        cars = self.fixed_cars()
+        self.history[self.tick] = cars
+        oldest = self.tick - BASELINE_SECONDS * self.tick_rate
+        for tick in [tick for tick in self.history if tick < oldest]:
+            del self.history[tick]
+
+        for connection in self.connections.values():
+            baseline = self.history.get(connection.ack_tick)
+            data = netcode.encode_snapshot(self.tick, connection.ack_tick, connection.applied_seq, cars, baseline)
+            self.send(connection.address, data)
+            connection.snapshots += 1
+            connection.full_snapshots += baseline is None
+
+    def stats(self, now=None):
+        """Bandwidth of every client in bytes per second and the tick time percentiles in ms."""
+        now = time.perf_counter() if now is None else now
+        clients = {}
+        for connection in self.connections.values():
+            seconds = max(now - connection.joined, 1e-9)
+            clients[connection.player_id] = {
+                "down": connection.bytes_sent / seconds,
+                "up": connection.bytes_received / seconds,
+                "snapshots": connection.snapshots,
+                "full_snapshots": connection.full_snapshots,
+            }
+        return {"clients": clients, "tick_ms": self.timer.percentiles("tick")}
+
+    def serve_forever(self, duration=None, report_every=10.0):
+        """Runs ticks in real time until duration seconds have passed, forever without one."""
+        start = next_tick = last_report = time.perf_counter()
+        while duration is None or next_tick - start < duration:
+            now = time.perf_counter()
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            elif now - next_tick > 0.25:
+                next_tick = now  # Fell far behind, drop the ticks instead of racing through them
+            self.step()
+            next_tick += self.dt
+            if report_every and now - last_report > report_every:
+                last_report = now
+                self.print_stats()
+
+    def print_stats(self):
+        stats = self.stats()
+        p50, p95, p99 = stats["tick_ms"]
+        print(f"tick {self.tick}: {len(self)} players, tick p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+        for player_id, client in sorted(stats["clients"].items()):
+            print(f"  player {player_id}: down {client['down'] / 1000:.2f} kB/s, up {client['up'] / 1000:.2f} kB/s, "
+                  f"{client['full_snapshots']} of {client['snapshots']} snapshots full")
+
+    def close(self):
+        self.sock.close()
+
+
+def _is_join_of_other_version(data):
+    """Its sender gets a REJECT instead of waiting for a WELCOME that never comes."""
+    return len(data) >= 4 and int.from_bytes(data[:2], "little") == netcode.PROTOCOL_ID and data[3] == netcode.JOIN
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host a LAN race")
+    parser.add_argument("--map", default="track", help="map to race on")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=netcode.DEFAULT_PORT)
+    parser.add_argument("--tick-rate", type=int, default=60, help="physics ticks per second")
+    parser.add_argument("--snapshot-rate", type=int, default=30, choices=(20, 30, 60), help="snapshots per second to each client")
+    parser.add_argument("--players", type=int, default=netcode.MAX_PLAYERS, choices=range(2, netcode.MAX_PLAYERS + 1))
+    args = parser.parse_args()
+
+    try:
+        server = RaceServer(args.map, args.host, args.port, args.tick_rate, args.snapshot_rate, args.players)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Racing on {args.map} at {server.address[0]}:{server.address[1]}, {args.tick_rate} ticks and {args.snapshot_rate} snapshots per second")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,26 @@
 import pyglet
 import os
 import sys
+import numpy as np
 from pyglet.window import key, Window, FPSDisplay
 from pyglet.gl import GL_NEAREST
 from pyglet.image import Texture
 
 from player import Car
+from replay import Replay
+from frame_timer import FrameTimer
+from profiler import SamplingProfiler
+from preloader import MapPreloader
+from map_bundle import MapBundle
+from tree_grid import map_tree_seed
+from score_store import ScoreStore
+from ghost import GhostRecorder, GhostLap, Ghost
+from snapshots import RaceSnapshot, SnapshotRing
+from opponents import Opponents
+from progress_field import ProgressField, RaceProgress
+from lan_client import RaceClient, parse_address
+from lan_game import LanRace
+from menu import FrameTimeOverlay
 from main_utils import *
 from game_logic import GameWorld, RaceManager, InputHandler
 
@@ -14,9 +29,15 @@ from game_logic import GameWorld, RaceManager, InputHandler
 Texture.default_mag_filter = Texture.default_min_filter = GL_NEAREST
 
 
+# Physics ticks per second, 60, 120 and 240 are supported
+TICK_RATES = (60, 120, 240)
+
+
 class Game:
 
-    def __init__(self):
+    def __init__(self, tick_rate=60, record_path=None, profile_seconds=5, opponents=0, join=None):
+        if tick_rate not in TICK_RATES:
+            raise ValueError(f"Unsupported tick rate {tick_rate}, expected one of {TICK_RATES}")
         self.window = Window(1280, 720, caption="Track Demo")
         
         self.menu_assets = load_assets(['neco', 'blohai'])
@@ -28,6 +49,12 @@ class Game:
             del menu_img_sprite
             
         self.fps = FPSDisplay(self.window)
+        self.frame_timer = FrameTimer()
+        self.frame_overlay = FrameTimeOverlay(self.frame_timer, self.window)
+        self.profiler = SamplingProfiler()
+        self.profile_seconds = profile_seconds
+        self.opponent_count = opponents
+        self.join_address = join  # (host, port) of a lan_server.py to race on, None to race alone
         self.keys = key.KeyStateHandler()
         self.window.push_handlers(self.keys)
         
@@ -35,7 +62,8 @@ class Game:
         self.paused = True
         self.is_on_menu = True
         self.settings = False
-        self.score = load_scores()
+        self.scores = ScoreStore()
+        self.scores.migrate_score_file("score.txt", list(load_sprite_data(1)))
 
         # Core Components
         self.batch = pyglet.graphics.Batch()
@@ -46,12 +74,36 @@ class Game:
         self.car = None
         self.world = None
         self.race_manager = None
+        self.ghost_recorder = None
+        self.ghost = None
+        self.opponents = None  # AI cars of the race, see opponents.py
+        self.race_progress = None  # Distance covered and wrong way time of every car
+        self.lan_race = None  # Connection to the LAN race server, see lan_game.py
+        self.delta_to_best = None  # Seconds behind the ghost's lap, None without one
+
+        # Race state of the last few seconds of ticks, and of the start for R
+        self.tick = 0
+        self.snapshots = SnapshotRing(5 * tick_rate)
+        self.start_snapshot = None
         
         # UI time label thingy
         self.lap_time = 0
+
+        # Fixed step simulation, rendering runs as fast as the display allows
+        self.tick_rate = tick_rate
+        self.tick_dt = 1 / tick_rate
+        self.accumulator = 0.0
+        self.max_frame_time = 0.25  # Longer hitches are dropped instead of simulated
+
+        # Maps are prepared in the background while the car picker is open
+        self.preloader = MapPreloader()
+
+        # Input recording for race_runner.py
+        self.record_path = record_path
+        self.replay = None
         
         # Start the main game loop
-        pyglet.clock.schedule_interval(self.game_update, 1 / 60.0)
+        pyglet.clock.schedule(self.game_update)
 
         # Pyglet event handlers
         self.window.push_handlers(
@@ -63,29 +115,82 @@ class Game:
         )
 
     def game_update(self, dt):
-        """The main game loop, called 60 times per second."""
-        self.input_handler.update()
-        self.main_menu.update(dt)
+        """The main game loop, called once per rendered frame."""
+        # The previous frame, including its drawing, ends here
+        self.frame_timer.end_frame()
+        self.profiler.mark_frame()
+        with self.frame_timer.scope("input"):
+            self.input_handler.update()
+        with self.frame_timer.scope("menu"):
+            if self.main_menu.loading and self.is_map_ready(self.main_menu.map_selected):
+                self.main_menu.start_selected_game()
+            self.main_menu.update(dt)
+        self.frame_overlay.update(dt)
 
         if self.paused or self.is_on_menu:
             if self.car and self.car.engine_player:
                 self.car.engine_player.pause()
+            if self.lan_race is not None:
+                self.lan_race.client.keep_alive()
             self.window.set_mouse_visible(True)
+            self.accumulator = 0.0
             return
 
         self.window.set_mouse_visible(False)
         if not self.car.engine_player.playing:
             self.car.engine_player.play()
 
-        # Update all game logic
-        self.car.update_hitbox_corners(self.world.track, dt)
-        self.car.update(dt, self.keys)
-        self.race_manager.update(dt)
-
-        # Move the world based on the car's movement
-        car_dx = self.car.smoothx + self.car.collision_correction_x
-        car_dy = self.car.smoothy + self.car.collision_correction_y
-        self.world.update(car_dx, car_dy, self.car)
+        # Run as many fixed physics ticks as the elapsed time covers
+        self.accumulator += min(dt, self.max_frame_time)
+        while self.accumulator >= self.tick_dt:
+            self.world.camera.begin_tick()
+            self.simulation_step(self.tick_dt)
+            self.accumulator -= self.tick_dt
+
+        # Draw the world between the last two ticks
+        self.world.camera.alpha = self.accumulator / self.tick_dt
+        self.car.sync_sprite(self.world.camera.alpha)
+        if self.opponents is not None:
+            self.opponents.sync_sprites(self.world.camera.alpha)
+        if self.lan_race is not None:
+            self.lan_race.sync_sprites()
+        if self.ghost is not None:
+            self.ghost.show_at(self.car.timer - self.tick_dt * (1 - self.world.camera.alpha))
+            self.delta_to_best = self.ghost.delta.update(self.car.x, self.car.y, self.car.timer)
+        else:
+            self.delta_to_best = None
+
+    def simulation_step(self, dt):
+        """Advances the race by one fixed tick."""
+        with self.frame_timer.scope("physics"):
+            controls = self.car.controls(self.keys)
+            if self.replay is not None:
+                self.replay.record(controls)
+            lap_started = self.car.lap_started
+            self.car.update(dt, self.keys, self.world.track, self.world.tree_manager.grid)
+            self.race_manager.update(dt)
+            if self.car.lap_started and not lap_started:
+                self.ghost_recorder.start_lap()  # Crossed the start line, the lap timer restarted this tick
+            if self.lan_race is not None:
+                self.lan_race.step(dt, controls, self.world.track, self.world.tree_manager.grid)
+            if self.opponents is not None:
+                respawn = self.opponents.update(dt, self.world.track, self.world.tree_manager.grid)
+                if self.race_progress is not None and respawn.any():
+                    fleet = self.opponents.fleet
+                    self.race_progress.respawn(1 + np.flatnonzero(respawn), fleet.x[respawn], fleet.y[respawn])
+            if self.race_progress is not None:
+                self.race_progress.update(dt, *self.car_states())
+            self.ghost_recorder.record(self.car.x, self.car.y, self.car.direction)
+            self.tick += 1
+
+        # The camera follows the car unless it is flown around freely
+        if self.car.is_freecam:
+            self.world.camera.move(self.car.smoothx, self.car.smoothy)
+        else:
+            self.world.camera.look_at(self.car.x, self.car.y)
+        with self.frame_timer.scope("world"):
+            self.world.update(dt, self.car)
+        self.snapshots.push(self.snapshot())
 
     def init_game(self):
         """Initializes and sets up all objects for a new game session."""
@@ -97,6 +202,12 @@ class Game:
         self.world = None
         self.car = None
         self.race_manager = None
+        self.ghost = None
+        self.opponents = None
+        self.race_progress = None
+        if self.lan_race is not None:
+            self.lan_race.close()
+            self.lan_race = None
 
         map_index = self.main_menu.map_selected
         car_index = self.main_menu.car_selected
@@ -105,6 +216,11 @@ class Game:
         all_car_data = load_sprite_data(0) 
         car_name = list(all_car_data)[car_index]
         all_map_data = load_sprite_data(1)
+
+        # The server decides the map of a LAN race
+        client = self.join_lan_race(car_index, list(all_map_data)[map_index], all_map_data) if self.join_address is not None else None
+        if client is not None:
+            map_index = list(all_map_data).index(client.map_name)
         map_name = list(all_map_data)[map_index]
 
         required_assets = [
@@ -119,29 +235,68 @@ class Game:
         if os.path.exists(os.path.join(assets_path, f"{decorations_key}.png")):
             required_assets.append(decorations_key)
 
+        prepared = self.preloader.take(map_name)
+        if prepared:
+            self.preloader.install(prepared)
+            bundle = prepared.bundle
+            tree_seed, tree_positions = prepared.tree_seed, prepared.tree_positions
+        else:
+            bundle = MapBundle.open(map_name)
+            if bundle is not None:
+                load_bundle_images(bundle)
+                tree_seed, tree_positions = bundle.tree_seed, bundle.tree_positions
+            else:
+                tree_seed, tree_positions = map_tree_seed(map_name), None
+
+        # Bundles carry the mask, the grayscale image is not needed then
+        if bundle is not None:
+            required_assets.remove(f"{map_name}_map_grayscale")
+
         self.game_assets = load_assets(required_assets)
 
-        map_data = load_map(self.game_assets, map_index)
+        map_data = load_map(self.game_assets, map_index, bundle)
         car_data = load_car(self.game_assets, car_index)
         
         if not map_data or not car_data:
             return False
 
         # Create the core game components
-        self.world = GameWorld(self.window, self.batch, map_data, self.game_assets)
+        self.world = GameWorld(
+            self.window, self.batch, map_data, self.game_assets,
+            tree_seed=tree_seed, tree_positions=tree_positions,
+        )
         self.car = Car(
             car_data["texture"], self.window, car_data["power"],
-            car_data["friction"], car_data["scale"], batch=self.batch
+            car_data["friction"], car_data["scale"], batch=self.batch,
+            camera=self.world.camera,
         )
         self.race_manager = RaceManager(self, self.car)
-        self.race_manager.start_race(map_data["total_laps"], map_data["spawn_point"])
+        spawn_point = client.spawn_point if client is not None else map_data["spawn_point"]
+        self.race_manager.start_race(map_data["total_laps"], spawn_point)
+        if self.record_path:
+            self.replay = Replay(map_name, car_name, self.tick_rate, tree_seed)
+        self.ghost_recorder = GhostRecorder(self.tick_rate)
+        self.ghost = self.load_ghost(map_name)
+        if client is not None:
+            self.lan_race = LanRace(client, self.car, self.batch)
+            if self.opponent_count > 0:
+                print("Warning: AI opponents only race offline")
+        elif self.opponent_count > 0:
+            self.opponents = Opponents(
+                self.opponent_count, self.car, self.world.track, map_data["spawn_point"],
+                map_data["total_laps"], self.batch,
+            )
         
         # Final setup
         self.main_menu.reset_labels()
         self.teleport_car_to_pos(
             self.race_manager.spawn_point[0], self.race_manager.spawn_point[1], -180
         )
-        self.score = load_scores()
+        self.race_progress = self.create_race_progress()
+        self.tick = 0
+        self.snapshots.clear()
+        self.start_snapshot = self.snapshot()
+        self.snapshots.push(self.start_snapshot)
  
         # Workaround for my audio driver issues. 
         if os.name == 'posix':
@@ -154,55 +309,190 @@ class Game:
             
         return True
 
+    def snapshot(self):
+        """The whole mutable race state: car physics, race rules, the camera offset and the AI cars."""
+        camera = self.world.camera
+        opponents = self.opponents.snapshot() if self.opponents is not None else None
+        progress = self.race_progress.snapshot() if self.race_progress is not None else None
+        return RaceSnapshot(
+            self.tick, self.car.snapshot(), self.race_manager.snapshot(), (camera.x, camera.y), opponents, progress,
+        )
+
+    def restore(self, snapshot):
+        """
+        Puts the race back to a snapshot of this race. Simulating the same
+        input from there repeats the original ticks exactly.
+        """
+        self.tick = snapshot.tick
+        self.car.restore(snapshot.car)
+        self.race_manager.restore(snapshot.race)
+        self.world.camera.move_to(*snapshot.camera)
+        if self.opponents is not None and snapshot.opponents is not None:
+            self.opponents.restore(snapshot.opponents)
+        if self.race_progress is not None and snapshot.progress is not None:
+            self.race_progress.restore(snapshot.progress)
+        self.world.tree_manager.update(self.world.camera)
+        self.snapshots.rewind(snapshot.tick)
+        self.accumulator = 0.0
+        if self.replay is not None:
+            del self.replay.inputs[snapshot.tick:]
+        self.ghost_recorder.discard_lap()
+
+    def create_race_progress(self):
+        """Progress tracking for the player and the AI cars, None on a map without a lap to follow."""
+        track = self.world.track
+        try:
+            field = ProgressField.for_mask(track.surfaces, track.scale)
+        except ValueError as e:
+            print(f"Warning: No race progress on this map: {e}")
+            return None
+        xs, ys, _ = self.car_states()
+        return RaceProgress(field, xs, ys)
+
+    def car_states(self):
+        """x, y and direction arrays of the player's car followed by the AI cars."""
+        xs, ys, directions = [self.car.x], [self.car.y], [self.car.direction]
+        if self.opponents is not None:
+            fleet = self.opponents.fleet
+            return np.concatenate((xs, fleet.x)), np.concatenate((ys, fleet.y)), np.concatenate((directions, fleet.direction))
+        return np.array(xs), np.array(ys), np.array(directions)
+
+    def restart_race(self):
+        """
+        Starts the current race over from its first tick without rebuilding
+        anything. A LAN race runs on the server and can not be rewound, R
+        goes back to the menu there instead.
+        """
+        if self.lan_race is not None:
+            self.is_on_menu = True
+            self.paused = True
+            return
+        self.restore(self.start_snapshot)
+        self.ghost_recorder.stop()
+        self.world.trail.clear()
+        self.paused = False
+        self.is_on_menu = False
+
+    def join_lan_race(self, car_index, map_name, all_map_data):
+        """
+        A RaceClient connected to the server at join_address, None to race
+        offline when that fails. A race_host.py races on map_name, a
+        lan_server.py on its own map.
+        """
+        try:
+            client = RaceClient(self.join_address, car_index, map_name)
+        except OSError as e:
+            print(f"Warning: Could not join the LAN race, racing offline: {e}")
+            return None
+        if client.map_name not in all_map_data:
+            print(f"Warning: The LAN race is on {client.map_name}, which this game does not have")
+            client.close()
+            return None
+        if client.tick_rate != self.tick_rate:
+            # The own car is predicted tick by tick, both sides have to step the same
+            print(f"Warning: The LAN race runs at {client.tick_rate} ticks per second, start with --tick-rate {client.tick_rate}")
+            client.close()
+            return None
+        print(f"Joined the LAN race on {client.map_name} as player {client.player_id}")
+        return client
+
     def teleport_camera_to_car(self):
-        """Moves the world so the car is in the center of the screen."""
-        dx_world = self.car.hitbox.x - (self.window.width / 2)
-        dy_world = self.car.hitbox.y - (self.window.height / 2)
-        self.world.update(dx_world, dy_world, self.car)
+        """Moves the camera so the car is in the center of the screen."""
+        self.world.camera.look_at(self.car.x, self.car.y)
+        self.world.tree_manager.update(self.world.camera)
 
     def teleport_car_to_pos(self, target_world_x, target_world_y, car_dir=None):
-        """Moves the world to effectively 'teleport' the car to a new position."""
-        # Some advanced math
+        """Puts the car on a world position and centers the camera on it."""
         screen_center_x = self.window.width / 2
         screen_center_y = self.window.height / 2
 
-        final_track_x = screen_center_x - target_world_x
-        final_track_y = screen_center_y - target_world_y
-
-        delta_move_x = final_track_x - self.world.track.sprite.x
-        delta_move_y = final_track_y - self.world.track.sprite.y
-
-        dx = -delta_move_x
-        dy = -delta_move_y
-
-        self.world.update(dx, dy, self.car)
+        self.car.move_to(target_world_x, target_world_y)
+        self.world.camera.move_to(target_world_x - screen_center_x, target_world_y - screen_center_y)
+        self.world.tree_manager.update(self.world.camera)
         if car_dir:
             self.car.direction = car_dir
             
     def add_score(self, total_time, lap_times):
-        """Add or update the score for the current map."""
-        map_number = self.main_menu.map_selected
+        """Saves the finished race, the score store writes it in the background."""
+        map_name = list(load_sprite_data(1))[self.main_menu.map_selected]
+        car_name = list(load_sprite_data(0))[self.main_menu.car_selected]
+        self.scores.add_run(map_name, car_name, total_time, lap_times)
+
+    def load_ghost(self, map_name):
+        """The ghost of the fastest recorded lap on the map, None if there is none."""
+        best = self.scores.best_ghost(map_name)
+        if best is None:
+            return None
+        car_name, _, data = best
+        try:
+            lap = GhostLap.from_bytes(data)
+        except ValueError as e:
+            print(f"Warning: Could not load the ghost of {map_name}: {e}")
+            return None
+        return self.create_ghost(lap, car_name)
+
+    def create_ghost(self, lap, car_name):
+        texture = load_assets([f"{car_name}_texture"])[f"{car_name}_texture"]
+        if texture is None:
+            return None
+        scale = load_sprite_data(0)[car_name]["scale"]
+        return Ghost(lap, texture, scale, self.batch, self.world.camera)
+
+    def finish_ghost_lap(self, lap_time):
+        """Saves the lap that just ended and races against it if it beats the current ghost."""
+        lap = self.ghost_recorder.finish_lap(lap_time)
+        if lap is None or (self.ghost is not None and self.ghost.lap.lap_time <= lap_time):
+            return
+        map_name = list(load_sprite_data(1))[self.main_menu.map_selected]
+        car_name = list(load_sprite_data(0))[self.main_menu.car_selected]
+        self.scores.add_ghost(map_name, car_name, lap_time, lap.to_bytes())
 
-        while len(self.score) <= map_number:
-            self.score.append([])
+        if self.ghost is not None:
+            self.ghost.delete()
+        self.ghost = self.create_ghost(lap, car_name)
 
-        existing_score = self.score[map_number]
+    def best_time(self, map_index):
+        """The fastest finished race on a map in seconds, None if there is none."""
+        best = self.scores.best_run(list(load_sprite_data(1))[map_index])
+        return best[0] if best else None
 
-        if not existing_score or total_time < existing_score[0]:
-            self.score[map_number] = [total_time] + lap_times
-            with open("score.txt", "w", encoding="utf-8") as f:
-                f.write(str(self.score))
 
+    def prefetch_map(self, map_index):
+        self.preloader.prefetch(list(load_sprite_data(1))[map_index])
+
+    def is_map_ready(self, map_index):
+        return self.preloader.is_ready(list(load_sprite_data(1))[map_index])
+
+    def start_profile(self):
+        """Captures a sampling profile of the game loop, saved to profiles/ when done."""
+        name = "profile_menu"
+        if self.world and not self.is_on_menu:
+            name = f"profile_{list(load_sprite_data(1))[self.main_menu.map_selected]}"
+        self.profiler.start(self.profile_seconds, name=name)
+
+    def save_replay(self):
+        """Writes the recorded inputs of the current race, if recording."""
+        if self.replay is None:
+            return
+        self.replay.lap_times = list(self.race_manager.lap_times)
+        try:
+            self.replay.save(self.record_path)
+            print(f"Replay saved to {self.record_path}")
+        except OSError as e:
+            print(f"Warning: Could not save replay: {e}")
 
     def on_draw(self):
         """Draws all game objects."""
         self.window.clear()
         if not self.is_on_menu:
-            self.batch.draw()
+            with self.frame_timer.scope("draw"):
+                self.batch.draw()
             self.fps.draw()
-        self.main_menu.draw()
-        if self.settings:
-            self.settings_popup.draw()
+        with self.frame_timer.scope("ui"):
+            self.main_menu.draw()
+            if self.settings:
+                self.settings_popup.draw()
+        self.frame_overlay.draw()
 
     def on_close(self):
         """Cleans up resources when the window is closed."""
@@ -210,6 +500,12 @@ class Game:
                                     # I thougth that its because of memory leaks or something and made a cleanup function. 
                                     # But this was not the problem because python releases all used memory when process is stopped. 
                                     # I guess it was just an coincidence, but ill keep cleanup in the code commented
+        if self.race_manager and not self.race_manager.is_race_finished:
+            self.save_replay()
+        if self.lan_race is not None:
+            self.lan_race.close()
+        self.preloader.shutdown()
+        self.scores.close()
         self.window.close()
         return True
 
@@ -271,7 +567,23 @@ Game.is_race_finished = is_race_finished
 
 
 if __name__ == "__main__":
-    game = Game()
+    import argparse
+    parser = argparse.ArgumentParser(description="PyRacing")
+    parser.add_argument("--tick-rate", type=int, default=60, choices=TICK_RATES, help="physics ticks per second")
+    parser.add_argument("--record", metavar="PATH", help="save the driver input of each race for race_runner.py")
+    parser.add_argument("--profile-seconds", type=float, default=5, help="length of an F9 profile capture")
+    parser.add_argument("--opponents", type=int, default=0, metavar="N", help="number of AI cars to race against")
+    parser.add_argument("--join", metavar="HOST[:PORT]", help="race on a LAN server started with lan_server.py")
+    args = parser.parse_args()
+    try:
+        join = parse_address(args.join) if args.join else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    game = Game(
+        tick_rate=args.tick_rate, record_path=args.record, profile_seconds=args.profile_seconds,
+        opponents=args.opponents, join=join,
+    )
     try:
         game.run()
     except KeyboardInterrupt:
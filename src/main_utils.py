@@ -1,29 +1,11 @@
-from ast import literal_eval
 import os
 import sys
+import numpy as np
 import pyglet
+import pyglet.extlibs.png as pypng
 from menu import Menu
-
-def load_scores():
-    filepath = "score.txt"
-    default_scores = "[[], [], [], []]"
-
-    try:
-        if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-            with open(filepath, "r", encoding="utf-8") as file:
-                content = file.read()
-                return literal_eval(content)
-        else:
-            with open(filepath, "w", encoding="utf-8") as file:
-                file.write(default_scores)
-            return literal_eval(default_scores)
-
-    except (ValueError, SyntaxError) as e:
-        print(f"Error loading scores: {e}. Resetting score file.")
-        with open(filepath, "w", encoding="utf-8") as file:
-            file.write(default_scores)
-        return literal_eval(default_scores)
-
+from asset_cache import asset_cache
+from tree_grid import place_trees, TREE_COUNT
 
 def load_sprite_data(i):
     if i == 0:
@@ -54,7 +36,7 @@ def load_sprite_data(i):
         }
 
 
-def load_map(assets, i):
+def load_map(assets, i, bundle=None):
     all_map_data = load_sprite_data(1)
     map_names = list(all_map_data)
     name = map_names[i]
@@ -65,12 +47,22 @@ def load_map(assets, i):
     decorations_key = f"{name}_map_decorations"
 
     to_add_map = {
+        "name": name,
         "color_img": assets[color_key],
-        "grayscale_img": assets[grayscale_key],
         "scale": map_properties["scale"],
         "spawn_point": map_properties["spawn_point"],
         "total_laps": map_properties["total_laps"],
     }
+    if bundle is not None:
+        # The mask, its surfaces and the wall field come precomputed
+        track_mask = bundle.track_mask()
+        to_add_map["grayscale_img"] = None
+        to_add_map["mask_pixels"] = track_mask.pixels
+        to_add_map["surfaces"] = track_mask.surfaces
+        to_add_map["wall_field"] = track_mask.wall_field
+    else:
+        to_add_map["grayscale_img"] = assets[grayscale_key]
+        to_add_map["mask_pixels"] = load_mask_pixels(grayscale_key, assets[grayscale_key])
     if decorations_key in assets:
         to_add_map["decorations_img"] = assets[decorations_key]
     else:
@@ -94,21 +86,70 @@ def load_car(assets, i):
         return output
 
 
-def load_assets(asset_keys): # optimise tis for faster loading
-    assets_path = os.path.join(getattr(sys, '_MEIPASS', os.getcwd()), "Assets")
-    pyglet.resource.path = [assets_path]
-    pyglet.resource.reindex()
+def assets_dir():
+    return os.path.join(getattr(sys, '_MEIPASS', os.getcwd()), "Assets")
+
+
+def load_assets(asset_keys):
+    """Loads images by name from Assets/. Decoded images stay in the asset cache between races."""
+    assets_path = assets_dir()
+    if pyglet.resource.path != [assets_path]:
+        pyglet.resource.path = [assets_path]
+        pyglet.resource.reindex()
 
     assets = {}
     for key in asset_keys:
         filename = f"{key}.png"
         try:
-            assets[key] = pyglet.resource.image(filename)
+            assets[key] = asset_cache.get(("image", filename), lambda: pyglet.resource.image(filename))
         except Exception as e:
             print(f"Warning: Failed to load asset {filename}: {e}")
             assets[key] = None
     return assets
 
+
+def extract_mask_pixels(image):
+    """
+    First channel of an image as one byte per pixel, bottom row first.
+    Same result as get_bytes(fmt="L"), but sliced with numpy instead of
+    pyglet's regex conversion, which takes seconds on a 2048 px mask.
+    """
+    data = image.get_image_data()
+    channels = len(data.format)
+    raw = data.get_data(data.format, data.width * channels)
+    pixels = np.frombuffer(raw, dtype=np.uint8).reshape(data.height, data.width * channels)
+    return pixels[:, ::channels].tobytes()
+
+
+def decode_png(path):
+    """
+    Same result as pyglet.image.load for 8-bit PNGs, but joins the rows one
+    at a time. pyglet builds the whole pixel array in a single C call that
+    holds the GIL for over a second on the 2048px maps, freezing the menu.
+    """
+    width, height, rows, metadata = pypng.Reader(filename=path).asDirect()
+    if metadata["bitdepth"] != 8:
+        return pyglet.image.load(path)
+    fmt = ("L" if metadata["greyscale"] else "RGB") + ("A" if metadata["alpha"] else "")
+    data = b"".join(bytes(row) for row in rows)
+    return pyglet.image.ImageData(width, height, fmt, data, -len(fmt) * width)
+
+
+def load_mask_pixels(key, image):
+    """The grayscale mask as one byte per pixel, extracted once per process."""
+    return asset_cache.get(("mask", key), lambda: extract_mask_pixels(image))
+
+
+def load_tree_positions(map_name, track, seed):
+    """The trees of a map, placed once per process for each seed."""
+    return asset_cache.get(("trees", map_name, seed), lambda: place_trees(TREE_COUNT, track, seed))
+
+
+def load_bundle_images(bundle):
+    """Uploads the images of a map bundle into the asset cache, under the names of the PNGs they replace."""
+    for name, filename in bundle.image_filenames().items():
+        asset_cache.get(("image", filename), lambda: bundle.image(name).get_texture())
+
 def init_menu(game,menu_img):
     button_configs = get_button_configs()
     labels = []
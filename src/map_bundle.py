@@ -0,0 +1,299 @@
+"""
+Compiled map bundles: everything the game derives from a map's PNGs and its
+load_sprite_data entry, in one file that is memory-mapped instead of decoded.
+
+    python3 src/map_bundle.py [map names ...] [--tree-seed N]
+
+writes Assets/<map>.mapbundle for every map (or the named ones). The game
+uses a bundle while it matches its PNGs and map settings and falls back to
+the PNGs otherwise, so a stale bundle is never loaded.
+
+File layout: magic, version and header length, a JSON header with the map
+settings, marker regions and an (offset, dtype, shape) entry per array, then
+the raw arrays, each aligned to ALIGNMENT bytes.
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pyglet
+if __name__ == "__main__":
+    pyglet.options['shadow_window'] = False  # Compiling needs no GL context
+
+from main_utils import assets_dir, load_sprite_data, extract_mask_pixels, decode_png
+from track_mask import (
+    TrackMask, SURFACE_ROAD, SURFACE_START, SURFACE_FINISH, SURFACE_CHECKPOINT, SURFACE_OFF_TRACK,
+)
+from wall_field import WallField, FIELD_VERSION
+from tree_grid import place_trees, map_tree_seed, TREE_COUNT, PLACEMENT_VERSION
+
+BUNDLE_MAGIC = b"PYRMAP\x00\x00"
+BUNDLE_VERSION = 1
+BUNDLE_EXTENSION = ".mapbundle"
+ALIGNMENT = 64
+_PREFIX = struct.Struct("<8sII")  # magic, version, header length
+
+MARKERS = {"start": SURFACE_START, "finish": SURFACE_FINISH, "checkpoint": SURFACE_CHECKPOINT}
+DRIVABLE = (SURFACE_ROAD, SURFACE_START, SURFACE_FINISH, SURFACE_CHECKPOINT)
+
+
+def bundle_path(map_name, directory=None):
+    return os.path.join(directory or assets_dir(), f"{map_name}{BUNDLE_EXTENSION}")
+
+
+def source_paths(map_name):
+    """The PNGs a map is compiled from, the decorations are optional."""
+    paths = {
+        "color": os.path.join(assets_dir(), f"{map_name}_map.png"),
+        "grayscale": os.path.join(assets_dir(), f"{map_name}_map_grayscale.png"),
+        "decorations": os.path.join(assets_dir(), f"{map_name}_map_decorations.png"),
+    }
+    if not os.path.exists(paths["decorations"]):
+        del paths["decorations"]
+    return paths
+
+
+def source_hash(map_name):
+    """Hash of the source PNGs and map settings, a bundle with another hash is stale."""
+    settings = load_sprite_data(1)[map_name]
+    digest = hashlib.sha1(json.dumps(
+        [BUNDLE_VERSION, FIELD_VERSION, PLACEMENT_VERSION, settings["scale"], list(settings["spawn_point"]), settings["total_laps"]]
+    ).encode())
+    for name, path in sorted(source_paths(map_name).items()):
+        digest.update(name.encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def rgba_rows(image):
+    """An image as an (height, width, 4) uint8 array, bottom row first like pyglet textures."""
+    data = image.get_image_data()
+    raw = data.get_data("RGBA", data.width * 4)
+    return np.frombuffer(raw, dtype=np.uint8).reshape(data.height, data.width, 4)
+
+
+def marker_regions(surfaces, scale):
+    """World pixel bounding box [left, bottom, right, top] of every marker surface, None if missing."""
+    regions = {}
+    for name, surface in MARKERS.items():
+        ys, xs = np.nonzero(surfaces == surface)
+        if not len(xs):
+            regions[name] = None
+            continue
+        regions[name] = [
+            int(xs.min()) * scale, int(ys.min()) * scale,
+            (int(xs.max()) + 1) * scale, (int(ys.max()) + 1) * scale,
+        ]
+    return regions
+
+
+def compile_map(map_name, tree_seed=None):
+    """Decodes and derives everything of one map. Returns (header, arrays), raising ValueError if it is invalid."""
+    settings = load_sprite_data(1)[map_name]
+    scale = settings["scale"]
+    if tree_seed is None:
+        tree_seed = map_tree_seed(map_name)
+
+    images = {name: decode_png(path) for name, path in source_paths(map_name).items()}
+    grayscale = images["grayscale"]
+    width, height = grayscale.width, grayscale.height
+    for name, image in images.items():
+        if (image.width, image.height) != (width, height):
+            raise ValueError(f"{name} image is {image.width}x{image.height}, the mask is {width}x{height}")
+
+    mask_pixels = np.frombuffer(extract_mask_pixels(grayscale), dtype=np.uint8).reshape(height, width)
+    mask = TrackMask(mask_pixels.tobytes(), width, height, scale)
+    trees = place_trees(TREE_COUNT, mask, tree_seed)
+
+    arrays = {
+        "mask": mask_pixels,
+        "surfaces": mask.surfaces,
+        "wall_distance": mask.wall_field.distance,
+        "wall_normals": mask.wall_field.normals,
+        "trees": trees,
+        "color": rgba_rows(images["color"]),
+    }
+    if "decorations" in images:
+        arrays["decorations"] = rgba_rows(images["decorations"])
+
+    header = {
+        "map_name": map_name,
+        "source_hash": source_hash(map_name),
+        "width": width,
+        "height": height,
+        "scale": scale,
+        "spawn_point": list(settings["spawn_point"]),
+        "total_laps": settings["total_laps"],
+        "tree_seed": tree_seed,
+        "markers": marker_regions(mask.surfaces, scale),
+    }
+    validate(header, arrays, mask)
+    return header, arrays
+
+
+def validate(header, arrays, mask):
+    """Raises ValueError for a map the game could not race on."""
+    missing = [name for name, region in header["markers"].items() if region is None]
+    if missing:
+        raise ValueError(f"mask has no {', '.join(missing)} pixels")
+
+    x, y = header["spawn_point"]
+    if int(mask.classify_points(x, y)) not in DRIVABLE:
+        raise ValueError(f"spawn point {x}, {y} is not on the track")
+
+    if len(arrays["trees"]) != TREE_COUNT:
+        raise ValueError(f"only {len(arrays['trees'])} of {TREE_COUNT} trees fit off the track")
+    if np.any(mask.classify_points(arrays["trees"][:, 0], arrays["trees"][:, 1]) != SURFACE_OFF_TRACK):
+        raise ValueError("trees were placed on the track")
+
+    unmarked = np.count_nonzero((mask.surfaces == SURFACE_OFF_TRACK) & (arrays["mask"] != 0))
+    if unmarked:
+        print(f"Warning: {header['map_name']}: {unmarked} mask pixels have unknown gray values, they count as off track")
+
+
+def write_bundle(path, header, arrays):
+    """Writes the bundle next to path first and moves it in place, so a crash leaves no half file."""
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        entries[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+
+    header_bytes = json.dumps(dict(header, arrays=entries)).encode("utf-8")
+    data_start = -(-(_PREFIX.size + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_PREFIX.pack(BUNDLE_MAGIC, BUNDLE_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + entries[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(temp_path, path)
+
+
+class MapBundle:
+    """A compiled map, its arrays are read-only views into the memory-mapped file."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            magic, version, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != BUNDLE_MAGIC:
+                raise ValueError("not a map bundle")
+            if version != BUNDLE_VERSION:
+                raise ValueError(f"bundle version {version}, expected {BUNDLE_VERSION}")
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+
+        self.path = path
+        data_start = -(-(_PREFIX.size + header_length) // ALIGNMENT) * ALIGNMENT
+        self.arrays = {}
+        for name, entry in self.header["arrays"].items():
+            shape = tuple(entry["shape"])
+            if not all(shape):
+                self.arrays[name] = np.empty(shape, dtype=entry["dtype"])
+                continue
+            self.arrays[name] = np.memmap(
+                path, dtype=entry["dtype"], mode="r", offset=data_start + entry["offset"], shape=shape
+            )
+
+        self.map_name = self.header["map_name"]
+        self.width = self.header["width"]
+        self.height = self.header["height"]
+        self.scale = self.header["scale"]
+        self.spawn_point = tuple(self.header["spawn_point"])
+        self.total_laps = self.header["total_laps"]
+        self.tree_seed = self.header["tree_seed"]
+        self.markers = self.header["markers"]
+
+    @classmethod
+    def open(cls, map_name):
+        """The bundle of map_name, or None if there is none or it is out of date."""
+        path = bundle_path(map_name)
+        if not os.path.exists(path):
+            return None
+        try:
+            bundle = cls(path)
+            if bundle.header["source_hash"] != source_hash(map_name):
+                print(f"Warning: {path} is out of date, loading the PNGs. Rebuild it with src/map_bundle.py")
+                return None
+            return bundle
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Warning: Ignoring broken map bundle {path}: {e}")
+            return None
+
+    @property
+    def tree_positions(self):
+        return np.array(self.arrays["trees"])
+
+    def track_mask(self):
+        """A TrackMask over the bundled arrays, nothing is recomputed."""
+        arrays = self.arrays
+        wall_field = WallField(arrays["wall_distance"], arrays["wall_normals"])
+        # Flat like the bytes a PNG gives, the bundle stores the mask as rows
+        return TrackMask(arrays["mask"].reshape(-1), self.width, self.height, self.scale, arrays["surfaces"], wall_field)
+
+    def image(self, name):
+        """The "color" or "decorations" image as ImageData, None if the map has none."""
+        rows = self.arrays.get(name)
+        if rows is None:
+            return None
+        return pyglet.image.ImageData(self.width, self.height, "RGBA", rows.tobytes())
+
+    def image_filenames(self):
+        """Bundled image name -> the PNG filename the asset cache knows it by."""
+        names = {"color": f"{self.map_name}_map.png", "decorations": f"{self.map_name}_map_decorations.png"}
+        return {name: filename for name, filename in names.items() if name in self.arrays}
+
+
+def verify_bundle(path, header, arrays):
+    """Reads a written bundle back and checks it holds exactly what was compiled."""
+    bundle = MapBundle(path)
+    for key, value in header.items():
+        if bundle.header[key] != value:
+            raise ValueError(f"header field {key} did not round trip")
+    for name, array in arrays.items():
+        if not np.array_equal(bundle.arrays[name], array):
+            raise ValueError(f"array {name} did not round trip")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile maps into memory-mapped bundles")
+    parser.add_argument("maps", nargs="*", help="map names, all maps if none are given")
+    parser.add_argument("--tree-seed", type=int, help="seed for the tree positions, the map's own seed by default")
+    parser.add_argument("--output-dir", metavar="DIR", help="where to write the bundles, Assets/ by default")
+    args = parser.parse_args()
+
+    all_maps = list(load_sprite_data(1))
+    unknown = [name for name in args.maps if name not in all_maps]
+    if unknown:
+        parser.error(f"unknown maps {', '.join(unknown)}, expected some of {', '.join(all_maps)}")
+
+    failed = False
+    for map_name in args.maps or all_maps:
+        start = time.perf_counter()
+        path = bundle_path(map_name, args.output_dir)
+        try:
+            header, arrays = compile_map(map_name, args.tree_seed)
+            write_bundle(path, header, arrays)
+            verify_bundle(path, header, arrays)
+        except (OSError, ValueError) as e:
+            print(f"Error: {map_name}: {e}")
+            failed = True
+            continue
+
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"{map_name}: {path} ({size_mb:.1f} MB, {time.perf_counter() - start:.1f} s)")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -261,6 +261,7 @@ class Menu:
         self.game = game
         self.picking_map = False
         self.picking_car = False
+        self.loading = False
         self.map_selected = None
         self.car_selected = None
 
@@ -307,6 +308,49 @@ class Menu:
         )
         self.best_time_label.hide() # Initially hidden
 
+        self.loading_label = LabelWithBackground(
+            text="Loading map...",
+            x=220,
+            y=340,
+            font_size=16,
+            batch=self.batch,
+            min_width=200
+        )
+        self.loading_label.hide()
+
+        # Next to the current lap's label
+        self.delta_label = LabelWithBackground(
+            text="+0.00",
+            x=220,
+            y=40,
+            font_size=14,
+            batch=self.batch,
+            min_width=80,
+        )
+        self.delta_label.hide()
+
+        # Race position against the AI cars, top right
+        self.position_label = LabelWithBackground(
+            text="P1/1",
+            x=1170,
+            y=670,
+            font_size=18,
+            batch=self.batch,
+            min_width=90,
+        )
+        self.position_label.hide()
+
+        self.wrong_way_label = LabelWithBackground(
+            text="WRONG WAY",
+            x=560,
+            y=600,
+            font_size=24,
+            color=(255, 90, 90, 255),
+            batch=self.batch,
+            min_width=180,
+        )
+        self.wrong_way_label.hide()
+
     def _assign_button_callbacks(self):
         bm = self.button_manager
         if bm.main_buttons[0]:
@@ -354,7 +398,7 @@ class Menu:
         for button in bm.map_pick_buttons:
             if button: button.enabled = self.picking_map
         for button in bm.car_pick_buttons:
-            if button: button.enabled = self.picking_car
+            if button: button.enabled = self.picking_car and not self.loading
 
         bm.update_buttons()
 
@@ -365,6 +409,12 @@ class Menu:
             self.best_time_label.hide()
         self.best_time_label.update(dt)
 
+        if self.loading:
+            self.loading_label.show()
+        else:
+            self.loading_label.hide()
+        self.loading_label.update(dt)
+
         for label, data in zip(self.labels, self.labels_data):
             if not is_in_game:
                 label.hide()
@@ -376,9 +426,50 @@ class Menu:
                 if data["lap"] == self.game.current_lap:
                     label.set_text(f"Lap {data['lap']}: {round(self.game.lap_time,2)}")
             label.update(dt)
-        
+
+        self.update_delta_label(is_in_game and not is_game_finished)
+        self.delta_label.update(dt)
+        self.update_progress_labels(is_in_game and not is_game_finished)
+        self.position_label.update(dt)
+        self.wrong_way_label.update(dt)
+
         if self.menu_img: self.menu_img.visible=is_main_menu_active or self.picking_car or self.picking_map
 
+    def update_delta_label(self, visible):
+        """Shows the live difference to the ghost's lap, red while behind and green while ahead."""
+        delta = self.game.delta_to_best
+        if not visible or delta is None:
+            self.delta_label.hide()
+            return
+        text = f"{round(delta, 2) or 0.0:+.2f}"  # No "-0.00"
+        if self.delta_label.label.text != text:
+            self.delta_label.set_text(text)
+            self.delta_label.label.color = (255, 110, 110, 255) if delta > 0 else (110, 255, 110, 255)
+        self.delta_label.set_position(220, 40 * self.game.current_lap)
+        self.delta_label.show()
+
+    def update_progress_labels(self, visible):
+        """Race position when there are AI cars, and a warning while the player drives the wrong way."""
+        progress = self.game.race_progress
+        if not visible or progress is None:
+            self.position_label.hide()
+            self.wrong_way_label.hide()
+            return
+
+        car_count = len(progress.covered)
+        if car_count > 1:
+            text = f"P{progress.positions()[0]}/{car_count}"
+            if self.position_label.label.text != text:
+                self.position_label.set_text(text)
+            self.position_label.show()
+        else:
+            self.position_label.hide()
+
+        if progress.wrong_way[0]:
+            self.wrong_way_label.show()
+        else:
+            self.wrong_way_label.hide()
+
     def draw(self):
         self.button_manager.update_visibility()
         self.batch.draw()
@@ -388,6 +479,13 @@ class Menu:
             a=label.text.split(":")[0]
             b=": 0.00"
             label.text=a+b
+
+    def show_lap_times(self, lap_times):
+        """Shows finished laps on their labels and resets the others."""
+        self.reset_labels()
+        for label, data in zip(self.labels, self.labels_data):
+            if data["lap"] <= len(lap_times):
+                label.set_text(f"Lap {data['lap']}: {round(lap_times[data['lap'] - 1], 2)}")
             
 
     def on_map_pick(self, index):
@@ -395,12 +493,12 @@ class Menu:
         self.map_selected = index
         self.picking_map = False
         self.picking_car = True
+        self.game.prefetch_map(index)
 
         # Fetch and display the best time for this map
         
-        best_time_data = self.game.score[index]
-        if best_time_data:
-            best_time = best_time_data[0]
+        best_time = self.game.best_time(index)
+        if best_time is not None:
             self.best_time_label.set_text(f"Best Time: {best_time:.2f}s")
         else:
             self.best_time_label.set_text("Best Time: N/A")
@@ -409,6 +507,14 @@ class Menu:
     def on_car_pick(self, index):
         print(f"Car {index} selected")
         self.car_selected = index
+        if not self.game.is_map_ready(self.map_selected):
+            # Game.game_update starts the race once the preload is done
+            self.loading = True
+            return
+        self.start_selected_game()
+
+    def start_selected_game(self):
+        self.loading = False
         if self.game.init_game():
             self.picking_car = False
             self.game.paused = False
@@ -456,3 +562,76 @@ class Menu:
                 except (IndexError, ValueError):
                     print(f"Could not parse time from label: {label.text}")
         return total_time, lap_times
+
+
+class FrameTimeOverlay:
+    """
+    Corner panel with p50/p95/p99 per timing scope and a graph of the last
+    frame times. Text and bars are refreshed a few times per second only,
+    so the overlay does not show up in its own numbers.
+    """
+    scope_order = ("frame", "input", "menu", "physics", "world", "draw", "ui")
+
+    def __init__(self, frame_timer, window, bars=150, refresh_interval=0.25):
+        self.frame_timer = frame_timer
+        self.visible = False
+        self.refresh_interval = refresh_interval
+        self._since_refresh = refresh_interval
+        self.batch = pyglet.graphics.Batch()
+
+        self.width = bars * 2 + 20
+        self.graph_height = 100
+        self.ms_to_pixels = self.graph_height / 33.3  # Two 60 Hz frames fill the graph
+        self.x = window.width - self.width - 10
+        self.y = window.height - 280
+
+        self.background = pyglet.shapes.Rectangle(
+            self.x, self.y, self.width, 270, color=(0, 0, 0), batch=self.batch
+        )
+        self.background.opacity = 170
+        self.label = pyglet.text.Label(
+            "", x=self.x + 10, y=self.y + 260, width=self.width - 20, multiline=True,
+            anchor_y="top", font_name="monospace", font_size=9, batch=self.batch,
+        )
+
+        graph_x, graph_y = self.x + 10, self.y + 10
+        self.graph_y = graph_y
+        self.bars = [
+            pyglet.shapes.Rectangle(graph_x + i * 2, graph_y, 2, 0, color=(90, 200, 90), batch=self.batch)
+            for i in range(bars)
+        ]
+        budget_y = graph_y + 1000 / 60 * self.ms_to_pixels
+        self.budget_line = pyglet.shapes.Line(
+            graph_x, budget_y, graph_x + bars * 2, budget_y, color=(220, 80, 80), batch=self.batch
+        )
+
+    def toggle(self):
+        self.visible = not self.visible
+        self._since_refresh = self.refresh_interval
+
+    def update(self, dt):
+        if not self.visible:
+            return
+        self._since_refresh += dt
+        if self._since_refresh < self.refresh_interval:
+            return
+        self._since_refresh = 0.0
+
+        summary = self.frame_timer.summary()
+        lines = [f"{'scope':<8}{'p50':>7}{'p95':>7}{'p99':>7} ms"]
+        names = [n for n in self.scope_order if n in summary] + sorted(n for n in summary if n not in self.scope_order)
+        for name in names:
+            s = summary[name]
+            lines.append(f"{name:<8}{s['p50']:>7.2f}{s['p95']:>7.2f}{s['p99']:>7.2f}")
+        self.label.text = "\n".join(lines)
+
+        frames = self.frame_timer.recent("frame")[-len(self.bars):]
+        offset = len(self.bars) - len(frames)
+        for i, bar in enumerate(self.bars):
+            ms = frames[i - offset] * 1000 if i >= offset else 0.0
+            bar.height = min(ms * self.ms_to_pixels, self.graph_height)
+            bar.color = (90, 200, 90) if ms <= 1000 / 60 else (230, 170, 60) if ms <= 1000 / 30 else (230, 70, 70)
+
+    def draw(self):
+        if self.visible:
+            self.batch.draw()
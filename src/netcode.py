@@ -0,0 +1,229 @@
+"""
+Packets of the LAN race protocol, shared by lan_server.py and lan_client.py.
+
+Every packet starts with the protocol id, the version and the packet type.
+Clients send their W/S/A/D bits (replay.encode_controls) every tick, the
+server answers with snapshots of every car in fixed point, each one a delta
+against the last snapshot the client confirmed to have received.
+"""
+import struct
+
+PROTOCOL_ID = 0x5052  # "PR"
+PROTOCOL_VERSION = 2
+DEFAULT_PORT = 47610
+MAX_PLAYERS = 8
+MAX_PACKET = 1200  # Stays below the MTU of any LAN
+
+# The fixed point steps of ghost.py: 1/16 world pixel and 1/64 degree per unit.
+# Not imported from there, so the protocol stays free of pyglet.
+POSITION_SCALE = 16
+DIRECTION_SCALE = 64
+
+JOIN = 1
+WELCOME = 2
+REJECT = 3
+INPUT = 4
+SNAPSHOT = 5
+LEAVE = 6
+
+# Reasons in a REJECT packet
+REJECT_FULL = 1
+REJECT_VERSION = 2
+REJECT_MAP = 3
+REJECT_REASONS = {REJECT_FULL: "the race is full", REJECT_VERSION: "different game version", REJECT_MAP: "map not hosted"}
+
+# Inputs repeated in every INPUT packet, so a lost packet costs nothing
+INPUT_REDUNDANCY = 8
+NO_TICK = 0  # Ticks count from 1, a baseline of 0 means "no baseline, everything is new"
+
+_HEADER = struct.Struct("<HBB")  # protocol id, version, packet type
+_JOIN = struct.Struct("<B")  # car index, then the wished map name in the rest of the packet
+_WELCOME = struct.Struct("<BBHHii32s")  # player id, car index, tick rate, snapshot rate, spawn x, y, map name
+_REJECT = struct.Struct("<B")
+_INPUT = struct.Struct("<BIIB")  # player id, last snapshot tick received, newest input seq, input count
+_SNAPSHOT = struct.Struct("<IIIB")  # tick, baseline tick, seq of the player's last applied input, car count
+
+# Fixed point per car, in this order. Flags are FLAG_* bits.
+CAR_FIELDS = (
+    "car", "x", "y", "direction", "vel_x", "vel_y", "speed",
+    "angular_velocity", "drift_turn_strength", "timer", "laps", "flags",
+)
+FIELD_SCALES = (
+    1, POSITION_SCALE, POSITION_SCALE, DIRECTION_SCALE, POSITION_SCALE, POSITION_SCALE, POSITION_SCALE,
+    DIRECTION_SCALE, DIRECTION_SCALE, 1000, 1, 1,
+)
+FLAG_DRIFTING = 1
+FLAG_CRASHED = 2
+FLAG_LAP_STARTED = 4
+FLAG_CHECKPOINT_REACHED = 8
+_EMPTY_CAR = (0,) * len(CAR_FIELDS)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def header(packet_type):
+    return _HEADER.pack(PROTOCOL_ID, PROTOCOL_VERSION, packet_type)
+
+
+def packet_type(data):
+    """The type of a packet, ProtocolError for anything that is not ours or from another version."""
+    try:
+        protocol, version, kind = _HEADER.unpack_from(data)
+    except struct.error:
+        raise ProtocolError("Packet too short")
+    if protocol != PROTOCOL_ID:
+        raise ProtocolError("Not a race packet")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Protocol version {version}, expected {PROTOCOL_VERSION}")
+    return kind
+
+
+def _unpack(layout, data):
+    try:
+        return layout.unpack_from(data, _HEADER.size)
+    except struct.error:
+        raise ProtocolError("Packet too short")
+
+
+def encode_join(car_index, map_name=""):
+    """map_name is the map the player picked, a server that hosts several maps starts its race there."""
+    return header(JOIN) + _JOIN.pack(car_index) + map_name.encode("utf-8")[:32]
+
+
+def decode_join(data):
+    """(car index, map name), the name is empty when the player did not pick one."""
+    car_index = _unpack(_JOIN, data)[0]
+    return car_index, data[_HEADER.size + _JOIN.size:].decode("utf-8", "replace")
+
+
+def encode_welcome(player_id, car_index, tick_rate, snapshot_rate, spawn_point, map_name):
+    x, y = (round(value * POSITION_SCALE) for value in spawn_point)
+    return header(WELCOME) + _WELCOME.pack(player_id, car_index, tick_rate, snapshot_rate, x, y, map_name.encode("utf-8"))
+
+
+def decode_welcome(data):
+    """(player id, car index, tick rate, snapshot rate, spawn point, map name)"""
+    player_id, car_index, tick_rate, snapshot_rate, x, y, name = _unpack(_WELCOME, data)
+    spawn_point = (x / POSITION_SCALE, y / POSITION_SCALE)
+    return player_id, car_index, tick_rate, snapshot_rate, spawn_point, name.rstrip(b"\0").decode("utf-8")
+
+
+def encode_reject(reason):
+    return header(REJECT) + _REJECT.pack(reason)
+
+
+def decode_reject(data):
+    return _unpack(_REJECT, data)[0]
+
+
+def encode_input(player_id, ack_tick, seq, inputs):
+    """inputs are the control bits of the last few ticks, oldest first, the last one belongs to seq."""
+    return header(INPUT) + _INPUT.pack(player_id, ack_tick, seq, len(inputs)) + bytes(inputs)
+
+
+def decode_input(data):
+    """(player id, ack tick, {seq: bits})"""
+    player_id, ack_tick, seq, count = _unpack(_INPUT, data)
+    start = _HEADER.size + _INPUT.size
+    bits = data[start:start + count]
+    if len(bits) != count:
+        raise ProtocolError("Input packet cut short")
+    first = seq - count + 1
+    return player_id, ack_tick, {first + i: value for i, value in enumerate(bits) if first + i > 0}
+
+
+def quantize_car(car, x, y, direction, vel_x, vel_y, speed, angular_velocity, drift_turn_strength, timer, laps, flags):
+    """The fixed point tuple of one car, in CAR_FIELDS order."""
+    values = (car, x, y, direction, vel_x, vel_y, speed, angular_velocity, drift_turn_strength, timer, laps, flags)
+    return tuple(round(value * scale) for value, scale in zip(values, FIELD_SCALES))
+
+
+def dequantize_car(fixed):
+    """dict of CAR_FIELDS in world units from a fixed point tuple."""
+    return {name: value / scale for name, value, scale in zip(CAR_FIELDS, fixed, FIELD_SCALES)}
+
+
+def _write_uvarint(out, value):
+    """Appends a LEB128 varint, 7 bits per byte."""
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_varint(out, value):
+    """Zigzag first, so small numbers of either sign take one byte."""
+    _write_uvarint(out, (value << 1) ^ (value >> 63))
+
+
+def _read_uvarint(data, offset):
+    result = shift = 0
+    while True:
+        if offset >= len(data):
+            raise ProtocolError("Snapshot cut short")
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+
+def _read_varint(data, offset):
+    value, offset = _read_uvarint(data, offset)
+    return (value >> 1) ^ -(value & 1), offset
+
+
+def encode_snapshot(tick, baseline_tick, ack_seq, cars, baseline=None):
+    """
+    cars maps player id to a fixed point tuple. Each car is written as its
+    id, a bitmask of the fields that differ from the baseline and the
+    zigzag varint difference of those fields. A car missing from the
+    baseline is written against zeros, so baseline=None gives a full
+    snapshot.
+    """
+    baseline = baseline or {}
+    out = bytearray(header(SNAPSHOT))
+    out += _SNAPSHOT.pack(tick, baseline_tick if baseline else NO_TICK, ack_seq, len(cars))
+    for player_id, fixed in cars.items():
+        old = baseline.get(player_id, _EMPTY_CAR)
+        changed = 0
+        deltas = []
+        for i, (value, before) in enumerate(zip(fixed, old)):
+            if value != before:
+                changed |= 1 << i
+                deltas.append(value - before)
+        out.append(player_id)
+        _write_uvarint(out, changed)
+        for delta in deltas:
+            _write_varint(out, delta)
+    return bytes(out)
+
+
+def snapshot_baseline(data):
+    """The baseline tick a snapshot was written against, to look it up before decoding."""
+    return _unpack(_SNAPSHOT, data)[1]
+
+
+def decode_snapshot(data, baseline=None):
+    """(tick, ack seq, {player id: fixed point tuple}), baseline is the cars of the snapshot's baseline tick."""
+    tick, baseline_tick, ack_seq, count = _unpack(_SNAPSHOT, data)
+    if baseline_tick != NO_TICK and baseline is None:
+        raise ProtocolError(f"Snapshot {tick} needs baseline {baseline_tick}")
+    baseline = baseline or {}
+    offset = _HEADER.size + _SNAPSHOT.size
+    cars = {}
+    for _ in range(count):
+        if offset >= len(data):
+            raise ProtocolError("Snapshot cut short")
+        player_id = data[offset]
+        changed, offset = _read_uvarint(data, offset + 1)
+        fixed = list(baseline.get(player_id, _EMPTY_CAR))
+        for i in range(len(CAR_FIELDS)):
+            if changed >> i & 1:
+                delta, offset = _read_varint(data, offset)
+                fixed[i] += delta
+        cars[player_id] = tuple(fixed)
+    return tick, ack_seq, cars
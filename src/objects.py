@@ -1,15 +1,14 @@
+import numpy as np
 import pyglet
+from pyglet.gl import GL_TRIANGLES, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_BLEND, glEnable, glDisable, glBlendFunc
 import static_object
-import math
-import time
+from camera import CameraGroup
+from main_utils import extract_mask_pixels
+from track_mask import TrackMask
 
 
-class Track(static_object.StaticObject):
-    # 210 -> 1 -> Start Line
-    # 220 -> 2 -> Finish Line
-    # 230 -> 5 -> Checkpoint 
-    grayscale_markings = {255: True, 210: 1, 220: 2, 200: 3, 27: 4, 230: 5}
-
+class Track(static_object.StaticObject, TrackMask):
+    """The track sprite together with its mask for surface queries."""
     def __init__(
         self,
         color_img,
@@ -18,93 +17,187 @@ class Track(static_object.StaticObject):
         scale=7,
         batch=None,
         group=pyglet.graphics.Group(2),
+        mask_pixels=None,
+        surfaces=None,
+        wall_field=None,
     ):
         self.group = group
-        super().__init__(
-            color_img, window, x=0, y=0, scale=scale, batch=batch, group=self.group
+        static_object.StaticObject.__init__(
+            self, color_img, window, x=0, y=0, scale=scale, batch=batch, group=self.group
         )
-        mask_sprite = pyglet.sprite.Sprite(mask_img, 0, 0)
-        self.mask_width = mask_sprite.width
-        self.mask_height = mask_sprite.height
+        # A map bundle has no grayscale image, only the mask arrays
+        if mask_img is None:
+            height, width = surfaces.shape
+        else:
+            width, height = mask_img.width, mask_img.height
+        if mask_pixels is None:
+            mask_pixels = extract_mask_pixels(mask_img)
+        TrackMask.__init__(self, mask_pixels, width, height, scale, surfaces, wall_field)
         self.scaled_size=self.get_scaled_size()
-        raw_data = mask_sprite.image.get_image_data()
-        self.pixels = raw_data.get_bytes(fmt="L", pitch=self.mask_width)
 
     def get_scaled_size(self):
         return self.sprite.width, self.sprite.height
 
-    def is_on_track(self, world_x, world_y):
-        x = int(world_x / self.sprite.scale)
-        y = int(world_y / self.sprite.scale)
-
-        if x < 0 or y < 0 or x >= self.mask_width or y >= self.mask_height:
-            return False
 
-        try:
-            idx = y * self.mask_width + x
-            pixel = self.pixels[idx]
-            return Track.grayscale_markings.get(pixel, False)
-        except (IndexError, KeyError):
-            return False
+def write_attribute(vertex_list, name, data):
+    """Copies a numpy array straight into a vertex list attribute in one bulk write."""
+    np.ctypeslib.as_array(getattr(vertex_list, name))[:] = np.ravel(data)
 
 
-class Tree(static_object.StaticObject):
-    def __init__(self, img, window, x=None, y=None, scale=1.0, batch=None, group=None):
+class TreeLayer:
+    """
+    All trees of a map packed into a single vertex list.
+    Every tree shares one SpriteGroup and the default sprite shader,
+    so the whole forest is drawn with one call.
+    """
+    def __init__(self, img, positions, scale=1.0, batch=None, group=None):
         img.anchor_x = img.width / 2
-        self.group = pyglet.graphics.Group(7)
-        super().__init__(img, window, x, y, scale, batch, self.group)
-        self.is_visible = False
-
-
+        self.texture = img.get_texture()
+        self.program = pyglet.sprite.get_default_shader()
+        self.group = pyglet.sprite.SpriteGroup(
+            self.texture, GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, self.program, group
+        )
+        self.positions = np.asarray(positions, dtype=np.float32).reshape(-1, 2)
+        self.scale = scale
+        self.vertex_list = None
+        if len(self.positions):
+            self.vertex_list = self._create_vertex_list(self.positions, batch)
+
+    def _create_vertex_list(self, positions, batch):
+        count = len(positions)
+        quad = np.array([0, 1, 2, 0, 2, 3], dtype=np.int64)
+        indices = (np.arange(count, dtype=np.int64)[:, None] * 4 + quad).ravel()
+
+        vertex_list = self.program.vertex_list_indexed(
+            count * 4, GL_TRIANGLES, indices.tolist(), batch, self.group,
+            position='f', colors='Bn', translate='f', scale='f', rotation='f', tex_coords='f',
+        )
 
-class Trail:
-    def __init__(self, batch):
-        self.group = pyglet.graphics.Group(3)
-        self.max_trail_size = 500
-        self.lifetime = 2.0  # seconds before trail disappears
+        x1, y1 = -self.texture.anchor_x, -self.texture.anchor_y
+        x2, y2 = x1 + self.texture.width, y1 + self.texture.height
+        corners = np.array([x1, y1, 0, x2, y1, 0, x2, y2, 0, x1, y2, 0], dtype=np.float32)
+        translate = np.zeros((count, 4, 3), dtype=np.float32)
+        translate[:, :, :2] = positions[:, None, :]
 
-        self.trail = [
-            pyglet.shapes.Circle(
-                0, 0, 10, color=(50, 50, 50), batch=batch, group=self.group
-            )
-            for _ in range(self.max_trail_size)
-        ]
+        write_attribute(vertex_list, 'position', np.tile(corners, count))
+        write_attribute(vertex_list, 'colors', np.full(count * 16, 255, dtype=np.uint8))
+        write_attribute(vertex_list, 'translate', translate)
+        write_attribute(vertex_list, 'scale', np.full(count * 8, self.scale, dtype=np.float32))
+        write_attribute(vertex_list, 'rotation', np.zeros(count * 4, dtype=np.float32))
+        write_attribute(vertex_list, 'tex_coords', np.tile(np.array(self.texture.tex_coords, dtype=np.float32), count))
+        return vertex_list
 
-        self.active_trails = set()
-        self.trail_age = [self.lifetime] * self.max_trail_size
-        self.trail_index = 0
+    def delete(self):
+        if self.vertex_list:
+            self.vertex_list.delete()
+            self.vertex_list = None
 
-        self._last_update_time = time.time()
 
-    def update(self, dx, dy, car):
-        current_time = time.time()
-        dt = current_time - self._last_update_time
-        self._last_update_time = current_time
 
-        for i in list(self.active_trails):
-            self.trail[i].x -= dx
-            self.trail[i].y -= dy
+class TrailGroup(pyglet.graphics.Group):
+    """Binds the shape shader with alpha blending for the skid particles."""
+    def __init__(self, program, parent=None):
+        super().__init__(parent=parent)
+        self.program = program
 
-            self.trail_age[i] += dt
+    def set_state(self):
+        self.program.use()
+        glEnable(GL_BLEND)
+        glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
-            if self.trail_age[i] < self.lifetime:
-                t = self.trail_age[i] / self.lifetime
-                self.trail[i].opacity = int(255 * (1 - t))
-                self.trail[i].radius = 10 * (1 - t)
-            else:
-                self.trail[i].opacity = 0
-                self.trail[i].radius = 0
-                self.active_trails.remove(i)
+    def unset_state(self):
+        glDisable(GL_BLEND)
+        self.program.stop()
 
-        if car.drifting:
-            trail_positions = car.get_trail_pos()
-            for corner in trail_positions:
-                circle = self.trail[self.trail_index]
-                circle.x = int(corner[0])
-                circle.y = int(corner[1])
-                circle.rotation = car.hitbox.rotation
 
-                self.trail_age[self.trail_index] = 0.0
-                self.active_trails.add(self.trail_index)
-                self.trail_index = (self.trail_index + 1) % self.max_trail_size
+class Trail:
+    """
+    Skid marks stored as a ring buffer of particles in numpy arrays.
+    Every particle is a circle in one shared vertex list that is
+    rewritten in bulk once per frame.
+    """
+    segments = 14
+
+    def __init__(self, camera, batch, max_trail_size=500):
+        self.camera = camera
+        self.max_trail_size = max_trail_size
+        self.lifetime = 2.0  # seconds before trail disappears
+        self.max_radius = 10
+        self.color = (50, 50, 50)
 
+        self.positions = np.zeros((max_trail_size, 2), dtype=np.float32)
+        self.trail_age = np.full(max_trail_size, self.lifetime, dtype=np.float32)
+        self.trail_index = 0
+        self.emit_interval = 1 / 60
+        self._emit_timer = 0.0
+        self._needs_upload = False
+
+        # Unit circle as a triangle fan: center vertex followed by the rim
+        self._verts_per_particle = self.segments + 1
+        angles = np.arange(self.segments) * (2 * np.pi / self.segments)
+        self._unit_circle = np.zeros((self._verts_per_particle, 2), dtype=np.float32)
+        self._unit_circle[1:, 0] = np.cos(angles)
+        self._unit_circle[1:, 1] = np.sin(angles)
+        rim = np.arange(self.segments)
+        fan = np.stack([np.zeros_like(rim), rim + 1, (rim + 1) % self.segments + 1], axis=1).ravel()
+        indices = (np.arange(max_trail_size)[:, None] * self._verts_per_particle + fan).ravel()
+
+        self._colors = np.empty((max_trail_size, self._verts_per_particle, 4), dtype=np.uint8)
+        self._colors[:, :, :3] = self.color
+        self._colors[:, :, 3] = 0
+
+        program = pyglet.shapes.get_default_shader()
+        self.group = TrailGroup(program, parent=CameraGroup(camera, 3))
+        self.vertex_list = program.vertex_list_indexed(
+            max_trail_size * self._verts_per_particle, GL_TRIANGLES, indices.tolist(), batch, self.group,
+            position='f', colors='Bn', translation='f', rotation='f',
+        )
+        write_attribute(self.vertex_list, 'position', np.zeros(max_trail_size * self._verts_per_particle * 2, dtype=np.float32))
+        write_attribute(self.vertex_list, 'colors', self._colors)
+        write_attribute(self.vertex_list, 'translation', np.zeros(max_trail_size * self._verts_per_particle * 2, dtype=np.float32))
+        write_attribute(self.vertex_list, 'rotation', np.zeros(max_trail_size * self._verts_per_particle, dtype=np.float32))
+
+    def emit(self, world_points):
+        """Spawns fresh particles at world positions, overwriting the oldest ones."""
+        count = len(world_points)
+        slots = (self.trail_index + np.arange(count)) % self.max_trail_size
+        self.positions[slots] = world_points
+        self.trail_age[slots] = 0.0
+        self.trail_index = int(slots[-1] + 1) % self.max_trail_size
+
+        translation = np.ctypeslib.as_array(self.vertex_list.translation)
+        translation.reshape(self.max_trail_size, self._verts_per_particle, 2)[slots] = (
+            self.positions[slots][:, None, :]
+        )
+        self._needs_upload = True
+
+    def update(self, car, dt):
+        self.trail_age += dt
+        self._emit_timer += dt
+
+        # Emit at a fixed rate so the trail looks the same at any tick rate
+        if car.drifting and self._emit_timer >= self.emit_interval:
+            self._emit_timer = 0.0
+            self.emit(car.get_trail_pos())
+
+        alive = self.trail_age < self.lifetime
+        if not (self._needs_upload or alive.any()):
+            return
+        self._upload(alive)
+
+    def _upload(self, alive):
+        fade = np.where(alive, 1 - self.trail_age / self.lifetime, 0).astype(np.float32)
+        self._colors[:, :, 3] = (255 * fade)[:, None]
+        radius = self.max_radius * fade
+        write_attribute(self.vertex_list, 'position', self._unit_circle[None, :, :] * radius[:, None, None])
+        write_attribute(self.vertex_list, 'colors', self._colors)
+        # Dead particles are uploaded once more at zero size, then skipped
+        self._needs_upload = bool(alive.any())
+
+    def clear(self):
+        """Removes every particle at once."""
+        self.trail_age[:] = self.lifetime
+        self._needs_upload = True
+
+    def active_count(self):
+        return int(np.count_nonzero(self.trail_age < self.lifetime))
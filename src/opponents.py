@@ -0,0 +1,133 @@
+from collections import namedtuple
+import numpy as np
+import pyglet
+from car_physics import CarPhysics, CarControls
+from car_fleet import CarFleet, FleetRaceRules
+from ai_driver import RayDriver
+from track_mask import SURFACE_WALL, SURFACE_SOFT_WALL, SURFACE_OFF_TRACK
+
+# Everything about the AI cars that changes during a race, for snapshots.RaceSnapshot
+OpponentsState = namedtuple("OpponentsState", ["fleet", "laps", "time_after_crash", "driver"])
+
+START_DIRECTION = -180
+
+
+def grid_slots(track, spawn_point, count, length, width, direction=START_DIRECTION):
+    """
+    Start positions two abreast, facing direction: behind spawn_point first,
+    then ahead of it when the road behind runs out. Slots with a corner off
+    the road are skipped, a row where neither fits tries its middle.
+    """
+    heading = np.radians(direction)
+    forward = np.array([np.cos(heading), np.sin(heading)])
+    side = np.array([-forward[1], forward[0]])
+    spawn = np.array(spawn_point, dtype=np.float64)
+    corner_signs = np.array([(a, b) for a in (-1, 1) for b in (-1, 1)], dtype=np.float64)
+
+    def fits(center):
+        corners = center + np.outer(corner_signs[:, 0] * length / 2, forward) + np.outer(corner_signs[:, 1] * width / 2, side)
+        surfaces = track.classify_points(corners[:, 0], corners[:, 1])
+        return not np.isin(surfaces, (SURFACE_WALL, SURFACE_SOFT_WALL, SURFACE_OFF_TRACK)).any()
+
+    slots = []
+    for rows in (range(-1, -count - 1, -1), range(1, count + 1)):
+        for row in rows:
+            centers = [spawn + forward * length * 1.4 * row + side * width * 1.3 * column for column in (-1, 1)]
+            row_slots = [center for center in centers if fits(center)]
+            if not row_slots and fits((centers[0] + centers[1]) / 2):
+                row_slots = [(centers[0] + centers[1]) / 2]
+            for center in row_slots:
+                slots.append((float(center[0]), float(center[1])))
+                if len(slots) == count:
+                    return slots
+    return slots
+
+
+class Opponents:
+    """
+    AI cars racing along with the player. Their physics is one CarFleet,
+    their sprites reuse the player's car frames and sprite group, so the
+    whole field is drawn together with the player's car.
+    """
+    def __init__(self, count, player, track, spawn_point, total_laps, batch, seed=0):
+        physics = player.physics
+        slots = grid_slots(track, spawn_point, count, physics.hitbox_width, physics.hitbox_height)
+        if len(slots) < count:
+            print(f"Warning: Only {len(slots)} of {count} opponents fit on the start grid")
+
+        cars = []
+        for x, y in slots:
+            car = CarPhysics(physics.power, physics.friction, physics.hitbox_width, physics.hitbox_height, x, y)
+            car.direction = START_DIRECTION
+            cars.append(car)
+        self.fleet = CarFleet(cars)
+
+        # Some drivers are braver than others, which spreads the field out
+        rng = np.random.default_rng(seed)
+        self.driver = RayDriver(self.fleet, speed_per_room=rng.uniform(0.85, 1.1, len(cars)))
+
+        self.rules = FleetRaceRules(self.fleet, total_laps, START_DIRECTION)
+        self.previous_x = self.fleet.x.copy()
+        self.previous_y = self.fleet.y.copy()
+
+        self.textures = player.textures
+        self.frames = self._frames()
+        self.sprites = []
+        for frame in self.frames.tolist():
+            sprite = pyglet.sprite.Sprite(self.textures[frame], batch=batch, group=player.group)
+            sprite.scale = player.sprite.scale
+            self.sprites.append(sprite)
+        self.sync_sprites(1.0)
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def _frames(self):
+        """Car sheet frame of every car, the same rounding player.Car uses."""
+        return (np.round(0 - self.fleet.direction / 45) % 8).astype(np.int64)
+
+    def update(self, dt, track, trees=None):
+        """Drives and steps every AI car one tick and applies the race rules to them. Returns the cars put back on their start slot."""
+        fleet = self.fleet
+        controls = self.driver.controls(track, dt)
+        racing = self.rules.racing
+        controls = CarControls(controls.accelerate & racing, controls.brake & racing, controls.left & racing, controls.right & racing)
+
+        self.previous_x, self.previous_y = fleet.x.copy(), fleet.y.copy()
+        fleet.step(dt, controls, track, trees)
+        respawn = self.rules.apply(dt)
+        self.previous_x[respawn] = fleet.x[respawn]
+        self.previous_y[respawn] = fleet.y[respawn]
+
+        frames = self._frames()
+        for i in np.flatnonzero(frames != self.frames).tolist():
+            self.sprites[i].image = self.textures[frames[i]]
+        self.frames = frames
+        return respawn
+
+    def sync_sprites(self, alpha):
+        """Draws every car between its last two physics positions."""
+        xs = self.previous_x + (self.fleet.x - self.previous_x) * alpha
+        ys = self.previous_y + (self.fleet.y - self.previous_y) * alpha
+        for sprite, x, y in zip(self.sprites, xs.tolist(), ys.tolist()):
+            sprite.position = (x - sprite.width / 2, y - sprite.height / 2, 0)
+
+    def snapshot(self):
+        return OpponentsState(self.fleet.snapshot(), self.rules.laps.copy(), self.rules.time_after_crash.copy(), self.driver.snapshot())
+
+    def restore(self, state):
+        """Puts every AI car back into a snapshot and jumps the sprites there."""
+        self.fleet.restore(state.fleet)
+        self.rules.laps[:] = state.laps
+        self.rules.time_after_crash[:] = state.time_after_crash
+        self.driver.restore(state.driver)
+        self.previous_x, self.previous_y = self.fleet.x.copy(), self.fleet.y.copy()
+        self.frames = self._frames()
+        for sprite, frame in zip(self.sprites, self.frames.tolist()):
+            sprite.image = self.textures[frame]
+        self.sync_sprites(1.0)
+
+    def delete(self):
+        for sprite in self.sprites:
+            sprite.delete()
+        self.sprites = []
@@ -0,0 +1,118 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_cache import asset_cache
+from main_utils import assets_dir, load_sprite_data, extract_mask_pixels, decode_png
+from map_bundle import MapBundle
+from track_mask import TrackMask
+from tree_grid import place_trees, map_tree_seed, TREE_COUNT
+from progress_field import ProgressField
+
+PreparedMap = namedtuple(
+    "PreparedMap", ["map_name", "images", "mask_pixels", "tree_seed", "tree_positions", "bundle"]
+)
+
+
+def prepare_map(map_name, tree_seed):
+    """
+    Everything about a map that needs no GL context: decoded images, the
+    mask bytes, the wall field and progress field (cached on disk) and the
+    tree positions. Runs on the preload thread.
+    """
+    # A compiled bundle already holds all of it but the progress field
+    bundle = MapBundle.open(map_name)
+    if bundle is not None:
+        warm_progress_field(bundle.track_mask())
+        images = {
+            filename: bundle.image(name) for name, filename in bundle.image_filenames().items()
+            if ("image", filename) not in asset_cache
+        }
+        return PreparedMap(map_name, images, None, bundle.tree_seed, bundle.tree_positions, bundle)
+
+    scale = load_sprite_data(1)[map_name]["scale"]
+    keys = [f"{map_name}_map", f"{map_name}_map_grayscale", f"{map_name}_map_decorations"]
+
+    images = {}
+    for key in keys:
+        filename = f"{key}.png"
+        path = os.path.join(assets_dir(), filename)
+        if ("image", filename) in asset_cache or not os.path.exists(path):
+            continue
+        images[filename] = decode_png(path)
+
+    # Cached images are textures, which must not be touched off the main thread
+    grayscale_key = f"{map_name}_map_grayscale"
+    mask_pixels = asset_cache.peek(("mask", grayscale_key))
+    grayscale = images.get(f"{grayscale_key}.png") or asset_cache.peek(("image", f"{grayscale_key}.png"))
+    if mask_pixels is None or grayscale is None:
+        grayscale = images.get(f"{grayscale_key}.png") or decode_png(
+            os.path.join(assets_dir(), f"{grayscale_key}.png")
+        )
+        mask_pixels = extract_mask_pixels(grayscale)
+
+    width, height = grayscale.width, grayscale.height
+    mask = TrackMask(mask_pixels, width, height, scale)
+    warm_progress_field(mask)
+    positions = asset_cache.peek(("trees", map_name, tree_seed))
+    if positions is None:
+        positions = place_trees(TREE_COUNT, mask, tree_seed)
+    return PreparedMap(map_name, images, mask_pixels, tree_seed, positions, None)
+
+
+def warm_progress_field(mask):
+    """Builds the progress field of a mask into the disk cache, so starting the race only loads it."""
+    try:
+        ProgressField.for_mask(mask.surfaces, mask.scale)
+    except ValueError as e:
+        print(f"Warning: No progress field for this map: {e}")
+
+
+class MapPreloader:
+    """
+    Prepares the picked map on a worker thread while the car picker is open.
+    The main thread turns the result into textures in install(), GL calls
+    must not happen on the worker. Only the last picked map is kept, a
+    PreparedMap holds whole decoded images outside the asset cache's budget.
+    """
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="map-preload")
+        self.futures = {}
+
+    def prefetch(self, map_name):
+        if map_name not in self.futures:
+            self._drop_all()
+            self.futures[map_name] = self.executor.submit(prepare_map, map_name, map_tree_seed(map_name))
+
+    def _drop_all(self):
+        """Forgets every prefetched map, the ones still waiting for the worker are not prepared at all."""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures.clear()
+
+    def is_ready(self, map_name):
+        future = self.futures.get(map_name)
+        return future is None or future.done()
+
+    def take(self, map_name):
+        """Returns the PreparedMap for map_name and forgets it, or None if there is none."""
+        future = self.futures.pop(map_name, None)
+        self._drop_all()
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"Warning: Preloading {map_name} failed, loading it now instead: {e}")
+            return None
+
+    def install(self, prepared):
+        """Moves the decoded images, mask bytes and trees into the asset cache, creating textures here."""
+        for filename, image in prepared.images.items():
+            asset_cache.get(("image", filename), image.get_texture)
+        asset_cache.get(("trees", prepared.map_name, prepared.tree_seed), lambda: prepared.tree_positions)
+        if prepared.mask_pixels is not None:
+            asset_cache.get(("mask", f"{prepared.map_name}_map_grayscale"), lambda: prepared.mask_pixels)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
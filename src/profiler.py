@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread from a background thread for a
+    fixed number of seconds and writes a Chrome trace JSON, which opens in
+    chrome://tracing, Perfetto and speedscope.
+
+    The sampled thread only pays for mark_frame(); the stack walking runs on
+    the sampler thread. Frame boundaries show up as "Frame N" spans on their
+    own track above the stacks.
+    """
+    def __init__(self, interval=0.002, output_dir=None):
+        self.interval = interval
+        self.output_dir = output_dir or os.path.join(os.getcwd(), "profiles")
+        self.target_thread_id = None
+        self.samples = []
+        self.frame_marks = []
+        self.output_path = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._start_time = 0.0
+        self._code_names = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, name="profile", thread_id=None):
+        """Starts a capture of the calling thread (or thread_id) that saves itself after seconds."""
+        if self.running:
+            return False
+        self.target_thread_id = thread_id or threading.get_ident()
+        self.samples = []
+        self.frame_marks = []
+        self.output_path = os.path.join(
+            self.output_dir, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        self._stop.clear()
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, args=(seconds,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+        print(f"Profiling for {seconds:g} s...")
+        return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def mark_frame(self):
+        """Called once per frame by the sampled thread while a capture runs."""
+        if self.running:
+            self.frame_marks.append(time.perf_counter())
+
+    def _frame_name(self, code):
+        name = self._code_names.get(code)
+        if name is None:
+            filename = os.path.basename(code.co_filename)
+            qualname = getattr(code, "co_qualname", code.co_name)
+            name = self._code_names[code] = f"{qualname} ({filename}:{code.co_firstlineno})"
+        return name
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.target_thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_name(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self, seconds):
+        end = self._start_time + seconds
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now >= end:
+                break
+            self.samples.append((now, self._sample()))
+            self._stop.wait(self.interval)
+        self._code_names = {}
+
+        try:
+            self.save(self.output_path)
+            print(f"Profile saved to {self.output_path} ({len(self.samples)} samples)")
+        except OSError as e:
+            print(f"Warning: Could not save profile: {e}")
+
+    def trace_events(self):
+        """Turns the samples into Chrome trace begin/end events, timestamps in microseconds."""
+        start = self._start_time
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "main"}},
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "frames"}},
+        ]
+
+        open_stack = []
+        last_time = 0.0
+        for sample_time, stack in self.samples:
+            ts = (sample_time - start) * 1e6
+            common = 0
+            while common < min(len(open_stack), len(stack)) and open_stack[common] == stack[common]:
+                common += 1
+            for name in reversed(open_stack[common:]):
+                events.append({"name": name, "ph": "E", "pid": 1, "tid": 1, "ts": ts})
+            for name in stack[common:]:
+                events.append({"name": name, "ph": "B", "pid": 1, "tid": 1, "ts": ts})
+            open_stack = stack
+            last_time = ts
+        for name in reversed(open_stack):
+            events.append({"name": name, "ph": "E", "pid": 1, "tid": 1, "ts": last_time + self.interval * 1e6})
+
+        for i, (frame_start, frame_end) in enumerate(zip(self.frame_marks, self.frame_marks[1:])):
+            events.append({
+                "name": f"Frame {i}", "ph": "X", "pid": 1, "tid": 0,
+                "ts": (frame_start - start) * 1e6, "dur": (frame_end - frame_start) * 1e6,
+            })
+        return events
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, f)
+        os.replace(temp_path, path)
@@ -0,0 +1,184 @@
+import os
+import numpy as np
+from racing_line import RacingLine, drivable_pixels, mask_key
+from wall_field import cache_dir
+
+# Bump when the field layout changes so stale cache files are ignored
+PROGRESS_VERSION = 1
+NO_SAMPLE = np.iinfo(np.uint16).max  # Pixels the flood did not reach, off the track
+
+# (dy, dx) steps to the 8 neighbours of a pixel
+_STEPS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+
+
+def flood_samples(region, center):
+    """
+    Index of the nearest centerline sample for every pixel of region, by a
+    breadth first flood over the region seeded at the samples. It never
+    crosses a wall, so two stretches of road side by side keep their own
+    samples. Pixels it does not reach get NO_SAMPLE.
+    """
+    height, width = region.shape
+    # A one pixel frame of blocked pixels keeps flat neighbour steps from wrapping
+    padded = np.zeros((height + 2, width + 2), dtype=bool)
+    padded[1:-1, 1:-1] = region
+    row = width + 2
+    free = padded.ravel()
+    labels = np.full(free.shape, NO_SAMPLE, dtype=np.uint16)
+
+    px = np.floor(center[:, 0]).astype(np.int64) + 1
+    py = np.floor(center[:, 1]).astype(np.int64) + 1
+    inside = (px >= 1) & (py >= 1) & (px <= width) & (py <= height)
+    frontier = py[inside] * row + px[inside]
+    keep = free[frontier]
+    frontier = frontier[keep]
+    labels[frontier] = np.flatnonzero(inside)[keep]
+
+    while len(frontier):
+        reached = []
+        for dy, dx in _STEPS:
+            neighbours = frontier + (dy * row + dx)
+            new = free[neighbours] & (labels[neighbours] == NO_SAMPLE)
+            labels[neighbours[new]] = labels[frontier[new]]
+            reached.append(neighbours[new])
+        frontier = np.unique(np.concatenate(reached))
+    return labels.reshape(height + 2, width + 2)[1:-1, 1:-1].copy()
+
+
+class ProgressField:
+    """
+    Distance along the track from the start line for every mask pixel:
+    each drivable pixel holds the index of its centerline sample, so the
+    progress, the track direction and the wrong way test for any number of
+    cars are one array lookup. Computed once per mask and cached on disk.
+    """
+    def __init__(self, samples, line, scale):
+        self.samples = samples
+        self.line = line
+        self.scale = scale
+        self.height, self.width = samples.shape
+
+        # Driving direction at every sample in degrees, like CarPhysics.direction
+        ahead = np.roll(line.center, -1, axis=0) if line.closed else np.vstack((line.center[1:], line.center[-1:]))
+        behind = np.roll(line.center, 1, axis=0) if line.closed else np.vstack((line.center[:1], line.center[:-1]))
+        tangent = ahead - behind
+        self.direction = np.degrees(np.arctan2(tangent[:, 1], tangent[:, 0]))
+
+    @classmethod
+    def for_mask(cls, surfaces, scale):
+        """Raises ValueError like RacingLine.for_mask when the mask has no lap to follow."""
+        line = RacingLine.for_mask(surfaces, scale)
+        path = os.path.join(cache_dir(), f"progress_field_v{PROGRESS_VERSION}_{mask_key(surfaces)}.npz")
+
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return cls(data["samples"], line, scale)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Warning: Ignoring broken progress field cache {path}: {e}")
+
+        samples = flood_samples(drivable_pixels(surfaces), line.center / scale)
+        try:
+            os.makedirs(cache_dir(), exist_ok=True)
+            temp_path = path + ".tmp.npz"
+            np.savez_compressed(temp_path, samples=samples)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache progress field: {e}")
+        return cls(samples, line, scale)
+
+    @property
+    def length(self):
+        """World pixels in one lap along the centerline."""
+        return self.line.length
+
+    def sample_at(self, xs, ys):
+        """Centerline sample index under each world point, -1 off the track."""
+        px = np.floor(np.asarray(xs, dtype=np.float64) / self.scale).astype(np.int64)
+        py = np.floor(np.asarray(ys, dtype=np.float64) / self.scale).astype(np.int64)
+        inside = (px >= 0) & (py >= 0) & (px < self.width) & (py < self.height)
+        samples = np.full(px.shape, -1, dtype=np.int64)
+        samples[inside] = self.samples[py[inside], px[inside]]
+        samples[samples == NO_SAMPLE] = -1
+        return samples
+
+    def progress(self, xs, ys):
+        """World pixels along the lap from the start line to each point, NaN off the track."""
+        return self.progress_of(self.sample_at(xs, ys))
+
+    def progress_of(self, samples):
+        return np.where(samples >= 0, self.line.distance[samples], np.nan)
+
+    def is_wrong_way(self, xs, ys, directions):
+        """True for cars facing away from the driving direction of their stretch of track."""
+        return self.is_wrong_way_at(self.sample_at(xs, ys), directions)
+
+    def is_wrong_way_at(self, samples, directions, tolerance=110):
+        difference = (np.asarray(directions, dtype=np.float64) - self.direction[samples] + 180) % 360 - 180
+        return (samples >= 0) & (np.abs(difference) > tolerance)
+
+
+class RaceProgress:
+    """
+    How far every car of a race has come since the start, for the
+    standings. The lap progress from a ProgressField is unwrapped across
+    the start line, so laps need no separate counting. Car 0 is the player,
+    the rest are the AI cars in order.
+    """
+    def __init__(self, field, xs, ys, wrong_way_delay=1.0):
+        self.field = field
+        self.wrong_way_delay = wrong_way_delay
+        self.last = np.nan_to_num(field.progress(xs, ys))
+        self.covered = np.zeros(len(self.last))
+        self.wrong_way_time = np.zeros(len(self.last))
+
+    def update(self, dt, xs, ys, directions):
+        """One lookup per car: its progress along the lap and whether it faces the wrong way."""
+        samples = self.field.sample_at(xs, ys)
+        progress = self.field.progress_of(samples)
+        on_track = ~np.isnan(progress)
+        step = np.where(on_track, progress - self.last, 0.0)
+        if self.field.line.closed:
+            # Half a lap in one tick is a crossing of the start line, not a drive
+            half = self.field.length / 2
+            step = np.where(step < -half, step + self.field.length, np.where(step > half, step - self.field.length, step))
+        self.covered += step
+        self.last = np.where(on_track, progress, self.last)
+
+        wrong_way = self.field.is_wrong_way_at(samples, directions)
+        self.wrong_way_time = np.where(wrong_way, self.wrong_way_time + dt, 0.0)
+
+    def respawn(self, cars, xs, ys):
+        """
+        Call when cars (indices) were put back to xs, ys without driving
+        there, like a crash respawn. The way back along the lap is taken off
+        their covered distance, update() would count the jump as driving.
+        """
+        cars = np.asarray(cars, dtype=np.int64)
+        progress = self.field.progress(xs, ys)
+        progress = np.where(np.isnan(progress), self.last[cars], progress)
+        lost = self.last[cars] - progress
+        if self.field.line.closed:
+            lost %= self.field.length  # Back behind the start line is still the same lap
+        self.covered[cars] -= lost
+        self.last[cars] = progress
+        self.wrong_way_time[cars] = 0.0
+
+    @property
+    def wrong_way(self):
+        """Cars that have faced backwards for longer than wrong_way_delay seconds."""
+        return self.wrong_way_time > self.wrong_way_delay
+
+    def positions(self):
+        """Race position of every car, 1 for the leader."""
+        order = np.argsort(-self.covered, kind="stable")
+        positions = np.empty(len(order), dtype=np.int64)
+        positions[order] = np.arange(1, len(order) + 1)
+        return positions
+
+    def snapshot(self):
+        return (self.last.copy(), self.covered.copy(), self.wrong_way_time.copy())
+
+    def restore(self, state):
+        self.last[:], self.covered[:], self.wrong_way_time[:] = state
+
@@ -0,0 +1,477 @@
+"""
+Time trial host for events: many independent races in one process, on one
+asyncio event loop, without a window. Everybody who joins gets a race of
+their own on the map they picked in the menu. The host drives it like
+lan_server.py drives a LAN race, so the game joins it the same way:
+
+    python3 src/race_host.py [--maps track donut] [--port 47611] [--snapshot-rate 20]
+    python3 src/main.py --join HOST:47611
+
+Every 10 seconds it prints the number of races, its time per tick, the share
+of one core it needs, the time of each map's fleet step and the races that
+need the most time of their own.
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import time
+
+import numpy as np
+import pyglet
+pyglet.options['shadow_window'] = False  # Decoding the masks needs no GL context
+
+import netcode
+from main_utils import load_sprite_data
+from car_physics import CarControls
+from car_fleet import CarFleet, FleetRaceRules
+from opponents import START_DIRECTION
+from race_runner import load_track_mask, load_map_trees, create_car
+from frame_timer import FrameTimer
+from replay import decode_fleet_controls
+from lan_server import Connection, CATCH_UP_BACKLOG, BASELINE_SECONDS
+
+DEFAULT_HOST_PORT = netcode.DEFAULT_PORT + 1
+METRIC_TICKS = 256  # Recent ticks kept per race and per map for their tick time percentiles
+RECEIVE_BUFFER = 4 * 1024 * 1024  # Room for a tick's inputs of every race, in bytes
+
+
+def freeze(*arrays):
+    """Marks shared arrays read-only, a race that writes into them fails instead of changing every race."""
+    for array in arrays:
+        array.flags.writeable = False
+
+
+class Session(Connection):
+    """One player's race: a lan_server.Connection with its car slot, its snapshots and its lap times."""
+    def __init__(self, session_id, address, car_index, hosted_map, slot, now):
+        super().__init__(0, address, car_index, now)  # Alone in its race, always player 0
+        self.session_id = session_id
+        self.map = hosted_map
+        self.slot = slot
+        self.ticks = 0
+        self.history = {}  # tick -> cars, the baselines for deltas
+        self.lap_times = []
+        self.finished = False
+        self.joined_cursor = hosted_map.cost_cursor  # First column of the cost ring that is this race's
+
+
+class HostedMap:
+    """
+    One map and every race on it. The mask and the trees are loaded once
+    and shared read-only. The cars of all races are one CarFleet, cars of a
+    fleet never touch each other, so each race still drives alone. The
+    fleet doubles in size when it is full.
+    """
+    def __init__(self, map_name, car_names, dt, snapshot_interval):
+        map_data = load_sprite_data(1)[map_name]
+        self.name = map_name
+        self.car_names = car_names
+        self.dt = dt
+        self.snapshot_interval = snapshot_interval
+        self.total_laps = map_data["total_laps"]
+        # On the fixed point grid, so the clients spawn on exactly the same spot
+        self.spawn_point = tuple(round(value * netcode.POSITION_SCALE) / netcode.POSITION_SCALE for value in map_data["spawn_point"])
+
+        self.track = load_track_mask(map_name)
+        self.trees = load_map_trees(map_name, self.track)
+        freeze(self.track.surfaces, self.track.wall_field.distance, self.track.wall_field.normals, self.trees.positions)
+
+        self.sessions = []  # slot -> Session or None
+        self.cars = []  # slot -> CarPhysics with the slot's car parameters
+        self.fleet = None
+        self.rules = None
+        self.bits = np.zeros(0, dtype=np.uint8)
+        self.car_index = np.zeros(0, dtype=np.int64)
+        self.costs = np.zeros((0, METRIC_TICKS))  # Seconds of every slot's own work in the recent ticks
+        self.fleet_costs = np.zeros(METRIC_TICKS)  # Seconds of the fleet step in the recent ticks, shared by all races
+        self.cost_cursor = 0
+        self._grow(8)
+
+    def __len__(self):
+        return len(self.sessions) - self.sessions.count(None)
+
+    def _place(self, car):
+        car.x, car.y = self.spawn_point
+        car.direction = START_DIRECTION
+        return car
+
+    def _grow(self, capacity):
+        """Rebuilds the fleet with room for capacity cars, the races on it go on unchanged."""
+        old = len(self.cars)
+        for i, car in enumerate(self.cars):
+            car.restore(self.fleet.state_of(i))
+        self.cars += [self._place(create_car(self.car_names[0])) for _ in range(capacity - old)]
+        self.sessions += [None] * (capacity - old)
+
+        fleet = CarFleet(self.cars)
+        rules = FleetRaceRules(fleet, self.total_laps, START_DIRECTION)
+        rules.start_x[:], rules.start_y[:] = self.spawn_point
+        if self.rules is not None:
+            for name in ("laps", "time_after_crash", "lap_time"):
+                getattr(rules, name)[:old] = getattr(self.rules, name)
+        self.fleet, self.rules = fleet, rules
+        self.bits = np.concatenate((self.bits, np.zeros(capacity - old, dtype=np.uint8)))
+        self.car_index = np.concatenate((self.car_index, np.zeros(capacity - old, dtype=np.int64)))
+        self.costs = np.concatenate((self.costs, np.zeros((capacity - old, METRIC_TICKS))))
+
+    def add(self, session_id, address, car_index, car, now):
+        """A new race on this map, its car waits on the spawn point."""
+        if None not in self.sessions:
+            self._grow(2 * len(self.sessions))
+        slot = self.sessions.index(None)
+        self.cars[slot] = self._place(car)
+        self.fleet.set_car(slot, car)
+        for name in ("laps", "time_after_crash", "lap_time"):
+            getattr(self.rules, name)[slot] = 0
+        self.bits[slot] = 0
+        self.car_index[slot] = car_index
+        self.costs[slot] = 0
+        session = self.sessions[slot] = Session(session_id, address, car_index, self, slot, now)
+        return session
+
+    def remove(self, session):
+        self.sessions[session.slot] = None
+
+    def step(self, sessions, costs):
+        """
+        One tick for the races among sessions whose next input has arrived.
+        The time taking each race's input is added to costs by slot. Returns
+        the mask of slots that moved and the seconds of the fleet step.
+        """
+        moving = np.zeros(len(self.sessions), dtype=bool)
+        for session in sessions:
+            start = time.perf_counter()
+            bits = session.next_input()
+            if bits is not None:
+                moving[session.slot] = True
+                self.bits[session.slot] = bits
+            costs[session.slot] += time.perf_counter() - start
+        if not moving.any():
+            return moving, 0.0
+
+        start = time.perf_counter()
+        rules = self.rules
+        racing = rules.racing
+        controls = CarControls(*(keys & racing for keys in decode_fleet_controls(self.bits)))
+        rules.step(self.dt, controls, self.track, self.trees, moving)
+        for slot in np.flatnonzero(rules.finished).tolist():
+            session = self.sessions[slot]
+            session.lap_times.append(float(rules.lap_time[slot]))
+            if rules.laps[slot] >= self.total_laps and not session.finished:
+                session.finished = True
+                print(f"Race {session.session_id} on {self.name} finished: "
+                      f"{sum(session.lap_times):.2f} s, best lap {min(session.lap_times):.2f} s")
+        for slot in np.flatnonzero(moving).tolist():
+            self.sessions[slot].ticks += 1
+        return moving, time.perf_counter() - start
+
+    def tick(self, host_tick, send):
+        """
+        Steps every race on the map one tick and sends the snapshots due.
+        The fleet step is timed once for the map, the input and the
+        snapshot of every race are timed as that race's own work.
+        """
+        sessions = [session for session in self.sessions if session is not None]
+        if not sessions:
+            return
+        costs = np.zeros(len(self.sessions))
+        _, fleet_cost = self.step(sessions, costs)
+        # Races whose inputs piled up after a hitch get a second step until they are back in time
+        behind = [session for session in sessions if len(session.pending) > CATCH_UP_BACKLOG]
+        if behind:
+            fleet_cost += self.step(behind, costs)[1]
+
+        # Snapshots are spread over the interval by slot, so every tick sends about as many
+        due = [session for session in sessions if (host_tick + session.slot) % self.snapshot_interval == 0]
+        if due:
+            cars = self.fixed_cars(np.array([session.slot for session in due]))
+            oldest = host_tick - BASELINE_SECONDS / self.dt
+            for session, fixed in zip(due, cars):
+                start = time.perf_counter()
+                snapshot = {0: fixed}
+                session.history[host_tick] = snapshot
+                for tick in [tick for tick in session.history if tick < oldest]:
+                    del session.history[tick]
+                baseline = session.history.get(session.ack_tick)
+                send(session, netcode.encode_snapshot(host_tick, session.ack_tick, session.applied_seq, snapshot, baseline))
+                session.snapshots += 1
+                session.full_snapshots += baseline is None
+                costs[session.slot] += time.perf_counter() - start
+
+        self.costs[:, self.cost_cursor % METRIC_TICKS] = costs
+        self.fleet_costs[self.cost_cursor % METRIC_TICKS] = fleet_cost
+        self.cost_cursor += 1
+
+    def fixed_cars(self, slots):
+        """Fixed point tuples of the cars in slots, in netcode.CAR_FIELDS order."""
+        fleet = self.fleet
+        flags = (
+            fleet.drifting[slots] * netcode.FLAG_DRIFTING
+            | fleet.crashed[slots] * netcode.FLAG_CRASHED
+            | fleet.lap_started[slots] * netcode.FLAG_LAP_STARTED
+            | fleet.checkpoint_reached[slots] * netcode.FLAG_CHECKPOINT_REACHED
+        )
+        values = np.stack((
+            self.car_index[slots], fleet.x[slots], fleet.y[slots], fleet.direction[slots],
+            fleet.vel_x[slots], fleet.vel_y[slots], fleet.speed[slots], fleet.angular_velocity[slots],
+            fleet.drift_turn_strength[slots], fleet.timer[slots], self.rules.laps[slots], flags,
+        ), axis=1)
+        return [tuple(row) for row in np.round(values * np.array(netcode.FIELD_SCALES)).astype(np.int64).tolist()]
+
+    def _percentiles(self, costs, since):
+        """p50 and p99 in ms of costs, a ring of METRIC_TICKS columns, over the ticks from since on."""
+        count = min(self.cost_cursor - since, METRIC_TICKS)
+        if count <= 0:
+            return 0.0, 0.0
+        columns = np.arange(self.cost_cursor - count, self.cost_cursor) % METRIC_TICKS
+        p50, p99 = np.percentile(costs[columns], (50, 99))
+        return float(p50) * 1000, float(p99) * 1000
+
+    def tick_times(self, session):
+        """
+        p50 and p99 in ms of one race's own work per tick over its recent
+        ticks: taking its input and encoding and sending its snapshots. The
+        fleet step it shares with the other races is in fleet_times().
+        """
+        return self._percentiles(self.costs[session.slot], session.joined_cursor)
+
+    def fleet_times(self):
+        """p50 and p99 in ms of the map's fleet step per tick, over the recent ticks."""
+        return self._percentiles(self.fleet_costs, 0)
+
+
+class RaceHost:
+    """
+    Every race of the process, keyed by the player's address. The event
+    loop reads packets whenever the socket has some and runs tick() at the
+    tick rate. tick() steps every map's fleet once, so a tick costs one
+    fleet step per map plus a little own work per race.
+    """
+    def __init__(self, map_names, tick_rate=60, snapshot_rate=20, max_sessions=1000, timeout=5.0):
+        if tick_rate % snapshot_rate:
+            raise ValueError(f"The tick rate {tick_rate} is not a multiple of the snapshot rate {snapshot_rate}")
+        all_map_data = load_sprite_data(1)
+        for map_name in map_names:
+            if map_name not in all_map_data:
+                raise ValueError(f"Unknown map {map_name}, expected one of {', '.join(all_map_data)}")
+
+        self.tick_rate = tick_rate
+        self.dt = 1 / tick_rate
+        self.snapshot_rate = snapshot_rate
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        self.tick_count = 0
+        self.car_names = list(load_sprite_data(0))
+        self.maps = {name: HostedMap(name, self.car_names, self.dt, tick_rate // snapshot_rate) for name in map_names}
+        self.sessions = {}  # address -> Session
+        self.next_session_id = 1
+        self.timer = FrameTimer(history=10 * tick_rate)
+        self.sock = None
+        self.address = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def open(self, host="0.0.0.0", port=DEFAULT_HOST_PORT):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+        except OSError as e:
+            print(f"Warning: Could not enlarge the receive buffer: {e}")
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.address = self.sock.getsockname()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+
+    def send(self, session, data):
+        try:
+            self.sock.sendto(data, session.address)
+            session.bytes_sent += len(data)
+        except BlockingIOError:
+            pass  # The send buffer is full, a snapshot that gets lost is replaced by the next one
+        except OSError as e:
+            print(f"Warning: Could not send to race {session.session_id}: {e}")
+
+    def create_car(self, car_index):
+        """(car index, CarPhysics) of a player's pick, the first car when the pick is unknown here."""
+        if 0 <= car_index < len(self.car_names):
+            try:
+                return car_index, create_car(self.car_names[car_index])
+            except OSError as e:
+                print(f"Warning: Can not load car {car_index}, using {self.car_names[0]}: {e}")
+        return 0, create_car(self.car_names[0])
+
+    def reject(self, address, reason):
+        try:
+            self.sock.sendto(netcode.encode_reject(reason), address)
+        except OSError as e:  # BlockingIOError too, the client asks again
+            print(f"Warning: Could not turn away {address[0]}:{address[1]}: {e}")
+
+    def join(self, address, car_index, map_name, now):
+        session = self.sessions.get(address)
+        if session is None:
+            if map_name and map_name not in self.maps:
+                self.reject(address, netcode.REJECT_MAP)
+                return
+            if len(self.sessions) >= self.max_sessions:
+                self.reject(address, netcode.REJECT_FULL)
+                return
+            hosted_map = self.maps[map_name or next(iter(self.maps))]
+            car_index, car = self.create_car(car_index)
+            session = hosted_map.add(self.next_session_id, address, car_index, car, now)
+            self.sessions[address] = session
+            self.next_session_id += 1
+
+        # A repeated JOIN means our WELCOME got lost, it gets the same answer
+        self.send(session, netcode.encode_welcome(
+            0, session.car_index, self.tick_rate, self.snapshot_rate, session.map.spawn_point, session.map.name,
+        ))
+
+    def leave(self, session):
+        del self.sessions[session.address]
+        session.map.remove(session)
+
+    def receive(self):
+        """Reads every waiting packet, called by the event loop whenever the socket has some."""
+        now = time.perf_counter()
+        with self.timer.scope("receive"):
+            while True:
+                try:
+                    data, address = self.sock.recvfrom(netcode.MAX_PACKET)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    continue
+                try:
+                    kind = netcode.packet_type(data)
+                    if kind == netcode.JOIN:
+                        self.join(address, *netcode.decode_join(data), now)
+                        continue
+                    session = self.sessions.get(address)
+                    if session is None:
+                        continue
+                    session.last_heard = now
+                    session.bytes_received += len(data)
+                    if kind == netcode.INPUT:
+                        _, ack_tick, inputs = netcode.decode_input(data)
+                        session.ack_tick = max(session.ack_tick, ack_tick)
+                        session.receive_inputs(inputs)
+                    elif kind == netcode.LEAVE:
+                        self.leave(session)
+                except netcode.ProtocolError:
+                    continue  # Nothing to print for every stray packet of hundreds of races
+
+    def tick(self):
+        """One tick of every race."""
+        with self.timer.scope("tick"):
+            self.tick_count += 1
+            if self.tick_count % self.tick_rate == 0:
+                now = time.perf_counter()
+                for session in [session for session in self.sessions.values() if now - session.last_heard > self.timeout]:
+                    self.leave(session)
+            for hosted_map in self.maps.values():
+                hosted_map.tick(self.tick_count, self.send)
+        self.timer.end_frame()
+
+    def stats(self):
+        """
+        Races per map, the host's time per tick, the share of one core it
+        needs at the tick rate and the fleet step p50 and p99 in ms per map.
+        """
+        tick = self.timer.recent("tick")
+        receive = self.timer.recent("receive")
+        busy = tick.mean() + (receive.mean() if len(receive) else 0.0) if len(tick) else 0.0
+        return {
+            "sessions": len(self),
+            "maps": {name: len(hosted_map) for name, hosted_map in self.maps.items()},
+            "tick_ms": self.timer.percentiles("tick"),
+            "busy_ms": busy * 1000,
+            "load": busy / self.dt,
+            "fleet_ms": {name: hosted_map.fleet_times() for name, hosted_map in self.maps.items()},
+        }
+
+    def session_stats(self):
+        """{session id: (map, ticks stepped, own p50 ms, own p99 ms, down B/s)} of every race, see HostedMap.tick_times."""
+        now = time.perf_counter()
+        stats = {}
+        for session in self.sessions.values():
+            p50, p99 = session.map.tick_times(session)
+            seconds = max(now - session.joined, 1e-9)
+            stats[session.session_id] = (session.map.name, session.ticks, p50, p99, session.bytes_sent / seconds)
+        return stats
+
+    def print_stats(self):
+        stats = self.stats()
+        p50, _, p99 = stats["tick_ms"]
+        maps = ", ".join(f"{name} {count}" for name, count in stats["maps"].items())
+        print(f"{stats['sessions']} races ({maps}): tick p50 {p50:.3f} ms, p99 {p99:.3f} ms, "
+              f"{stats['load']:.0%} of a core")
+        for name, (p50, p99) in stats["fleet_ms"].items():
+            if len(self.maps[name]):
+                print(f"  fleet step of {name}: p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+        # Races on one map share its fleet step, only their own work tells them apart
+        busiest = sorted(self.session_stats().items(), key=lambda item: -item[1][3])[:3]
+        for session_id, (map_name, ticks, p50, p99, down) in busiest:
+            print(f"  race {session_id} on {map_name}: {ticks} ticks, own work p50 {p50 * 1000:.1f} us, "
+                  f"p99 {p99 * 1000:.1f} us, {down / 1000:.2f} kB/s")
+
+    async def run(self, duration=None, report_every=10.0):
+        """Reads packets as they come and ticks at the tick rate, until duration seconds have passed."""
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.sock.fileno(), self.receive)
+        try:
+            start = next_tick = last_report = loop.time()
+            while duration is None or next_tick - start < duration:
+                delay = next_tick - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -0.25:
+                    next_tick = loop.time()  # Fell far behind, drop the ticks instead of racing through them
+                else:
+                    await asyncio.sleep(0)  # Late, but packets still get read between ticks
+                self.tick()
+                next_tick += self.dt
+                if report_every and next_tick - last_report > report_every:
+                    last_report = next_tick
+                    self.print_stats()
+        finally:
+            loop.remove_reader(self.sock.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host time trial races for many players at once")
+    parser.add_argument("--maps", nargs="+", default=list(load_sprite_data(1)), help="maps players may race on")
+    parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_HOST_PORT)
+    parser.add_argument("--tick-rate", type=int, default=60, help="physics ticks per second")
+    parser.add_argument("--snapshot-rate", type=int, default=20, choices=(20, 30, 60), help="snapshots per second to each player")
+    parser.add_argument("--max-sessions", type=int, default=1000, help="races at the same time")
+    args = parser.parse_args()
+
+    try:
+        host = RaceHost(args.maps, args.tick_rate, args.snapshot_rate, args.max_sessions)
+        host.open(args.host, args.port)
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Hosting {', '.join(args.maps)} at {host.address[0]}:{host.address[1]}, "
+          f"{args.tick_rate} ticks and {args.snapshot_rate} snapshots per second")
+
+    if sys.platform == "win32":
+        # The default event loop on Windows can not watch a socket with add_reader
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(host.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
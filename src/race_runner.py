@@ -0,0 +1,218 @@
+"""
+Replays recorded races without a window, as fast as the CPU allows.
+
+Record a race with `python3 src/main.py --record replays/lap.json`, then:
+
+    python3 src/race_runner.py replays/lap.json [more.json ...] [--trajectory out.csv]
+
+Prints the simulated lap times, collisions and steps per second, and checks
+the lap times against the ones stored in the replay.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+from collections import namedtuple
+
+import pyglet
+pyglet.options['shadow_window'] = False  # Decoding the masks needs no GL context
+
+from main_utils import load_sprite_data, extract_mask_pixels
+from car_physics import CarPhysics, REFERENCE_TICK
+from track_mask import TrackMask
+from tree_grid import TreeGrid, place_trees, map_tree_seed, TREE_COUNT
+from map_bundle import MapBundle
+from replay import Replay
+
+RaceResult = namedtuple(
+    "RaceResult", ["lap_times", "finished", "ticks", "collisions", "crashes", "steps_per_second", "trajectory"]
+)
+
+# Lap times are plain float sums, so a replay of the same build matches exactly
+LAP_TIME_TOLERANCE = 1e-6
+
+
+def assets_path():
+    return os.path.join(getattr(sys, '_MEIPASS', os.getcwd()), "Assets")
+
+
+def png_size(path):
+    """Width and height from the PNG header, without decoding the image."""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    return struct.unpack(">II", header[16:24])
+
+
+def load_track_mask(map_name):
+    bundle = MapBundle.open(map_name)
+    if bundle is not None:
+        return bundle.track_mask()
+    scale = load_sprite_data(1)[map_name]["scale"]
+    image = pyglet.image.load(os.path.join(assets_path(), f"{map_name}_map_grayscale.png"))
+    return TrackMask(extract_mask_pixels(image), image.width, image.height, scale)
+
+
+def load_map_trees(map_name, track):
+    """The trees the game puts on a map: the bundled ones, or the ones of its default seed."""
+    bundle = MapBundle.open(map_name)
+    if bundle is not None:
+        return TreeGrid(bundle.tree_positions)
+    return TreeGrid(place_trees(TREE_COUNT, track, map_tree_seed(map_name)))
+
+
+def create_car(car_name):
+    """CarPhysics with the same hitbox the rendered car gets from its sprite."""
+    car_data = load_sprite_data(0)[car_name]
+    sheet_width, sheet_height = png_size(os.path.join(assets_path(), f"{car_name}_texture.png"))
+    sprite_width = sheet_width // 8 * car_data["scale"]
+    sprite_height = sheet_height * car_data["scale"]
+    return CarPhysics(
+        car_data["power"], car_data["friction"],
+        hitbox_width=sprite_width * 0.8,
+        hitbox_height=sprite_height * 0.4,
+    )
+
+
+class HeadlessRace:
+    """
+    One race without rendering, sound or menus.
+    Follows the same rules as game_logic.RaceManager.
+    """
+    def __init__(self, track, trees, car, spawn_point, total_laps, tick_rate):
+        self.track = track
+        self.trees = trees
+        self.car = car
+        self.spawn_point = spawn_point
+        self.total_laps = total_laps
+        self.dt = 1 / tick_rate
+        self.current_lap = 1
+        self.lap_times = []
+        self.time_after_crash = 0
+        self.is_race_finished = False
+        self.collisions = 0
+        self.crashes = 0
+        self.respawn()
+
+    def respawn(self):
+        self.car.x, self.car.y = self.spawn_point
+        self.car.direction = -180
+
+    def step(self, controls):
+        dt = self.dt
+        was_colliding = self.car.collision_frames > 0
+        was_crashed = self.car.crashed
+        self.car.step(dt, controls, self.track, self.trees)
+        self.car.collision_sound_due = False
+        if self.car.collision_frames > 0 and not was_colliding:
+            self.collisions += 1
+        if self.car.crashed and not was_crashed:
+            self.crashes += 1
+
+        if self.car.is_lap_finished:
+            self.current_lap += 1
+            self.lap_times.append(self.car.timer)
+            self.car.timer = 0
+            self.car.is_lap_finished = False
+            if self.current_lap > self.total_laps:
+                self.is_race_finished = True
+
+        self.car.timer += dt
+
+        if self.car.crashed:
+            self.time_after_crash += dt
+            self.car.vel_x *= 0.92 ** (dt / REFERENCE_TICK)
+            self.car.vel_y *= 0.92 ** (dt / REFERENCE_TICK)
+            if self.time_after_crash > 5:
+                self.time_after_crash = 0
+                self.car.crashed = False
+                self.car.drifting = False
+                self.respawn()
+                self.car.timer = 0
+
+    def run(self, controls, keep_trajectory=False):
+        trajectory = [] if keep_trajectory else None
+        ticks = 0
+        start = time.perf_counter()
+        for tick_controls in controls:
+            self.step(tick_controls)
+            ticks += 1
+            if trajectory is not None:
+                trajectory.append((self.car.x, self.car.y, self.car.direction))
+            if self.is_race_finished:
+                break
+        elapsed = time.perf_counter() - start
+
+        return RaceResult(
+            lap_times=list(self.lap_times),
+            finished=self.is_race_finished,
+            ticks=ticks,
+            collisions=self.collisions,
+            crashes=self.crashes,
+            steps_per_second=ticks / elapsed if elapsed > 0 else float("inf"),
+            trajectory=trajectory,
+        )
+
+
+def run_replay(replay, track=None, keep_trajectory=False):
+    """Simulates a replay. Pass track to reuse an already loaded mask of the same map."""
+    map_data = load_sprite_data(1)[replay.map_name]
+    if track is None:
+        track = load_track_mask(replay.map_name)
+
+    trees = TreeGrid(place_trees(TREE_COUNT, track, replay.tree_seed))
+
+    race = HeadlessRace(
+        track, trees, create_car(replay.car_name),
+        map_data["spawn_point"], map_data["total_laps"], replay.tick_rate,
+    )
+    return race.run(replay.controls(), keep_trajectory)
+
+
+def laps_match(replay, result):
+    if len(replay.lap_times) != len(result.lap_times):
+        return False
+    return all(abs(a - b) <= LAP_TIME_TOLERANCE for a, b in zip(replay.lap_times, result.lap_times))
+
+
+def write_trajectory(path, trajectory):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("tick,x,y,direction\n")
+        for tick, (x, y, direction) in enumerate(trajectory):
+            f.write(f"{tick},{x:.3f},{y:.3f},{direction:.3f}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded races headless")
+    parser.add_argument("replays", nargs="+", help="replay files written by main.py --record")
+    parser.add_argument("--trajectory", metavar="PATH", help="write the car path of the first replay as CSV")
+    args = parser.parse_args()
+
+    tracks = {}
+    all_valid = True
+    for i, path in enumerate(args.replays):
+        replay = Replay.load(path)
+        if replay.map_name not in tracks:
+            tracks[replay.map_name] = load_track_mask(replay.map_name)
+
+        keep_trajectory = bool(args.trajectory) and i == 0
+        result = run_replay(replay, tracks[replay.map_name], keep_trajectory)
+
+        laps = ", ".join(f"{t:.2f}" for t in result.lap_times) or "none"
+        print(f"{path}: {replay.map_name} / {replay.car_name} @ {replay.tick_rate} Hz")
+        print(f"  laps: {laps} ({'finished' if result.finished else 'not finished'})")
+        print(f"  collisions: {result.collisions}, crashes: {result.crashes}")
+        print(f"  {result.ticks} ticks, {result.steps_per_second:.0f} steps/sec")
+        if replay.lap_times:
+            valid = laps_match(replay, result)
+            all_valid = all_valid and valid
+            print(f"  recorded laps {'match' if valid else 'DO NOT match'}")
+
+        if keep_trajectory:
+            write_trajectory(args.trajectory, result.trajectory)
+
+    return 0 if all_valid else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import hashlib
+from collections import deque
+import os
+import numpy as np
+from track_mask import SURFACE_ROAD, SURFACE_START, SURFACE_FINISH, SURFACE_CHECKPOINT
+from wall_field import cache_dir
+
+# Bump when the extraction changes so stale cache files are ignored
+LINE_VERSION = 1
+SAMPLE_SPACING = 4  # Mask pixels between polyline samples
+SMOOTHING = 5  # Samples averaged on each side when smoothing the skeleton path
+EDGE_MARGIN = 6  # Mask pixels the racing line keeps from the edges
+MAX_HALF_WIDTH = 256  # Mask pixels searched for the road edge from the centerline
+
+# Neighbours in the order P2..P9 of Zhang-Suen thinning: N, NE, E, SE, S, SW, W, NW
+_NEIGHBOURS = ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1))
+
+
+def drivable_pixels(surfaces):
+    """Road, start, finish and checkpoint pixels, the area a lap can be driven on."""
+    return np.isin(surfaces, (SURFACE_ROAD, SURFACE_START, SURFACE_FINISH, SURFACE_CHECKPOINT))
+
+
+def skeletonize(region):
+    """One pixel wide 8-connected skeleton of a boolean image, by Zhang-Suen thinning."""
+    rows, columns = np.nonzero(region)
+    if not len(rows):
+        return np.zeros_like(region)
+    # Work on the bounding box with a one pixel frame, so neighbours never wrap
+    top, left = rows.min() - 1, columns.min() - 1
+    image = np.zeros((rows.max() - top + 2, columns.max() - left + 2), dtype=np.uint8)
+    image[rows - top, columns - left] = 1
+
+    changed = True
+    while changed:
+        changed = False
+        for first_pass in (True, False):
+            inner = image[1:-1, 1:-1]
+            p = [image[1 + dy:image.shape[0] - 1 + dy, 1 + dx:image.shape[1] - 1 + dx] for dy, dx in _NEIGHBOURS]
+            count = sum(p, np.zeros_like(inner))
+            transitions = sum(((p[i] == 0) & (p[(i + 1) % 8] == 1)).astype(np.uint8) for i in range(8))
+            if first_pass:
+                keep_ends = (p[0] & p[2] & p[4]) | (p[2] & p[4] & p[6])
+            else:
+                keep_ends = (p[0] & p[2] & p[6]) | (p[0] & p[4] & p[6])
+            remove = (inner == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & (keep_ends == 0)
+            if remove.any():
+                inner[remove] = 0
+                changed = True
+
+    skeleton = np.zeros_like(region)
+    rows, columns = np.nonzero(image)
+    skeleton[rows + top, columns + left] = True
+    return skeleton
+
+
+def _shortest_path(neighbours, sources, targets, blocked):
+    """Pixel indices of the shortest 8-connected path from any source to any target, None if there is none."""
+    previous = {source: None for source in sources if source not in blocked}
+    queue = deque(previous)
+    while queue:
+        index = queue.popleft()
+        if index in targets:
+            path = []
+            while index is not None:
+                path.append(index)
+                index = previous[index]
+            return path[::-1]
+        for other in neighbours[index]:
+            if other not in previous and other not in blocked:
+                previous[other] = index
+                queue.append(other)
+    return None
+
+
+def ordered_skeleton(surfaces, skeleton):
+    """
+    The skeleton as one path of (x, y) mask pixels in driving order: start
+    line, checkpoint, finish line and, on a circuit, back to the start line.
+    Returns the points and whether the path is closed. Each stretch may not
+    touch the line it is not heading for, which keeps it from running the
+    lap backwards across the finish next to the start.
+    """
+    ys, xs = np.nonzero(skeleton)
+    index_of = {(x, y): i for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist()))}
+    neighbours = [
+        [index_of[(x + dx, y + dy)] for dy, dx in _NEIGHBOURS if (x + dx, y + dy) in index_of]
+        for x, y in zip(xs.tolist(), ys.tolist())
+    ]
+    on = surfaces[ys, xs]
+    start = set(np.flatnonzero(on == SURFACE_START).tolist())
+    checkpoint = set(np.flatnonzero(on == SURFACE_CHECKPOINT).tolist())
+    finish = set(np.flatnonzero(on == SURFACE_FINISH).tolist())
+    if not start or not checkpoint or not finish:
+        raise ValueError("The track needs start, checkpoint and finish pixels on its drivable area")
+
+    to_checkpoint = _shortest_path(neighbours, start, checkpoint, finish)
+    if to_checkpoint is None:
+        raise ValueError("No path from the start line to the checkpoint")
+    to_finish = _shortest_path(neighbours, [to_checkpoint[-1]], finish, start)
+    if to_finish is None:
+        raise ValueError("No path from the checkpoint to the finish line")
+    # A circuit leads from the finish back to the start without passing the checkpoint
+    to_start = _shortest_path(neighbours, [to_finish[-1]], start, checkpoint)
+
+    path = to_checkpoint + to_finish[1:]
+    closed = to_start is not None
+    if closed:
+        path += to_start[1:-1]
+    return np.column_stack((xs[path], ys[path])).astype(np.float64), closed
+
+
+def arc_length(points, closed):
+    """Distance along a polyline to every point, and its total length including the closing segment of a loop."""
+    steps = np.hypot(*np.diff(points, axis=0).T)
+    distance = np.concatenate(([0.0], np.cumsum(steps)))
+    total = distance[-1] + (np.hypot(*(points[0] - points[-1])) if closed else 0.0)
+    return distance, total
+
+
+def even_stations(total, spacing, closed):
+    """Arc lengths of samples spaced about spacing apart over total, a loop does not repeat its first one."""
+    count = max(int(total / spacing), 2)
+    return np.linspace(0, total, count, endpoint=not closed)
+
+
+def resample(points, spacing, closed):
+    """Points at equal arc length steps along a polyline."""
+    distance, total = arc_length(points, closed)
+    if closed:
+        points = np.vstack((points, points[:1]))
+        distance = np.append(distance, total)
+    at = even_stations(total, spacing, closed)
+    return np.column_stack((np.interp(at, distance, points[:, 0]), np.interp(at, distance, points[:, 1])))
+
+
+def smooth(points, radius, closed):
+    """Moving average over radius samples on each side, the ends of an open path stay put."""
+    window = 2 * radius + 1
+    if closed:
+        padded = np.concatenate((points[-radius:], points, points[:radius]))
+    else:
+        padded = np.concatenate((np.repeat(points[:1], radius, axis=0), points, np.repeat(points[-1:], radius, axis=0)))
+    totals = np.cumsum(np.vstack((np.zeros((1, 2)), padded)), axis=0)
+    return (totals[window:] - totals[:-window]) / window
+
+
+def _neighbours(values, closed, reach=1):
+    """Entries reach samples before and after every sample, open ends repeat themselves."""
+    indices = np.arange(len(values))
+    if closed:
+        return values[(indices - reach) % len(values)], values[(indices + reach) % len(values)]
+    return values[np.maximum(indices - reach, 0)], values[np.minimum(indices + reach, len(values) - 1)]
+
+
+def normals_of(points, closed):
+    """Unit normals pointing left of the driving direction."""
+    before, after = _neighbours(points, closed)
+    tangent = after - before
+    tangent /= np.maximum(np.hypot(tangent[:, 0], tangent[:, 1]), 1e-9)[:, None]
+    return np.column_stack((-tangent[:, 1], tangent[:, 0]))
+
+
+def curvature_of(points, closed, reach=2):
+    """
+    Signed curvature (1 / radius, positive turning left) of the circle
+    through every sample and the ones reach samples before and after it.
+    """
+    before, after = _neighbours(points, closed, reach)
+    a, b = points - before, after - points
+    cross = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    sides = np.hypot(a[:, 0], a[:, 1]) * np.hypot(b[:, 0], b[:, 1]) * np.hypot(*(after - before).T)
+    return 2 * cross / np.maximum(sides, 1e-9)
+
+
+def resampled_curvature(points, closed, spacing=SAMPLE_SPACING):
+    """
+    curvature_of for a polyline with uneven spacing, like a racing line whose
+    samples bunch up on the inside of corners: measured on an evenly
+    resampled copy and read back at the original samples by arc length.
+    """
+    distance, total = arc_length(points, closed)
+    even = resample(points, spacing, closed)
+    return np.interp(distance, even_stations(total, spacing, closed), curvature_of(even, closed))
+
+
+def edge_distances(region, points, normals, max_distance=MAX_HALF_WIDTH):
+    """Distance from every point to the edge of region along its normal, to the left and to the right."""
+    steps = np.arange(0.5, max_distance, 0.5)
+    height, width = region.shape
+    result = []
+    for side in (1, -1):
+        xs = np.floor(points[:, 0, None] + normals[:, 0, None] * steps * side).astype(np.int64)
+        ys = np.floor(points[:, 1, None] + normals[:, 1, None] * steps * side).astype(np.int64)
+        inside = (xs >= 0) & (ys >= 0) & (xs < width) & (ys < height)
+        free = np.zeros(xs.shape, dtype=bool)
+        free[inside] = region[ys[inside], xs[inside]]
+        first = np.where((~free).any(axis=1), (~free).argmax(axis=1), len(steps) - 1)
+        result.append(steps[first])
+    return result[0], result[1]
+
+
+def racing_offsets(center, normals, left, right, closed, margin=EDGE_MARGIN, iterations=2000):
+    """
+    Sideways offset of the racing line from the centerline at every sample.
+    An elastic band: each point moves to the middle of its neighbours, which
+    straightens the line as far as the road allows and cuts the corners,
+    then is held margin inside the edges. The kinks left where the band
+    wraps around the inside of a corner are smoothed out at the end.
+    """
+    low = np.minimum(-right + margin, 0.0)
+    high = np.maximum(left - margin, 0.0)
+    offsets = np.zeros(len(center))
+    for _ in range(iterations):
+        line = center + normals * offsets[:, None]
+        before, after = _neighbours(line, closed)
+        target = (before + after) / 2
+        offsets = np.minimum(np.maximum(((target - center) * normals).sum(axis=1), low), high)
+        if not closed:
+            offsets[[0, -1]] = 0.0
+    offsets = smooth(np.column_stack((offsets, offsets)), SMOOTHING, closed)[:, 0]
+    return np.minimum(np.maximum(offsets, low), high)
+
+
+def extract_line(surfaces):
+    """All RacingLine arrays in mask pixels, the slow part that gets cached."""
+    region = drivable_pixels(surfaces)
+    points, closed = ordered_skeleton(surfaces, skeletonize(region))
+    center = smooth(resample(points, SAMPLE_SPACING, closed), SMOOTHING, closed)
+    normals = normals_of(center, closed)
+    left, right = edge_distances(region, center + 0.5, normals)
+    offsets = racing_offsets(center, normals, left, right, closed)
+    racing = center + normals * offsets[:, None]
+    distance, length = arc_length(center, closed)
+    return {
+        "closed": np.array(closed),
+        "length": np.array(length),
+        "center": center + 0.5,  # Pixel centers
+        "distance": distance,
+        "left_width": left,
+        "right_width": right,
+        "curvature": curvature_of(center, closed),
+        "racing": racing + 0.5,
+        "racing_curvature": resampled_curvature(racing, closed),
+    }
+
+
+def mask_key(surfaces):
+    """Short hash of a classified mask and its shape, names the cache files derived from it."""
+    digest = hashlib.sha1(str(surfaces.shape).encode())
+    digest.update(np.ascontiguousarray(surfaces).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class RacingLine:
+    """
+    The centerline of a track mask from the start line over the checkpoint
+    to the finish, and a racing line inside the road next to it. Both are
+    polylines with one sample every few mask pixels, in world pixels:
+    distance is the arc length along the centerline, length all of it
+    including the closing stretch of a circuit, left_width and
+    right_width the room to each side of it and curvature is 1 / radius,
+    positive in left turns. Computed once per mask and cached on disk.
+    """
+    FIELDS = ("closed", "length", "center", "distance", "left_width", "right_width", "curvature", "racing", "racing_curvature")
+
+    def __init__(self, arrays, scale):
+        self.closed = bool(arrays["closed"])
+        self.length = float(arrays["length"]) * scale
+        self.center = arrays["center"] * scale
+        self.distance = arrays["distance"] * scale
+        self.left_width = arrays["left_width"] * scale
+        self.right_width = arrays["right_width"] * scale
+        self.curvature = arrays["curvature"] / scale
+        self.racing = arrays["racing"] * scale
+        self.racing_curvature = arrays["racing_curvature"] / scale
+
+    def __len__(self):
+        return len(self.center)
+
+    @classmethod
+    def for_mask(cls, surfaces, scale):
+        """Raises ValueError when the mask has no drivable way from start over the checkpoint to the finish."""
+        path = os.path.join(cache_dir(), f"racing_line_v{LINE_VERSION}_{mask_key(surfaces)}.npz")
+
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return cls({name: data[name] for name in cls.FIELDS}, scale)
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Warning: Ignoring broken racing line cache {path}: {e}")
+
+        arrays = extract_line(surfaces)
+        try:
+            os.makedirs(cache_dir(), exist_ok=True)
+            temp_path = path + ".tmp.npz"
+            np.savez(temp_path, **arrays)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache racing line: {e}")
+        return cls(arrays, scale)
@@ -0,0 +1,90 @@
+import json
+import os
+from car_physics import CarControls
+
+# 2: trees are placed from the off-track pixel index, version 1 seeds give other trees
+REPLAY_VERSION = 2
+
+
+def encode_controls(controls):
+    """Packs W/S/A/D into one small int: W=1, S=2, A=4, D=8."""
+    return (
+        bool(controls.accelerate)
+        | bool(controls.brake) << 1
+        | bool(controls.left) << 2
+        | bool(controls.right) << 3
+    )
+
+
+def decode_controls(bits):
+    return CarControls(bool(bits & 1), bool(bits & 2), bool(bits & 4), bool(bits & 8))
+
+
+def decode_fleet_controls(bits):
+    """decode_controls for an int array of bits, one per car of a CarFleet."""
+    return CarControls(bits & 1 > 0, bits & 2 > 0, bits & 4 > 0, bits & 8 > 0)
+
+
+class Replay:
+    """
+    The driver input of one race, one entry per physics tick, together with
+    everything needed to simulate it again (map, car, tick rate, tree seed).
+    Inputs are stored run-length encoded as [ticks, bits] pairs.
+    """
+    def __init__(self, map_name, car_name, tick_rate, tree_seed, inputs=None, lap_times=None):
+        self.map_name = map_name
+        self.car_name = car_name
+        self.tick_rate = tick_rate
+        self.tree_seed = tree_seed
+        self.inputs = inputs if inputs is not None else []
+        self.lap_times = lap_times if lap_times is not None else []
+
+    def record(self, controls):
+        self.inputs.append(encode_controls(controls))
+
+    def controls(self):
+        for bits in self.inputs:
+            yield decode_controls(bits)
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def _runs(self):
+        runs = []
+        for bits in self.inputs:
+            if runs and runs[-1][1] == bits:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, bits])
+        return runs
+
+    def save(self, path):
+        data = {
+            "version": REPLAY_VERSION,
+            "map": self.map_name,
+            "car": self.car_name,
+            "tick_rate": self.tick_rate,
+            "tree_seed": self.tree_seed,
+            "lap_times": self.lap_times,
+            "inputs": self._runs(),
+        }
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay version {data.get('version')} in {path}")
+
+        inputs = []
+        for count, bits in data["inputs"]:
+            inputs.extend([bits] * count)
+        return cls(
+            data["map"], data["car"], data["tick_rate"], data["tree_seed"],
+            inputs=inputs, lap_times=data.get("lap_times", []),
+        )
@@ -0,0 +1,182 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from ast import literal_eval
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    map TEXT NOT NULL,
+    car TEXT NOT NULL,
+    total_time REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS laps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    lap INTEGER NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (run_id, lap)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ghosts (
+    id INTEGER PRIMARY KEY,
+    map TEXT NOT NULL,
+    car TEXT NOT NULL,
+    lap_time REAL NOT NULL,
+    data BLOB NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_map ON runs (map, total_time);
+CREATE INDEX IF NOT EXISTS runs_by_map_car ON runs (map, car, total_time);
+CREATE INDEX IF NOT EXISTS ghosts_by_map ON ghosts (map, lap_time);
+"""
+
+# Scores from before the database have no car
+UNKNOWN_CAR = "unknown"
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=5)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # WAL keeps commits atomic, a power cut may lose the last one
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class ScoreStore:
+    """
+    Every finished race and the recorded laps for ghosts, kept in an SQLite
+    database in WAL mode. Rows are only ever inserted, each in its own transaction, so a crash or a second
+    running game cannot corrupt the table. Writes go through a background
+    thread; queries run on the caller's own connection.
+    """
+    def __init__(self, path="scores.db"):
+        self.path = path
+        self.connection = connect(path)
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="score-writer", daemon=True)
+        self._writer.start()
+
+    def add_run(self, map_name, car_name, total_time, lap_times):
+        """Queues a finished race for writing, returns right away."""
+        self._queue.put((
+            self._insert, (map_name, car_name, float(total_time), [float(t) for t in lap_times], time.time())
+        ))
+
+    def add_ghost(self, map_name, car_name, lap_time, data):
+        """Queues the recording of a lap (ghost.GhostLap.to_bytes()) for writing."""
+        self._queue.put((self._insert_ghost, (map_name, car_name, float(lap_time), data, time.time())))
+
+    def _write_loop(self):
+        connection = connect(self.path)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            insert, args = item
+            try:
+                with connection:
+                    insert(connection, *args)
+            except sqlite3.Error as e:
+                print(f"Warning: Could not save score: {e}")
+            self._queue.task_done()
+        connection.close()
+
+    @staticmethod
+    def _insert(connection, map_name, car_name, total_time, lap_times, finished_at):
+        cursor = connection.execute(
+            "INSERT INTO runs (map, car, total_time, finished_at) VALUES (?, ?, ?, ?)",
+            (map_name, car_name, total_time, finished_at),
+        )
+        connection.executemany(
+            "INSERT INTO laps (run_id, lap, time) VALUES (?, ?, ?)",
+            [(cursor.lastrowid, lap, lap_time) for lap, lap_time in enumerate(lap_times, 1)],
+        )
+
+    @staticmethod
+    def _insert_ghost(connection, map_name, car_name, lap_time, data, recorded_at):
+        connection.execute(
+            "INSERT INTO ghosts (map, car, lap_time, data, recorded_at) VALUES (?, ?, ?, ?, ?)",
+            (map_name, car_name, lap_time, data, recorded_at),
+        )
+
+    def flush(self):
+        """Blocks until every queued run is written."""
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self.connection.close()
+
+    def top_runs(self, map_name, n=10, car_name=None):
+        """The n fastest runs of a map as (total_time, car, lap_times) tuples, fastest first."""
+        if car_name is None:
+            rows = self.connection.execute(
+                "SELECT id, total_time, car FROM runs WHERE map = ? ORDER BY total_time LIMIT ?",
+                (map_name, n),
+            ).fetchall()
+        else:
+            rows = self.connection.execute(
+                "SELECT id, total_time, car FROM runs WHERE map = ? AND car = ? ORDER BY total_time LIMIT ?",
+                (map_name, car_name, n),
+            ).fetchall()
+        return [(total_time, car, self._lap_times(run_id)) for run_id, total_time, car in rows]
+
+    def best_run(self, map_name, car_name=None):
+        """The fastest (total_time, car, lap_times) of a map, None if it was never finished."""
+        runs = self.top_runs(map_name, 1, car_name)
+        return runs[0] if runs else None
+
+    def best_lap(self, map_name, car_name=None):
+        """The fastest single lap driven on a map, None if there is none."""
+        query = "SELECT MIN(laps.time) FROM laps JOIN runs ON runs.id = laps.run_id WHERE runs.map = ?"
+        args = (map_name,)
+        if car_name is not None:
+            query += " AND runs.car = ?"
+            args += (car_name,)
+        return self.connection.execute(query, args).fetchone()[0]
+
+    def best_ghost(self, map_name):
+        """(car, lap_time, data) of the fastest recorded lap on a map, None if there is none."""
+        return self.connection.execute(
+            "SELECT car, lap_time, data FROM ghosts WHERE map = ? ORDER BY lap_time LIMIT 1", (map_name,)
+        ).fetchone()
+
+    def _lap_times(self, run_id):
+        rows = self.connection.execute("SELECT time FROM laps WHERE run_id = ? ORDER BY lap", (run_id,))
+        return [lap_time for (lap_time,) in rows]
+
+    def migrate_score_file(self, path, map_names):
+        """
+        Imports the best times of the old score.txt once. It held one
+        [total_time, lap_time, ...] list per map index, or [] for none.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                old_scores = literal_eval(f.read() or "[]")
+        except (OSError, ValueError, SyntaxError) as e:
+            print(f"Warning: Could not read {path}, its scores are not imported: {e}")
+            old_scores = []
+
+        with self.connection:
+            # Takes the write lock first, so a second game starting at the same time waits here
+            self.connection.execute("BEGIN IMMEDIATE")
+            if self.connection.execute("SELECT 1 FROM meta WHERE key = 'score_txt_migrated'").fetchone():
+                return 0
+
+            imported = 0
+            for map_name, entry in zip(map_names, old_scores):
+                if entry:
+                    self._insert(self.connection, map_name, UNKNOWN_CAR, entry[0], entry[1:], os.path.getmtime(path))
+                    imported += 1
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('score_txt_migrated', ?)", (str(time.time()),))
+        return imported
@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+# Everything that changes during a race, taken after `tick` physics ticks.
+# car is a car_physics.PhysicsState, race a game_logic.RaceState,
+# camera the (x, y) world offset, opponents an opponents.OpponentsState and
+# progress a progress_field.RaceProgress snapshot, None when the race has
+# no AI cars or no progress tracking.
+RaceSnapshot = namedtuple(
+    "RaceSnapshot", ["tick", "car", "race", "camera", "opponents", "progress"], defaults=(None, None)
+)
+
+
+class SnapshotRing:
+    """
+    The snapshots of the last `capacity` ticks, looked up by tick number.
+    Older ones are overwritten, nothing is allocated after the start.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.items = [None] * capacity
+        self.newest_tick = -1
+
+    def push(self, snapshot):
+        self.items[snapshot.tick % self.capacity] = snapshot
+        self.newest_tick = snapshot.tick
+
+    def at(self, tick):
+        """The snapshot taken after `tick` ticks, None if it was overwritten or not taken yet."""
+        if tick > self.newest_tick or tick <= self.newest_tick - self.capacity:
+            return None
+        snapshot = self.items[tick % self.capacity]
+        if snapshot is None or snapshot.tick != tick:
+            return None
+        return snapshot
+
+    def rewind(self, tick):
+        """Forgets the snapshots after tick, the race continues from there."""
+        self.newest_tick = min(self.newest_tick, tick)
+
+    def clear(self):
+        self.items = [None] * self.capacity
+        self.newest_tick = -1
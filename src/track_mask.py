@@ -0,0 +1,88 @@
+import math
+import numpy as np
+from wall_field import WallField
+
+
+# Surface classes stored in TrackMask.surfaces, one per mask pixel
+SURFACE_ROAD = 0
+SURFACE_START = 1
+SURFACE_FINISH = 2
+SURFACE_WALL = 3
+SURFACE_SOFT_WALL = 4  # Wall unless the car also touches the finish line
+SURFACE_CHECKPOINT = 5
+SURFACE_OFF_TRACK = 6
+
+
+class TrackMask:
+    """
+    The grayscale track mask as plain arrays, queried in world pixels.
+    Needs no window, so the physics can run headless.
+    """
+    # Grayscale value -> surface class, anything unmarked is off track
+    surface_lut = np.full(256, SURFACE_OFF_TRACK, dtype=np.uint8)
+    surface_lut[255] = SURFACE_ROAD
+    surface_lut[210] = SURFACE_START
+    surface_lut[220] = SURFACE_FINISH
+    surface_lut[200] = SURFACE_WALL
+    surface_lut[27] = SURFACE_SOFT_WALL
+    surface_lut[230] = SURFACE_CHECKPOINT
+
+    # Surface class -> old is_on_track result
+    _legacy_results = (True, 1, 2, 3, 4, 5, False)
+
+    def __init__(self, pixels, width, height, scale, surfaces=None, wall_field=None):
+        """
+        pixels are the mask bytes, one gray value per pixel, bottom row first.
+        surfaces and wall_field are derived from them unless passed in, as a
+        map bundle does.
+        """
+        self.mask_width = width
+        self.mask_height = height
+        self.scale = scale
+        self.pixels = pixels
+        if surfaces is None:
+            surfaces = TrackMask.surface_lut[np.frombuffer(pixels, dtype=np.uint8)].reshape(height, width)
+        self.surfaces = surfaces
+        if wall_field is None:
+            wall_field = WallField.for_mask(
+                (self.surfaces == SURFACE_WALL) | (self.surfaces == SURFACE_OFF_TRACK)
+            )
+        self.wall_field = wall_field
+        self._off_track_pixels = None
+
+    def classify_points(self, xs, ys):
+        """Returns the surface class under each world point as a uint8 array."""
+        px, py = self._to_mask_pixels(xs, ys)
+
+        inside = (px >= 0) & (py >= 0) & (px < self.mask_width) & (py < self.mask_height)
+        classes = np.full(px.shape, SURFACE_OFF_TRACK, dtype=np.uint8)
+        classes[inside] = self.surfaces[py[inside], px[inside]]
+        return classes
+
+    def off_track_pixels(self):
+        """Flat indices of all off-track mask pixels, found on first use."""
+        if self._off_track_pixels is None:
+            self._off_track_pixels = np.flatnonzero(self.surfaces.ravel() == SURFACE_OFF_TRACK)
+        return self._off_track_pixels
+
+    def _to_mask_pixels(self, xs, ys):
+        px = np.floor(np.asarray(xs, dtype=np.float64) / self.scale).astype(np.int64)
+        py = np.floor(np.asarray(ys, dtype=np.float64) / self.scale).astype(np.int64)
+        return px, py
+
+    def wall_distance(self, xs, ys):
+        """
+        Signed distance in world pixels from each point to the nearest wall edge
+        (negative inside walls) and the wall normal (nx, ny) at that point.
+        """
+        px, py = self._to_mask_pixels(xs, ys)
+        distance, normal_x, normal_y = self.wall_field.sample(px, py)
+        return distance * self.scale, normal_x, normal_y
+
+    def is_on_track(self, world_x, world_y):
+        """One point without arrays: True on the road, the surface class on a marking, False off the mask."""
+        x = math.floor(world_x / self.scale)
+        y = math.floor(world_y / self.scale)
+        if x < 0 or y < 0 or x >= self.mask_width or y >= self.mask_height:
+            return False
+        return TrackMask._legacy_results[self.surfaces[y, x]]
@@ -0,0 +1,171 @@
+import math
+import zlib
+import numpy as np
+
+# Trees placed on every map
+TREE_COUNT = 1000
+
+# Bump when place_trees picks different positions for the same seed
+PLACEMENT_VERSION = 2
+
+
+def map_tree_seed(map_name):
+    """The tree seed of a map, so it gets the same forest every race."""
+    return zlib.crc32(map_name.encode())
+
+
+def place_trees(amount, track, seed=None):
+    """
+    Picks amount off-track positions in one pass: random mask pixels from
+    the track's off-track pixel index, each moved to a random world pixel
+    inside it. The same seed gives the same trees.
+    """
+    index = track.off_track_pixels()
+    if not len(index):
+        return np.empty((0, 2), dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    picks = index[rng.integers(0, len(index), size=amount)]
+    offsets = rng.integers(0, track.scale, size=(amount, 2))
+    ys, xs = np.divmod(picks, track.mask_width)
+    return np.stack([xs * track.scale + offsets[:, 0], ys * track.scale + offsets[:, 1]], axis=1)
+
+
+def _cell_key(cx, cy):
+    """One sortable int64 per cell, ordered like the cells' (cx, cy) tuples."""
+    return cx * (1 << 32) + (cy + (1 << 31))
+
+
+class TreeGrid:
+    """
+    Tree positions sorted into a uniform grid of cells.
+    Collision queries only look at the cells around the query point.
+    """
+    def __init__(self, positions, tree_scale=7, cell_size=1024):
+        self.tree_scale = tree_scale
+        self.cell_size = cell_size
+
+        # Trunk circle used for collisions, in world pixels
+        self.trunk_radius = 3 * tree_scale
+        self.trunk_offset_y = 5 * tree_scale
+
+        self.cells = {}
+        self._reach_maps = {}
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 2)
+
+        # The same cells as flat arrays for pairs_near: positions sorted by
+        # cell, and the key and range of every non-empty cell
+        self.positions = positions
+        self.cell_keys = np.empty(0, dtype=np.int64)
+        self.cell_starts = np.empty(0, dtype=np.int64)
+        self.cell_ends = np.empty(0, dtype=np.int64)
+        if not len(positions):
+            return
+
+        cell_coords = np.floor(positions / cell_size).astype(np.int64)
+        order = np.lexsort((cell_coords[:, 1], cell_coords[:, 0]))
+        positions, cell_coords = positions[order], cell_coords[order]
+        boundaries = np.flatnonzero(np.any(np.diff(cell_coords, axis=0), axis=1)) + 1
+
+        for chunk, chunk_cells in zip(np.split(positions, boundaries), np.split(cell_coords, boundaries)):
+            self.cells[(int(chunk_cells[0, 0]), int(chunk_cells[0, 1]))] = chunk
+
+        self.positions = positions
+        self.cell_starts = np.concatenate(([0], boundaries))
+        self.cell_ends = np.concatenate((boundaries, [len(positions)]))
+        self.cell_keys = _cell_key(cell_coords[self.cell_starts, 0], cell_coords[self.cell_starts, 1])
+
+    def cell_range(self, left, bottom, right, top):
+        size = self.cell_size
+        return (
+            math.floor(left / size), math.floor(bottom / size),
+            math.floor(right / size), math.floor(top / size),
+        )
+
+    def trees_near(self, x, y, r):
+        """Returns an (n, 2) array of trunk centers within r world pixels of (x, y)."""
+        base_y = y - self.trunk_offset_y
+        min_cx, min_cy, max_cx, max_cy = self.cell_range(x - r, base_y - r, x + r, base_y + r)
+
+        found = []
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                chunk = self.cells.get((cx, cy))
+                if chunk is None:
+                    continue
+                dx = chunk[:, 0] - x
+                dy = chunk[:, 1] - base_y
+                found.append(chunk[dx * dx + dy * dy <= r * r])
+
+        if not found:
+            return np.empty((0, 2), dtype=np.float32)
+        trunks = np.concatenate(found)
+        trunks[:, 1] += self.trunk_offset_y
+        return trunks
+
+    def maybe_near(self, xs, ys, r, block=64):
+        """
+        Broad phase for pairs_near: False for points that have no trunk
+        within r, so most cars skip the exact query. The coarse map of
+        blocks within r of a trunk is built once per r.
+        """
+        key = (r, block)
+        if key not in self._reach_maps:
+            self._reach_maps[key] = self._reach_map(r, block)
+        reach_map = self._reach_maps[key]
+        height, width = reach_map.shape
+        bx = np.minimum(np.maximum(np.asarray(xs) // block, 0), width - 1).astype(np.int64)
+        by = np.minimum(np.maximum((np.asarray(ys) - self.trunk_offset_y) // block, 0), height - 1).astype(np.int64)
+        return reach_map[by, bx]
+
+    def _reach_map(self, r, block):
+        """Blocks with a trunk base within r of some point in them. Points outside clip onto the edge blocks."""
+        if not len(self.positions):
+            return np.zeros((1, 1), dtype=bool)
+        spread = int(math.ceil(r / block)) + 1
+        blocks = np.floor(self.positions / block).astype(np.int64) + spread
+        reach_map = np.zeros((int(blocks[:, 1].max()) + spread + 1, int(blocks[:, 0].max()) + spread + 1), dtype=bool)
+        for dy in range(-spread, spread + 1):
+            for dx in range(-spread, spread + 1):
+                reach_map[blocks[:, 1] + dy, blocks[:, 0] + dx] = True
+        return reach_map[spread:, spread:]
+
+    def pairs_near(self, xs, ys, rs):
+        """
+        trees_near for many points at once. Returns (point index, trunk x,
+        trunk y) arrays, grouped by point and in the order trees_near
+        returns them. Every radius must be smaller than cell_size.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        if not len(self.cell_keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+        base_ys = np.asarray(ys, dtype=np.float64) - self.trunk_offset_y
+        rs = np.broadcast_to(np.asarray(rs, dtype=np.float64), xs.shape)
+        size = self.cell_size
+        min_cx, max_cx = np.floor((xs - rs) / size), np.floor((xs + rs) / size)
+        min_cy, max_cy = np.floor((base_ys - rs) / size), np.floor((base_ys + rs) / size)
+
+        # The at most 2x2 cells around each point, in the nested loop order of trees_near
+        cxs = np.stack([min_cx, min_cx, max_cx, max_cx], axis=1).astype(np.int64)
+        cys = np.stack([min_cy, max_cy, min_cy, max_cy], axis=1).astype(np.int64)
+        new_x, new_y = max_cx != min_cx, max_cy != min_cy
+        wanted = np.stack([np.ones_like(new_x), new_y, new_x, new_x & new_y], axis=1)
+
+        keys = _cell_key(cxs, cys).ravel()
+        slots = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = wanted.ravel() & (self.cell_keys[slots] == keys)
+        counts = np.where(found, self.cell_ends[slots] - self.cell_starts[slots], 0)
+
+        # Expand every found cell into one row per tree in it
+        total = int(counts.sum())
+        points = np.repeat(np.repeat(np.arange(len(xs)), 4), counts)
+        firsts = np.repeat(np.cumsum(counts) - counts, counts)
+        trees = np.repeat(self.cell_starts[slots], counts) + (np.arange(total) - firsts)
+
+        # Same float32 distance test as trees_near
+        trunks = self.positions[trees]
+        dx = trunks[:, 0] - xs[points].astype(np.float32)
+        dy = trunks[:, 1] - base_ys[points].astype(np.float32)
+        near = dx * dx + dy * dy <= (rs * rs)[points].astype(np.float32)
+        trunks = trunks[near]
+        return points[near], trunks[:, 0], trunks[:, 1] + np.float32(self.trunk_offset_y)
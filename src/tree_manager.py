@@ -1,9 +1,30 @@
-import random
-from objects import Tree
+from objects import TreeLayer
+from tree_grid import TreeGrid, place_trees
 import pyglet
 
 
+class TreeCellGroup(pyglet.graphics.Group):
+    """Trees of one grid cell. Hidden while the cell is off screen."""
+    def __init__(self, cell, parent=None):
+        super().__init__(parent=parent)
+        self.cell = cell
+        self._visible = False
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and
+                self.cell == other.cell and
+                self.parent == other.parent)
+
+    def __hash__(self):
+        return hash((self.cell, self.parent))
+
+
 class TreeManager:
+    """
+    Places trees off the track and draws them per grid cell.
+    Only cells that overlap the viewport are drawn; the TreeGrid in
+    self.grid answers the collision queries.
+    """
     def __init__(
         self,
         image,
@@ -12,60 +33,84 @@ class TreeManager:
         world_width=1000,
         world_height=1000,
         batch=None,
+        group=None,
     ):
-        self.trees = []
+        self.positions = []
         self.window = window
         self.image = image
         self.scale = scale
         self.world_width = world_width
         self.world_height = world_height
         self.batch = batch
-        self.group = pyglet.graphics.Group(6)
-
-
-        self.update_radius = 500
-        self.last_car_pos = (0, 0)
-        self.position_threshold = (
-            50 
-        )
-
-    def generate_trees(self, amount, track):
-        attempts = 0
-        max_attempts = amount * 10 
+        self.group = group if group is not None else pyglet.graphics.Group(7)
+        self.tree_scale = 7
+        self.grid = TreeGrid([], tree_scale=self.tree_scale)
+        self.layers = {}
+        self.cell_groups = {}
+        self.visible_cells = set()
+        self._visible_range = None
 
-        for _ in range(amount):
-            if attempts > max_attempts:
-                break
+    def generate_trees(self, amount, track, seed=None):
+        self.set_positions(place_trees(amount, track, seed))
 
-            x, y = None, None
-            while attempts < max_attempts:
-                x = random.randint(0, self.world_width)
-                y = random.randint(0, self.world_height)
-                attempts += 1
+    def set_positions(self, positions):
+        """Uses already placed trees, like the ones the map preloader made."""
+        self.positions = positions.tolist()
+        self._build_grid()
 
-                if not track.is_on_track(x, y):
-                    break
+    def _build_grid(self):
+        """Sorts trees into grid cells and builds one vertex list per cell."""
+        for layer in self.layers.values():
+            layer.delete()
+        self.grid = TreeGrid(self.positions, tree_scale=self.tree_scale)
+        self.layers = {}
+        self.cell_groups = {}
+        self.visible_cells = set()
+        self._visible_range = None
 
-            # Create tree at world position, scaled to match track
-            tree = Tree(
+        for cell, chunk in self.grid.cells.items():
+            self.cell_groups[cell] = TreeCellGroup(cell, parent=self.group)
+            # Trees in the same cell share a vertex list, scaled to match track
+            self.layers[cell] = TreeLayer(
                 self.image,
-                self.window,
-                x=x,
-                y=y,
-                scale=7,
+                chunk,
+                scale=self.tree_scale,
                 batch=self.batch,
-                group=self.group,
+                group=self.cell_groups[cell],
             )
-            self.trees.append(tree)
 
-    def update(self, dx, dy, wdim):
-        if dx != 0 or dy != 0:
-            for tree in self.trees:
-                tree.update(dx, dy)
-               
+    def update(self, camera):
+        """Shows the cells overlapping the viewport and hides the rest."""
+        tree_width = self.image.width * self.tree_scale
+        tree_height = self.image.height * self.tree_scale
+
+        # Trees are anchored at the bottom center, so they reach up and sideways out of their cell
+        visible_range = self.grid.cell_range(
+            camera.x - tree_width / 2,
+            camera.y - tree_height,
+            camera.x + self.window.width + tree_width / 2,
+            camera.y + self.window.height,
+        )
+        if visible_range == self._visible_range:
+            return
+        self._visible_range = visible_range
+
+        min_cx, min_cy, max_cx, max_cy = visible_range
+        visible_cells = {
+            (cx, cy)
+            for cx in range(min_cx, max_cx + 1)
+            for cy in range(min_cy, max_cy + 1)
+            if (cx, cy) in self.layers
+        }
+
+        for cell in self.visible_cells - visible_cells:
+            self.cell_groups[cell].visible = False
+        for cell in visible_cells - self.visible_cells:
+            self.cell_groups[cell].visible = True
+        self.visible_cells = visible_cells
 
-   
-        
+    def trees_near(self, x, y, r):
+        return self.grid.trees_near(x, y, r)
 
     def get_all(self):
-        return self.trees
+        return self.positions
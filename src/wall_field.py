@@ -0,0 +1,99 @@
+import hashlib
+import os
+import numpy as np
+
+# Bump when the field layout or math changes so stale cache files are ignored
+FIELD_VERSION = 1
+MAX_DISTANCE = 32  # In mask pixels, distances further than this are clamped
+
+
+def cache_dir():
+    return os.path.join(os.getcwd(), "cache")
+
+
+def _distance_to(targets, max_distance):
+    """Euclidean distance from every pixel to the nearest True pixel of targets, clamped to max_distance."""
+    height, width = targets.shape
+    far = np.float32(max_distance + 1)
+
+    # Vertical distance to the nearest target in the same column, swept down and up
+    vertical = np.empty((height, width), dtype=np.float32)
+    run = np.full(width, far, dtype=np.float32)
+    for y in range(height):
+        run = np.where(targets[y], 0, np.minimum(run + 1, far))
+        vertical[y] = run
+    run = np.full(width, far, dtype=np.float32)
+    for y in range(height - 1, -1, -1):
+        run = np.where(targets[y], 0, np.minimum(run + 1, far))
+        np.minimum(vertical[y], run, out=vertical[y])
+
+    # Combine columns: anything closer than max_distance is at most that many columns away
+    column_sq = vertical * vertical
+    distance_sq = column_sq.copy()
+    for dx in range(1, max_distance + 1):
+        offset = np.float32(dx * dx)
+        np.minimum(distance_sq[:, dx:], column_sq[:, :-dx] + offset, out=distance_sq[:, dx:])
+        np.minimum(distance_sq[:, :-dx], column_sq[:, dx:] + offset, out=distance_sq[:, :-dx])
+
+    return np.minimum(np.sqrt(distance_sq), max_distance)
+
+
+def compute_wall_field(blocked, max_distance=MAX_DISTANCE):
+    """
+    Builds the signed distance to the nearest wall edge (positive on drivable
+    pixels, negative inside walls) and the unit normal pointing out of the wall.
+    """
+    inside = _distance_to(blocked, max_distance)
+    outside = _distance_to(~blocked, max_distance)
+    distance = np.where(blocked, 0.5 - outside, inside - 0.5).astype(np.float32)
+
+    grad_y, grad_x = np.gradient(distance)
+    length = np.hypot(grad_x, grad_y)
+    length[length == 0] = 1
+    normals = np.empty(distance.shape + (2,), dtype=np.int8)
+    normals[..., 0] = np.round(grad_x / length * 127)
+    normals[..., 1] = np.round(grad_y / length * 127)
+    return distance.astype(np.float16), normals
+
+
+class WallField:
+    """
+    Signed distance to the walls and wall normals for one track mask,
+    sampled in mask pixels. Computed once per mask and cached on disk.
+    """
+    def __init__(self, distance, normals):
+        self.distance = distance
+        self.normals = normals
+        self.height, self.width = distance.shape
+
+    @classmethod
+    def for_mask(cls, blocked):
+        # The shape is hashed too, packed bits alone are the same for a mask of other proportions
+        digest = hashlib.sha1(str(blocked.shape).encode())
+        digest.update(np.packbits(blocked).tobytes())
+        key = digest.hexdigest()[:16]
+        path = os.path.join(cache_dir(), f"wall_field_v{FIELD_VERSION}_{key}.npz")
+
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    return cls(data["distance"], data["normals"])
+            except (OSError, KeyError, ValueError) as e:
+                print(f"Warning: Ignoring broken wall field cache {path}: {e}")
+
+        distance, normals = compute_wall_field(blocked)
+        try:
+            os.makedirs(cache_dir(), exist_ok=True)
+            temp_path = path + ".tmp.npz"
+            np.savez(temp_path, distance=distance, normals=normals)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache wall field: {e}")
+        return cls(distance, normals)
+
+    def sample(self, px, py):
+        """Signed distance and normal (nx, ny) at integer mask pixels, clamped to the mask edges."""
+        px = np.clip(px, 0, self.width - 1)
+        py = np.clip(py, 0, self.height - 1)
+        normals = self.normals[py, px].astype(np.float32) / 127
+        return self.distance[py, px].astype(np.float32), normals[..., 0], normals[..., 1]
@@ -0,0 +1,119 @@
+"""
+Shared setup of the tests: src/ on the import path, pyglet without a
+display or sound, and the repository root as the working directory, where
+the game finds Assets/.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import pyglet
+
+pyglet.options["headless"] = True
+pyglet.options["audio"] = ("silent",)
+
+import numpy as np
+import pytest
+from pyglet.window import key
+
+import main
+from ai_driver import RayDriver
+from car_fleet import CarFleet
+from car_physics import CarControls
+from score_store import ScoreStore
+from track_mask import SURFACE_ROAD, SURFACE_START, SURFACE_FINISH, SURFACE_CHECKPOINT, SURFACE_OFF_TRACK
+import racing_line
+import progress_field
+
+os.chdir(ROOT)
+
+
+class Driver:
+    """Drives a headless main.Game tick by tick, without its window loop."""
+    def __init__(self, game):
+        self.game = game
+        self.fleet = CarFleet([game.car.physics])
+        self.ray_driver = RayDriver(self.fleet)
+
+    def press(self, controls):
+        """Holds exactly the keys of a CarControls."""
+        for pressed, symbol in zip(controls, (key.W, key.S, key.A, key.D)):
+            self.game.keys.data[symbol] = bool(pressed)
+
+    def autopilot(self):
+        """The controls the AI driver picks for the player's car right now."""
+        self.fleet.set_car(0, self.game.car.physics)
+        controls = self.ray_driver.controls(self.game.world.track, self.game.tick_dt)
+        return CarControls(*(bool(keys[0]) for keys in controls))
+
+    def tick(self, controls):
+        """One fixed physics tick with controls held, like game_update runs them."""
+        self.press(controls)
+        self.game.world.camera.begin_tick()
+        self.game.simulation_step(self.game.tick_dt)
+
+
+@pytest.fixture
+def start_race(tmp_path, monkeypatch):
+    """
+    start_race(map_index, **Game options) starts a race with the first car
+    in a headless main.Game and returns its Driver. Scores go to tmp_path.
+    """
+    monkeypatch.setattr(main, "ScoreStore", lambda: ScoreStore(str(tmp_path / "scores.db")))
+    games = []
+
+    def start(map_index, **options):
+        game = main.Game(**options)
+        games.append(game)
+        game.main_menu.on_map_pick(map_index)
+        while not game.is_map_ready(map_index):
+            time.sleep(0.01)
+        game.main_menu.on_car_pick(0)
+        return Driver(game)
+
+    yield start
+    for game in games:
+        if game.lan_race is not None:
+            game.lan_race.close()
+        game.scores.close()
+        game.window.close()
+
+
+def ring_surfaces():
+    """
+    Surface classes of a 120 x 120 mask with a square ring road, 20 pixels
+    wide, driven counterclockwise: the start line at x 60 on the bottom
+    stretch, the checkpoint on the top stretch and the finish line at x 40
+    on the way back to the start.
+    """
+    surfaces = np.full((120, 120), SURFACE_OFF_TRACK, dtype=np.uint8)
+    surfaces[10:110, 10:110] = SURFACE_ROAD
+    surfaces[30:90, 30:90] = SURFACE_OFF_TRACK
+    surfaces[10:30, 60:62] = SURFACE_START
+    surfaces[90:110, 60:62] = SURFACE_CHECKPOINT
+    surfaces[10:30, 40:42] = SURFACE_FINISH
+    return surfaces
+
+
+def strip_surfaces():
+    """A straight road 100 x 20 pixels with the start, the checkpoint and the finish one after another, no circuit."""
+    surfaces = np.full((40, 120), SURFACE_OFF_TRACK, dtype=np.uint8)
+    surfaces[10:30, 10:110] = SURFACE_ROAD
+    surfaces[10:30, 30:32] = SURFACE_START
+    surfaces[10:30, 60:62] = SURFACE_CHECKPOINT
+    surfaces[10:30, 88:90] = SURFACE_FINISH
+    return surfaces
+
+
+@pytest.fixture
+def line_cache(tmp_path, monkeypatch):
+    """Racing lines and progress fields are cached in tmp_path instead of cache/. Returns the directory."""
+    monkeypatch.setattr(racing_line, "cache_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(progress_field, "cache_dir", lambda: str(tmp_path))
+    return tmp_path
@@ -0,0 +1,54 @@
+import numpy as np
+
+from car_physics import CarControls, STATE_FIELDS
+from car_fleet import CarFleet
+from main_utils import load_sprite_data
+from race_runner import load_track_mask, load_map_trees, create_car
+
+MAP_NAME = "track"
+CAR_COUNT = 12
+TICKS = 1500
+DT = 1 / 60
+TOLERANCE = 1e-6  # World pixels and degrees, the two differ only in float rounding
+
+
+def place_cars(spawn_point):
+    cars = [create_car("car" if i % 2 else "blue_car") for i in range(CAR_COUNT)]
+    for i, car in enumerate(cars):
+        car.x = spawn_point[0] + i % 4 * 30
+        car.y = spawn_point[1] + i // 4 * 20
+        car.direction = -180
+    return cars
+
+
+def test_fleet_matches_car_physics():
+    """One CarFleet drives exactly like one CarPhysics per car, through walls, trees and laps."""
+    track = load_track_mask(MAP_NAME)
+    trees = load_map_trees(MAP_NAME, track)
+    spawn_point = load_sprite_data(1)[MAP_NAME]["spawn_point"]
+    cars = place_cars(spawn_point)
+    fleet = CarFleet(place_cars(spawn_point))
+
+    # Every car holds random keys for a while, mostly the throttle
+    rng = np.random.default_rng(0)
+    held = np.zeros((4, CAR_COUNT), dtype=bool)
+    held[0] = True
+    collisions = 0
+    for _ in range(TICKS):
+        change = rng.random(CAR_COUNT) < 0.03
+        held[:, change] = rng.random((4, int(change.sum()))) < np.array([[0.85], [0.1], [0.3], [0.3]])
+        for i, car in enumerate(cars):
+            car.step(DT, CarControls(*(bool(keys[i]) for keys in held)), track, trees)
+            collisions += car.collision_frames > 0
+        fleet.step(DT, CarControls(*held.copy()), track, trees)
+
+    assert collisions > 0
+    for i, car in enumerate(cars):
+        expected = car.snapshot()
+        actual = fleet.state_of(i)
+        for name in STATE_FIELDS:
+            value, fleet_value = getattr(expected, name), getattr(actual, name)
+            if isinstance(value, float):
+                assert abs(fleet_value - value) <= TOLERANCE, (i, name)
+            else:
+                assert fleet_value == value, (i, name)
@@ -0,0 +1,93 @@
+import pytest
+
+from ghost import GhostLap, GhostRecorder, LapDelta
+
+TICK_RATE = 60
+
+
+def record(states, tick_rate=TICK_RATE):
+    """A lap recorded from (x, y, direction) states, one per tick, None if the recorder dropped it."""
+    recorder = GhostRecorder(tick_rate, max_lap_seconds=60)
+    recorder.start_lap()
+    for x, y, direction in states:
+        recorder.record(x, y, direction)
+    return recorder.finish_lap(len(states) / tick_rate)
+
+
+def straight(ticks, speed=3.0):
+    """Driving to the right along y = 100 at speed world pixels per tick."""
+    return [(100.0 + speed * k, 100.0, 0.0) for k in range(ticks)]
+
+
+def test_lap_survives_bytes():
+    lap = record([(100.0 + 2.5 * k, 200.0 - 1.25 * k, (10.0 * k) % 360) for k in range(300)])
+    loaded = GhostLap.from_bytes(lap.to_bytes())
+    assert (loaded.tick_rate, loaded.lap_time, loaded.start, len(loaded)) == (lap.tick_rate, lap.lap_time, lap.start, len(lap))
+    assert (loaded.xs == lap.xs).all() and (loaded.ys == lap.ys).all() and (loaded.directions == lap.directions).all()
+    assert loaded.state_at(2.0) == lap.state_at(2.0)
+    assert lap.state_at(3.0) == pytest.approx((100.0 + 2.5 * 179, 200.0 - 1.25 * 179, (10.0 * 179) % 360))
+
+
+def test_broken_bytes_raise_value_error():
+    data = record(straight(10)).to_bytes()
+    with pytest.raises(ValueError):
+        GhostLap.from_bytes(data[:10])
+    with pytest.raises(ValueError):
+        GhostLap.from_bytes(b"XXXX" + data[4:])
+
+
+def test_direction_turns_the_short_way_across_north():
+    lap = record([(0.0, 0.0, 358.0), (0.0, 0.0, 359.5), (0.0, 0.0, 0.5), (0.0, 0.0, 2.0)])
+    # Halfway between 359.5 and 0.5 degrees, ticks 1 and 2 were recorded at 2 / 60 and 3 / 60 seconds
+    direction = lap.state_at(2.5 / TICK_RATE)[2]
+    assert min(direction, 360 - direction) == pytest.approx(0.0, abs=1e-9)
+    assert lap.state_at(2.25 / TICK_RATE)[2] == pytest.approx(359.75)
+
+
+def test_state_past_the_end_is_none():
+    lap = record(straight(120))
+    assert lap.state_at(0.0) == pytest.approx((100.0, 100.0, 0.0))
+    assert lap.state_at(lap.lap_time) is not None
+    assert lap.state_at(lap.lap_time + 1 / TICK_RATE) is None
+
+
+def test_teleport_drops_the_lap():
+    states = straight(120)
+    # A respawn 3000 world pixels away does not fit an int16 delta of 1/16 pixel steps
+    states[60:] = [(x - 3000.0, y, direction) for x, y, direction in states[60:]]
+    assert record(states) is None
+    assert record(straight(120)) is not None
+
+
+def test_delta_is_positive_behind_the_ghost():
+    delta = LapDelta(record(straight(600)))
+    # Where the ghost was after 2 s (tick 119), reached 0.5 s later or 0.5 s sooner
+    assert delta.update(100.0 + 3.0 * 119, 100.0, 2.5) == pytest.approx(0.5)
+    delta = LapDelta(delta.lap)
+    assert delta.update(100.0 + 3.0 * 119, 100.0, 1.5) == pytest.approx(-0.5)
+
+
+def test_delta_finds_the_car_again_near_its_cursor():
+    delta = LapDelta(record(straight(1200)))
+    for k in range(120):
+        delta.update(100.0 + 3.0 * k, 100.0, (k + 1) / TICK_RATE)
+    cursor = delta.cursor
+
+    searched = []
+    nearest = delta._nearest
+
+    def logged(x, y, start, end):
+        searched.append(end - start)
+        return nearest(x, y, start, end)
+
+    delta._nearest = logged
+    # Two seconds far off the path: no delta, the cursor waits where the car left
+    for k in range(120, 240):
+        assert delta.update(100.0 + 3.0 * k, 600.0, (k + 1) / TICK_RATE) is None
+    assert delta.cursor == cursor
+    assert max(searched) <= 3 * delta.search + delta.ahead + delta.behind
+
+    # Back on the path further on, a second behind the ghost
+    assert delta.update(100.0 + 3.0 * 200, 100.0, 1.0 + 201 / TICK_RATE) == pytest.approx(1.0)
+    assert delta.cursor == 200
+    assert delta.update(100.0 + 3.0 * 201, 100.0, 1.0 + 202 / TICK_RATE) == pytest.approx(1.0)
@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+
+import pytest
+
+import netcode
+from car_physics import CarControls
+from lan_server import RaceServer
+from lan_client import RaceClient
+
+MAP_NAME = "trees_at_qatar"
+TICKS = 600
+
+
+@pytest.fixture
+def server():
+    server = RaceServer(MAP_NAME, "127.0.0.1", 0, tick_rate=60, snapshot_rate=60)
+    yield server
+    server.close()
+
+
+def join(server, count, **options):
+    """count clients joining from threads while the server answers from this one."""
+    clients = [None] * count
+    errors = []
+
+    def connect(i):
+        try:
+            clients[i] = RaceClient(server.address, car_index=i % 2, seed=i, **options)
+        except ConnectionError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=connect, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        server.step()
+        time.sleep(0.001)
+    if errors:
+        raise errors[0]
+    return clients
+
+
+def race(server, clients, ticks=TICKS):
+    """
+    Every client holds random keys for a while, the server and the clients
+    take turns each tick. Yields after every tick.
+    """
+    rng = random.Random(0)
+    held = [CarControls(True, False, False, False)] * len(clients)
+    for _ in range(ticks):
+        for i, client in enumerate(clients):
+            if rng.random() < 0.03:
+                held[i] = CarControls(rng.random() < 0.85, rng.random() < 0.1, rng.random() < 0.3, rng.random() < 0.3)
+            client.send_input(held[i])
+        server.step()
+        for client in clients:
+            client.poll()
+        yield
+
+
+@pytest.mark.parametrize("packet_loss", [0.0, 0.2])
+def test_clients_decode_the_server_snapshots(server, packet_loss):
+    clients = join(server, 3, packet_loss=packet_loss)
+    try:
+        for _ in race(server, clients):
+            if packet_loss == 0.0:
+                # Nothing is lost on loopback, so every client holds the state the server has right now
+                for client in clients:
+                    assert client.latest_tick == server.tick
+                    assert client.buffer[-1][1] == server.fixed_cars()
+
+        for client in clients:
+            compared = 0
+            for tick, cars in client.received.items():
+                if tick in server.history:
+                    assert cars == server.history[tick]
+                    compared += 1
+            assert compared > 0
+            assert client.snapshots < TICKS if packet_loss else client.snapshots >= TICKS
+            # A delta whose baseline was lost is dropped, which only happens after lost snapshots
+            assert client.missing_baselines <= packet_loss * client.snapshots
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_ninth_player_is_rejected(server):
+    clients = join(server, netcode.MAX_PLAYERS)
+    try:
+        with pytest.raises(ConnectionError, match=netcode.REJECT_REASONS[netcode.REJECT_FULL]):
+            join(server, 1)
+    finally:
+        for client in clients:
+            client.close()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from conftest import ring_surfaces
+from progress_field import ProgressField, RaceProgress
+
+DT = 1 / 60
+
+
+@pytest.fixture
+def field(line_cache):
+    return ProgressField.for_mask(ring_surfaces(), 1)
+
+
+def lap_points(field, fractions):
+    """(xs, ys, directions) of centerline samples at fractions of the lap, wrapped into one lap."""
+    line = field.line
+    indices = np.searchsorted(line.distance, np.asarray(fractions) % 1.0 * field.length).clip(0, len(line) - 1)
+    return line.center[indices, 0], line.center[indices, 1], field.direction[indices]
+
+
+def drive(progress, field, start, end, ticks=200):
+    """Moves every car along the centerline from its start fraction to its end fraction."""
+    for t in np.linspace(0, 1, ticks):
+        progress.update(DT, *lap_points(field, np.asarray(start) + (np.asarray(end) - np.asarray(start)) * t))
+
+
+def test_progress_wraps_across_the_start_line(field):
+    # From just behind the start line into the next lap
+    progress = RaceProgress(field, *lap_points(field, [0.9])[:2])
+    drive(progress, field, [0.9], [1.2])
+    assert progress.covered[0] == pytest.approx(0.3 * field.length, abs=8)
+
+
+def test_respawn_takes_the_way_back_off_the_progress(field):
+    spawn = lap_points(field, [0.95])
+    progress = RaceProgress(field, *lap_points(field, [0.0, 0.0])[:2])
+    drive(progress, field, [0.0, 0.0], [0.59, 0.69])
+    assert progress.positions().tolist() == [2, 1]
+
+    # Car 0 crashed and is put back behind the start line, car 1 drives on
+    xs, ys, directions = lap_points(field, [0.59, 0.7])
+    xs[0], ys[0], directions[0] = spawn[0][0], spawn[1][0], spawn[2][0]
+    progress.respawn([0], xs[:1], ys[:1])
+    progress.update(DT, xs, ys, directions)
+
+    assert progress.covered[0] == pytest.approx(-0.05 * field.length, abs=8)
+    assert progress.positions().tolist() == [2, 1]
+
+    # Driving from the spawn over the start line counts again
+    drive(progress, field, [0.95, 0.7], [1.1, 0.75])
+    assert progress.covered[0] == pytest.approx(0.1 * field.length, abs=8)
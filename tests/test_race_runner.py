@@ -0,0 +1,24 @@
+from race_runner import run_replay, laps_match
+from replay import Replay
+
+MAX_TICKS = 20000
+
+
+def test_replay_reproduces_the_live_race(start_race, tmp_path):
+    """A race recorded in the game and simulated again by race_runner ends the same, to the last bit."""
+    path = tmp_path / "race.json"
+    driver = start_race(0, record_path=str(path))  # "track", one lap
+    game = driver.game
+    for _ in range(MAX_TICKS):
+        driver.tick(driver.autopilot())
+        if game.race_manager.is_race_finished:
+            break
+    assert game.race_manager.is_race_finished
+
+    replay = Replay.load(str(path))
+    result = run_replay(replay, keep_trajectory=True)
+    assert result.finished
+    assert result.ticks == len(replay) == game.tick
+    assert result.lap_times == game.race_manager.lap_times
+    assert laps_match(replay, result)
+    assert result.trajectory[-1] == (game.car.x, game.car.y, game.car.direction)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import racing_line
+from conftest import ring_surfaces, strip_surfaces
+from racing_line import RacingLine
+
+SCALE = 2
+
+
+def distance_at(line, x, y):
+    """Distance along the centerline of the sample nearest to mask pixel x, y."""
+    center = line.center / SCALE
+    return line.distance[np.argmin(np.hypot(center[:, 0] - x, center[:, 1] - y))]
+
+
+@pytest.mark.parametrize("surfaces, closed, markings", [
+    # (x, y) in the middle of the start line, the checkpoint and the finish line
+    (ring_surfaces(), True, ((61, 20), (61, 100), (41, 20))),
+    (strip_surfaces(), False, ((31, 20), (61, 20), (89, 20))),
+])
+def test_line_runs_from_start_over_checkpoint_to_finish(line_cache, surfaces, closed, markings):
+    line = RacingLine.for_mask(surfaces, SCALE)
+    assert line.closed == closed
+    assert (np.diff(line.distance) > 0).all()
+    assert line.length >= line.distance[-1]
+    start, checkpoint, finish = (distance_at(line, x, y) for x, y in markings)
+    assert start < checkpoint < finish
+    # Every sample lies on the road
+    px, py = np.floor(line.center / SCALE).astype(int).T
+    assert (racing_line.drivable_pixels(surfaces)[py, px]).all()
+
+
+def test_second_line_of_a_mask_comes_from_the_cache(line_cache, monkeypatch):
+    surfaces = ring_surfaces()
+    first = RacingLine.for_mask(surfaces, SCALE)
+    assert len(list(line_cache.glob("racing_line_*.npz"))) == 1
+
+    def extract_line(surfaces):
+        raise AssertionError("The racing line was extracted again")
+
+    monkeypatch.setattr(racing_line, "extract_line", extract_line)
+    second = RacingLine.for_mask(surfaces, SCALE)
+    for name in RacingLine.FIELDS:
+        assert np.array_equal(getattr(first, name), getattr(second, name))
+
+    # Another mask is another cache file
+    with pytest.raises(AssertionError):
+        RacingLine.for_mask(strip_surfaces(), SCALE)
@@ -0,0 +1,90 @@
+import pytest
+
+from score_store import ScoreStore, UNKNOWN_CAR
+
+MAPS = ["track", "trees_at_qatar", "trees_at_batangas", "donut"]
+
+
+@pytest.fixture
+def open_store(tmp_path):
+    """open_store() opens a ScoreStore on tmp_path/scores.db, every one of them is closed after the test."""
+    stores = []
+
+    def open_store():
+        stores.append(ScoreStore(str(tmp_path / "scores.db")))
+        return stores[-1]
+
+    yield open_store
+    for store in stores:
+        store.close()
+
+
+def test_runs_are_written_in_the_background(open_store):
+    store = open_store()
+    assert store.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    store.add_run("track", "car_a", 31.0, [15.0, 16.0])
+    store.add_run("track", "car_b", 29.5, [14.0, 15.5])
+    store.add_run("track", "car_a", 30.0, [14.5, 15.5])
+    store.add_run("donut", "car_a", 20.0, [13.5, 6.5])
+    store.flush()
+
+    assert store.top_runs("track") == [
+        (29.5, "car_b", [14.0, 15.5]), (30.0, "car_a", [14.5, 15.5]), (31.0, "car_a", [15.0, 16.0]),
+    ]
+    assert store.top_runs("track", n=2, car_name="car_a") == [(30.0, "car_a", [14.5, 15.5]), (31.0, "car_a", [15.0, 16.0])]
+    assert store.best_run("donut") == (20.0, "car_a", [13.5, 6.5])
+    assert store.best_run("trees_at_qatar") is None
+    assert store.best_lap("track") == 14.0
+    assert store.best_lap("track", "car_a") == 14.5
+    assert store.best_lap("trees_at_qatar") is None
+
+
+def test_best_ghost_is_the_fastest_lap_of_the_map(open_store):
+    store = open_store()
+    assert store.best_ghost("track") is None
+    store.add_ghost("track", "car_a", 15.0, b"slow")
+    store.add_ghost("track", "car_b", 14.0, b"fast")
+    store.add_ghost("donut", "car_a", 6.0, b"other map")
+    store.flush()
+    assert store.best_ghost("track") == ("car_b", 14.0, b"fast")
+
+
+def test_score_file_is_imported_once(open_store, tmp_path):
+    path = tmp_path / "score.txt"
+    path.write_text("[[30.0, 14.0, 16.0], [], [50.0, 25.0, 25.0]]", encoding="utf-8")
+
+    store = open_store()
+    assert store.migrate_score_file(str(path), MAPS) == 2
+    assert store.migrate_score_file(str(path), MAPS) == 0
+    # A game started later finds the import done in the database
+    assert open_store().migrate_score_file(str(path), MAPS) == 0
+
+    assert store.top_runs("track") == [(30.0, UNKNOWN_CAR, [14.0, 16.0])]
+    assert store.top_runs("trees_at_qatar") == []
+    assert store.top_runs("trees_at_batangas") == [(50.0, UNKNOWN_CAR, [25.0, 25.0])]
+
+
+def test_unreadable_score_file_imports_nothing(open_store, tmp_path, capsys):
+    path = tmp_path / "score.txt"
+    path.write_text("[[30.0, 14.0", encoding="utf-8")
+    store = open_store()
+    assert store.migrate_score_file(str(path), MAPS) == 0
+    assert "Warning: Could not read" in capsys.readouterr().out
+    assert store.top_runs("track") == []
+    assert store.migrate_score_file(str(tmp_path / "missing.txt"), MAPS) == 0
+
+
+def test_two_games_write_at_the_same_time(open_store):
+    first, second = open_store(), open_store()
+    for i in range(50):
+        first.add_run("track", "car_a", 40.0 + i, [20.0, 20.0 + i])
+        second.add_run("track", "car_b", 40.5 + i, [20.0, 20.5 + i])
+    first.flush()
+    second.flush()
+
+    for store in (first, second):
+        runs = store.top_runs("track", n=1000)
+        assert len(runs) == 100
+        assert [total_time for total_time, _, _ in runs] == sorted(total_time for total_time, _, _ in runs)
+        assert sum(car == "car_b" for _, car, _ in runs) == 50
@@ -0,0 +1,40 @@
+import numpy as np
+
+from car_physics import CarControls
+
+ROLLBACK_TICKS = 250
+
+
+def assert_same(a, b):
+    """Equal to the last bit, through the namedtuples, tuples and arrays of a RaceSnapshot."""
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        assert np.array_equal(a, b)
+    elif isinstance(a, tuple):
+        assert type(a) is type(b) and len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    else:
+        assert a == b
+
+
+def test_rollback_repeats_the_race_exactly(start_race):
+    """Restoring a snapshot and simulating the same input again ends in the same state, walls and AI cars included."""
+    driver = start_race(1, opponents=5)  # trees_at_qatar
+    game = driver.game
+    inputs = []
+    collisions = 0
+    for tick in range(900):
+        # The AI drives, then the car is steered hard into the wall for a while
+        controls = driver.autopilot() if tick < 700 else CarControls(True, False, True, False)
+        inputs.append(controls)
+        driver.tick(controls)
+        collisions += game.car.physics.collision_frames > 0
+    assert collisions > 0
+    expected = game.snapshot()
+
+    start = game.tick - ROLLBACK_TICKS
+    game.restore(game.snapshots.at(start))
+    assert game.tick == start
+    for controls in inputs[start:]:
+        driver.tick(controls)
+    assert_same(game.snapshot(), expected)